@@ -0,0 +1,72 @@
+"""Benchmark :py:func:`cdata.alloc` on linked lists of increasing length.
+
+Each list node is a struct containing a value and a pointer to the next node
+(i.e. three instances per node). The time taken per instance should remain
+roughly constant as the number of instances grows, i.e. allocation should scale
+linearly.
+
+Usage (from the root of the repository, with cdata installed e.g. using ``pip
+install -e .``)::
+    
+    python benchmarks/benchmark_alloc.py [max_instances]
+
+Alternatively, to run the benchmark against the working copy without
+installing it::
+    
+    PYTHONPATH=. python benchmarks/benchmark_alloc.py [max_instances]
+"""
+
+import sys
+
+import time
+
+import cdata
+
+
+def linked_list(num_nodes):
+    """Create a linked list with the specified number of nodes, returning the
+    first node."""
+    next_pointer = cdata.Pointer(cdata.char)
+    node = cdata.Struct("list_node",
+                        ("value", cdata.unsigned_int),
+                        ("next", next_pointer))
+    next_pointer.base_type = node
+    next_pointer.name = "struct list_node*"
+    
+    first = last = node()
+    for _ in range(num_nodes - 1):
+        last.next.deref = node()
+        last = last.next.deref
+    return first
+
+
+def benchmark(num_instances):
+    """Return the time taken to allocate (and then re-allocate at a new
+    address) a linked list made up of the specified number of instances."""
+    first = linked_list(num_instances // 3)
+    
+    before = time.perf_counter()
+    cdata.alloc(first, 0x1000)
+    alloc_time = time.perf_counter() - before
+    
+    before = time.perf_counter()
+    cdata.alloc(first, 0x2000)
+    realloc_time = time.perf_counter() - before
+    
+    return alloc_time, realloc_time
+
+
+def main(max_instances=1000000):
+    print("{:>10}  {:>10}  {:>10}  {:>14}".format(
+        "instances", "alloc (s)", "again (s)", "us/instance"))
+    num_instances = 1000
+    while num_instances <= max_instances:
+        alloc_time, realloc_time = benchmark(num_instances)
+        print("{:>10}  {:>10.3f}  {:>10.3f}  {:>14.2f}".format(
+            num_instances, alloc_time, realloc_time,
+            alloc_time * 1e6 / num_instances))
+        num_instances *= 10
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
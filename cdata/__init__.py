@@ -18,7 +18,7 @@ from cdata.pointer import Pointer, pointer
 
 from cdata.struct import Struct
 
-from cdata.union import Union
+from cdata.union import Union, TaggedUnion
 
 from cdata.array import Array
 
@@ -26,4 +26,8 @@ from cdata.exceptions import PointerToUndefinedMemoryAddress
 
 from cdata.header_file import to_header
 
-from cdata.alloc import total_size, alloc
+from cdata.alloc import total_size, alloc, Allocator
+
+from cdata.image import Image, pack_image, write_image, load_image
+
+from cdata.base import deferred_updates
@@ -1,6 +1,10 @@
 """Utilities for allocating addresses/memory to cdata instances."""
 
-from six import integer_types
+from bisect import bisect_left
+
+from six import integer_types, iteritems
+
+from cdata.base import deferred_updates
 
 def total_size(instance):
     """Calculate the total storage required (in bytes) to store the supplied set
@@ -9,7 +13,7 @@ def total_size(instance):
     return sum(i.size for i in instance.iter_instances())
 
 
-def alloc(instance, start_at):
+def alloc(instance, start_at, section=None, aligned=False, min_alignment=1):
     """Allocate non-overlapping addresses to all supplied instances.
     
     Parameters
@@ -17,20 +21,283 @@ def alloc(instance, start_at):
     instance : :py:class:`cdata.base.Instance`
         The instance (along with all other accessible instances) to allocate a
         non-overlapping address to. This instance (or its container) will be
-        given the address start_at.
-    start_at : int
+        given the address start_at (or the first suitably aligned address
+        after it).
+    start_at : int or {section_name: int, ...}
         The first instance listed will be
         allocated this address and all other instances will be allocated
         addresses after this point.
+        
+        Alternatively, instances may be allocated in several named sections
+        (e.g. one for constant lookup tables and another for mutable state),
+        in which case this gives the address at which each section starts.
+    section : function or None
+        Required if sections are used. A function which, given a (top-level)
+        instance, returns the name of the section it is to be allocated in.
+    aligned : bool
+        If True, every instance is allocated at a multiple of the natural
+        alignment of its type (see :py:attr:`.DataType.alignment`). Otherwise
+        (the default) instances are allocated back-to-back.
+    min_alignment : int
+        Every instance is allocated at a multiple of this many bytes.
+        (Default: 1).
     
     Returns
     -------
-    int
-        The next free address after the allocation completes.
+    int or {section_name: int, ...}
+        The next free address after the allocation completes (in each
+        section, if sections are used).
+    
+    Raises
+    ------
+    ValueError
+        If sections are used without a section function, an instance is
+        placed in a section with no start address or the minimum alignment is
+        not positive.
+    
+    Notes
+    -----
+    The layout of all instances is computed in a single pass and then applied
+    without sending any notifications. Afterwards, the referrers (e.g.
+    pointers) of every moved instance are informed of its new address with
+    value change notifications deferred (see :py:func:`.deferred_updates`) so
+    that the containers of those referrers are each notified just once.
+    Instances which are already at their allocated address are left untouched.
+    As a result, allocation takes time linear in the number of instances.
+    
+    To allocate addresses to a data structure which changes over time without
+    moving every instance, use an :py:class:`.Allocator`.
+    """
+    allocator = Allocator(start_at, section, aligned, min_alignment)
+    allocator.alloc(instance)
+    return allocator.next_address
+
+
+class Allocator(object):
+    """Allocates addresses to the instances of a data structure which changes
+    over time.
+    
+    Unlike :py:func:`.alloc`, which allocates addresses to every instance
+    afresh, an Allocator remembers the address ranges it has allocated. Each
+    call to :py:meth:`.alloc` only allocates addresses to instances which have
+    become reachable since the previous call and frees the ranges of those
+    which are no longer reachable. Instances which remain reachable keep their
+    addresses and so, after a small change to a data structure, only the
+    instances which have changed need to be re-packed.
+    
+    Freed ranges are kept in a (coalesced) free list for each section and are
+    reused, first-fit, before any space after the end of the section.
+    
+    Example::
+        
+        allocator = Allocator(0x1000)
+        allocator.alloc(root)
+        
+        # ...modify the data structure reachable from root...
+        
+        for instance in allocator.alloc(root):
+            print("{} allocated at 0x{:X}".format(instance, instance.address))
     """
-    address = start_at
-    for i in instance.iter_instances():
-        i.address = address
-        address += i.size
     
-    return address
+    def __init__(self, start_at, section=None, aligned=False, min_alignment=1):
+        """Create an allocator with nothing allocated.
+        
+        Parameters
+        ----------
+        start_at : int or {section_name: int, ...}
+            The address at which to start allocating or, if instances are
+            allocated in several named sections, the address at which each
+            section starts.
+        section : function or None
+            Required if sections are used. A function which, given a
+            (top-level) instance, returns the name of the section it is to be
+            allocated in.
+        aligned : bool
+            If True, every instance is allocated at a multiple of the natural
+            alignment of its type (see :py:attr:`.DataType.alignment`).
+            Otherwise (the default) instances are allocated back-to-back.
+        min_alignment : int
+            Every instance is allocated at a multiple of this many bytes.
+            (Default: 1).
+        
+        Raises
+        ------
+        ValueError
+            If sections are used without a section function or the minimum
+            alignment is not positive.
+        """
+        if min_alignment < 1:
+            raise ValueError("minimum alignment must be at least 1")
+        
+        if isinstance(start_at, integer_types):
+            if section is not None:
+                raise ValueError(
+                    "a start address must be given for each section")
+            self._next_addresses = {None: start_at}
+        else:
+            if section is None:
+                raise ValueError("a section function is required")
+            self._next_addresses = dict(start_at)
+        
+        self._section = section
+        self._aligned = aligned
+        self._min_alignment = min_alignment
+        
+        # The free address ranges below the next address of each section,
+        # sorted by address and with adjacent ranges merged.
+        # {section_name: [(start, end), ...], ...}
+        self._free_ranges = {name: [] for name in self._next_addresses}
+        
+        # The allocation made for each allocated instance.
+        # {instance: (section_name, address), ...}
+        self._allocations = {}
+        
+        # Cache of alignments of each type encountered. Types are identified by
+        # object since the names of types do not uniquely identify their
+        # layout (e.g. 32- and 64-bit pointers to a type share a name). The
+        # type is retained to ensure its id is not reused.
+        # {id(data_type): (data_type, alignment), ...}
+        self._alignments = {}
+    
+    @property
+    def next_address(self):
+        """The address after the highest allocation (in each section, if
+        sections are used)."""
+        if self._section is None:
+            return self._next_addresses[None]
+        else:
+            return dict(self._next_addresses)
+    
+    def alloc(self, instance):
+        """Allocate addresses to any newly reachable instances and free those
+        which are no longer reachable.
+        
+        Instances whose address has been changed since it was allocated are
+        allocated afresh.
+        
+        Parameters
+        ----------
+        instance : :py:class:`cdata.base.Instance`
+            The instance via which all instances to be allocated are reachable
+            (see :py:meth:`.Instance.iter_instances`).
+        
+        Returns
+        -------
+        [:py:class:`cdata.base.Instance`, ...]
+            The instances which were allocated an address by this call.
+        
+        Raises
+        ------
+        ValueError
+            If an instance is placed in a section with no start address.
+        """
+        reachable = list(instance.iter_instances())
+        reachable_set = set(reachable)
+        
+        # Free the ranges of instances which are no longer reachable (or have
+        # been moved) first so that the space may be reused immediately.
+        for i, (i_section, address) in list(iteritems(self._allocations)):
+            if i not in reachable_set or i._address != address:
+                self._free(i_section, address, i.size)
+                del self._allocations[i]
+        
+        # Allocate addresses to the new instances
+        allocated = []
+        for i in reachable:
+            if i not in self._allocations:
+                i_section = None if self._section is None else self._section(i)
+                if i_section not in self._next_addresses:
+                    raise ValueError(
+                        "no start address given for section {}".format(
+                            repr(i_section)))
+                address = self._allocate(i_section, i.size,
+                                         self._alignment(i.data_type))
+                self._allocations[i] = (i_section, address)
+                allocated.append(i)
+        
+        # Apply the allocation. Since only top-level instances are listed,
+        # nothing contains the instances being moved and so no notifications
+        # are required until the referrers are informed below.
+        moved = []
+        for i in allocated:
+            address = self._allocations[i][1]
+            if i._address != address:
+                i._address = address
+                moved.append(i)
+        
+        # Reconcile
+        with deferred_updates():
+            for i in moved:
+                i._addresses_changed()
+        
+        return allocated
+    
+    def _alignment(self, data_type):
+        """Get the alignment required for instances of the given type."""
+        alignment = self._min_alignment
+        if self._aligned:
+            cached = self._alignments.get(id(data_type))
+            if cached is None:
+                cached = (data_type, data_type.alignment)
+                self._alignments[id(data_type)] = cached
+            alignment = _lcm(alignment, cached[1])
+        return alignment
+    
+    def _allocate(self, section, size, alignment):
+        """Allocate a range of addresses in a section, returning its start."""
+        # Use the first free range which is large enough
+        free_ranges = self._free_ranges[section]
+        for index, (start, end) in enumerate(free_ranges):
+            address = start + (-start % alignment)
+            if address + size <= end:
+                # Return any unused parts of the range to the free list
+                remainder = []
+                if start < address:
+                    remainder.append((start, address))
+                if address + size < end:
+                    remainder.append((address + size, end))
+                free_ranges[index:index + 1] = remainder
+                return address
+        
+        # Otherwise allocate after the end of the section (note that space
+        # skipped to align the range is not added to the free list)
+        address = self._next_addresses[section]
+        address += -address % alignment
+        self._next_addresses[section] = address + size
+        return address
+    
+    def _free(self, section, address, size):
+        """Add a previously allocated range to a section's free list."""
+        if size == 0:
+            return
+        end = address + size
+        
+        # Merge with any adjacent free ranges
+        free_ranges = self._free_ranges[section]
+        index = bisect_left(free_ranges, (address, ))
+        if index > 0 and free_ranges[index - 1][1] == address:
+            index -= 1
+            address = free_ranges.pop(index)[0]
+        if index < len(free_ranges) and free_ranges[index][0] == end:
+            end = free_ranges.pop(index)[1]
+        
+        if end == self._next_addresses[section]:
+            # Ranges at the end of the section are returned to the section
+            self._next_addresses[section] = address
+        else:
+            free_ranges.insert(index, (address, end))
+
+
+def _gcd(a, b):
+    """Greatest common divisor of two positive integers.
+    
+    (math.gcd is not available before Python 3.5.)
+    """
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _lcm(a, b):
+    """Lowest common multiple of two positive integers."""
+    return a * b // _gcd(a, b)
@@ -1,13 +1,23 @@
 """An array type."""
 
-from six import integer_types
+import array
 
-from cdata.base import DataType, Instance
+import struct
+
+import sys
+
+from six import integer_types, iteritems, itervalues
+
+from cdata.base import DataType, Instance, _apply_pending_updates
 
 from cdata.endianness import Endianness
 
 from cdata.primitive import Primitive
 
+from cdata.utils import empty_iterable
+
+from cdata.view import ArrayView
+
 class Array(DataType):
     """Defines an array of a particular type.
     
@@ -35,12 +45,70 @@ class Array(DataType):
         # Arrays are native since they're a basic part of the language.
         super(Array, self).__init__(name, True, doc)
     
+    _has_packed_cache = True
+    
     def __call__(self, values=[]):
-        return ArrayInstance(self, values)
+        if (isinstance(self.base_type, Primitive) and
+                self.base_type.struct_format in PRIMITIVE_ARRAY_TYPECODES):
+            return PrimitiveArrayInstance(self, values)
+        else:
+            return ArrayInstance(self, values)
     
     def declare(self, identifier=""):
         return "{}[{}]".format(self.base_type.declare(identifier), self.length)
     
+    @property
+    def _flat_format(self):
+        base_format = self.base_type._flat_format
+        if base_format is None:
+            return None
+        elif len(base_format) == 1 and base_format not in "sp":
+            # Single-item formats can use the compact repeat-count syntax
+            # (note that for "s" and "p" the count means something else).
+            return "{}{}".format(self.length, base_format)
+        else:
+            return base_format * self.length
+    
+    @property
+    def size(self):
+        return self.length * self.base_type.size
+    
+    @property
+    def alignment(self):
+        return self.base_type.alignment
+    
+    def view(self, buffer, offset=0, endianness=Endianness.little):
+        """Get a lightweight view of an array of this type packed in the
+        supplied buffer.
+        
+        See :py:meth:`.ComplexType.view`.
+        
+        Returns
+        -------
+        :py:class:`.ArrayView`
+        """
+        return ArrayView(self, buffer, offset, endianness)
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype((self.base_type.to_numpy_dtype(endianness),
+                            (self.length, )))
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self.view(buffer, offset, endianness)
+    
+    def _decode(self, values):
+        return self.base_type._decode_many(values, self.length)
+    
+    def _encode(self, value, values):
+        if len(value) != self.length:
+            raise ValueError("expected {} values for {}, got {}".format(
+                self.length, repr(self), len(value)))
+        
+        encode = self.base_type._encode
+        for element_value in value:
+            encode(element_value, values)
+    
     def iter_types(self, _generated=None):
         if _generated is None:
             _generated = set()
@@ -56,51 +124,39 @@ class Array(DataType):
 class ArrayInstance(Instance):
     """An instance of an array."""
     
+    __slots__ = ("_ignore_child_value_changed", "_packed", "_instances")
+    
     def __init__(self, data_type, values=[]):
         assert isinstance(data_type, Array)
         
         # Used to suppress value changed notifications while unpacking the array
         self._ignore_child_value_changed = False
         
+        # The packed form of the array for each endianness it has been packed
+        # with since it last changed (or None until it is first packed).
+        self._packed = None
+        
         # The internal array of instances, one for each array element.
         self._instances = [None] * data_type.length
         
         super(ArrayInstance, self).__init__(data_type)
         
+        # Add the supplied default values and initialise the others with
+        # defaults
+        self._set_initial_values(values)
+        for i in range(len(values), self.data_type.length):
+            self[i] = self.data_type.base_type()
+    
+    def _set_initial_values(self, values):
+        """Set the first elements of the array to the supplied instances."""
         # Make sure not too many default values are provided
         if len(values) > self.data_type.length:
-            raise ValueError("too many ({}) values supplied for {}-entry array.".format(
-                len(values), self.data_type.length))
+            raise ValueError(
+                "too many ({}) values supplied for {}-entry array.".format(
+                    len(values), self.data_type.length))
         
-        # Add the supplied default values
         for i, instance in enumerate(values):
             self[i] = instance
-        
-        # Initialise the others with defaults
-        for i in range(len(values), self.data_type.length):
-            self[i] = self.data_type.base_type()
-    
-    
-    @property
-    def address(self):
-        return self._address
-    
-    @address.setter
-    def address(self, address):
-        self._address = address
-        
-        # Update all instance addresses
-        for instance in self:
-            # During initialisation not all instances will have a value so
-            # simply terminate.
-            if instance is None:
-                break
-            
-            instance.address = address
-            if address is not None:
-                address += instance.size
-        
-        self._address_changed()
     
     def __len__(self):
         return self.data_type.length
@@ -108,20 +164,18 @@ class ArrayInstance(Instance):
     def __iter__(self):
         return iter(self._instances)
     
-    def __getitem__(self, key):
-        """Get the instance at a particular position in the array."""
-        # Check in range
+    def _check_key(self, key):
+        """Check the index is in range and return the non-negative index."""
         if key >= len(self) or key < -len(self):
             raise IndexError("array index {} out of range".format(key))
         
-        return self._instances[key]
-    
-    def __setitem__(self, key, instance):
-        """Set the instance at the specified position in the array."""
-        # Check in range
-        if key >= len(self) or key < -len(self):
-            raise IndexError("array index {} out of range".format(key))
+        if key < 0:
+            key += len(self)
         
+        return key
+    
+    def _check_element(self, instance):
+        """Check an instance may be placed in the array."""
         # Check the type
         if (not hasattr(instance, "data_type") or
                 instance.data_type != self.data_type.base_type):
@@ -131,12 +185,22 @@ class ArrayInstance(Instance):
         # Check the instance isn't already in a container
         if instance._container is not None:
             raise ValueError("instance is already a member of a container")
+    
+    def __getitem__(self, key):
+        """Get the instance at a particular position in the array."""
+        return self._instances[self._check_key(key)]
+    
+    def __setitem__(self, key, instance):
+        """Set the instance at the specified position in the array."""
+        key = self._check_key(key)
+        self._check_element(instance)
         
         # Set the element's address
-        if self.address is None:
+        address = self.address
+        if address is None:
             instance.address = None
         else:
-            instance.address = self.address + (instance.size * key)
+            instance.address = address + (self.data_type.base_type.size * key)
         
         # If there was previously an instance here, remove this array as its
         # container.
@@ -146,39 +210,36 @@ class ArrayInstance(Instance):
         self._instances[key] = instance
         
         # We are now the instance's parent, add it to the list
+        instance._container_key = key
         instance._container = self
         
         # The array has now been changed, inform any parents
+        self._packed = None
         self._value_changed()
     
     def _child_value_changed(self, child):
+        self._packed = None
         if not self._ignore_child_value_changed:
-            self._value_changed()
+            self._deferrable_value_changed()
     
     def _child_address_changed(self, child):
         # Simply verify that the new address is appropriate, if not fail and
         # revert the address.
-        if self.address is None:
-            address = None
-        else:
-            key = self._instances.index(child)
-            address = self.address + (key * child.size)
-        
-        if child.address != address:
+        address = self._child_address(child)
+        if child._address != address:
             # If the address is bad, fix it and throw an error.
-            child.address = address
+            child._address = address
             raise ValueError("The address of {} is defined by its "
                              "containing array, {}, as {}".format(
                                  repr(child), repr(self), self.address))
     
-    @property
-    def size(self):
-        if self.data_type.length == 0:
-            # We need an instance to know the size of a type but an array of
-            # length zero is always of size 0.
-            return 0
+    def _child_address(self, child):
+        address = self.address
+        if address is None:
+            return None
         else:
-            return self.data_type.length * self._instances[0].size
+            return address + (child._container_key *
+                              self.data_type.base_type.size)
     
     @property
     def literal(self):
@@ -186,13 +247,73 @@ class ArrayInstance(Instance):
         return "{{{}}}".format(", ".join(i.literal for i in self._instances))
     
     def pack(self, endianness=Endianness.little):
-        return b"".join(i.pack(endianness) for i in self._instances)
+        # Make sure the cache reflects any deferred changes
+        _apply_pending_updates()
+        
+        if self._packed is None:
+            self._packed = {}
+        packed = self._packed.get(endianness)
+        if packed is None:
+            codec = self.data_type.codec(endianness)
+            if codec is None or self.data_type.base_type._has_packed_cache:
+                # Concatenate the (possibly cached) packed elements
+                packed = b"".join(instance.pack(endianness)
+                                  for instance in self._instances)
+            else:
+                values = []
+                self._flatten(values)
+                packed = codec.pack(*values)
+            self._packed[endianness] = packed
+        return packed
     
     def unpack(self, data, endianness=Endianness.little):
+        self.unpack_from(data, 0, endianness)
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        _apply_pending_updates()
+        
+        packed = None if self._packed is None else self._packed.get(endianness)
+        if packed is not None:
+            buffer[offset:offset + self.size] = packed
+            return
+        
+        codec = self.data_type.codec(endianness)
+        if codec is None or self.data_type.base_type._has_packed_cache:
+            # Pack each element in place (using any cached packed elements)
+            element_size = self.data_type.base_type.size
+            for instance in self._instances:
+                instance.pack_into(buffer, offset, endianness)
+                offset += element_size
+        else:
+            values = []
+            self._flatten(values)
+            codec.pack_into(buffer, offset, *values)
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        codec = self.data_type.codec(endianness)
+        if codec is not None:
+            self._unflatten(iter(codec.unpack_from(buffer, offset)))
+            return
+        
         self._ignore_child_value_changed = True
+        element_size = self.data_type.base_type.size
         for instance in self._instances:
-            this_data, data = data[:instance.size], data[instance.size:]
-            instance.unpack(this_data, endianness)
+            instance.unpack_from(buffer, offset, endianness)
+            offset += element_size
+        self._ignore_child_value_changed = False
+        
+        self._value_changed()
+    
+    def _flatten(self, values):
+        for instance in self._instances:
+            instance._flatten(values)
+    
+    def _unflatten(self, values):
+        self._ignore_child_value_changed = True
+        for instance in self._instances:
+            instance._unflatten(values)
         self._ignore_child_value_changed = False
         
         self._value_changed()
@@ -200,20 +321,270 @@ class ArrayInstance(Instance):
     def __str__(self):
         return "[{}]".format(", ".join(map(str, self._instances)))
     
-    def iter_instances(self, _generated=None):
-        if _generated is None:
-            _generated = set()
+    def _iter_children(self):
+        return iter(self._instances)
+
+
+def _find_typecode(struct_format, typecodes):
+    """Find the :py:mod:`array` typecode (from those given) whose item size
+    matches the standard size of the given :py:mod:`struct` format."""
+    size = struct.calcsize("<" + struct_format)
+    for typecode in typecodes:
+        if array.array(typecode).itemsize == size:
+            return typecode
+    raise ValueError(  # pragma: no cover
+        "no array typecode for struct format {}".format(struct_format))
+
+
+"""Mapping from primitive struct format character to a pair of array
+typecodes: the typecode used to hold the values of the array in memory and the
+typecode whose representation matches the packed form. (Floats are held as
+doubles so that element values are not rounded until they are packed, just as
+for :py:class:`.PrimitiveInstance`.)"""
+PRIMITIVE_ARRAY_TYPECODES = {
+    "c": ("B", "B"),
+    "?": ("B", "B"),
+    "f": ("d", "f"),
+    "d": ("d", "d"),
+}
+for _format in "bhilq":
+    _typecode = _find_typecode(_format, "bhilq")
+    PRIMITIVE_ARRAY_TYPECODES[_format] = (_typecode, _typecode)
+for _format in "BHILQ":
+    _typecode = _find_typecode(_format, "BHILQ")
+    PRIMITIVE_ARRAY_TYPECODES[_format] = (_typecode, _typecode)
+
+
+def _check_float(value):
+    """Check a float value can be packed as a (32-bit) float.
+    
+    Raises
+    ------
+    OverflowError
+        If the value is too large to pack (as when packing a
+        :py:class:`.PrimitiveInstance` of the same value).
+    """
+    struct.pack("<f", value)
+    return value
+
+
+"""Conversions from primitive values to the representation held in an array
+(and back again) where these differ."""
+_TO_STORED = {
+    "c": (lambda value: value[0]),
+    "f": _check_float,
+}
+_FROM_STORED = {
+    "c": (lambda value: bytes([value])),
+    "?": bool,
+}
+
+"""Normalisations applied to arrays of values unpacked from packed data where
+the packed form may hold values which the primitive would not pack (e.g. a
+_Bool byte other than 0 or 1)."""
+_NORMALISE_UNPACKED = {
+    "?": (lambda values: array.array("B", map(bool, values))),
+}
+
+
+class PrimitiveArrayInstance(ArrayInstance):
+    """An instance of an array of primitive values.
+    
+    Rather than holding a :py:class:`.PrimitiveInstance` for every element,
+    element values are held compactly in an :py:class:`array.array`. Element
+    instances are only created when an element is accessed (e.g. ``a[3]``) and
+    are then kept in sync with the array. Packing and unpacking are performed
+    as a single copy of the array's memory (byte-swapped if required).
+    
+    Note that iterating over the array (e.g. ``for element in a``) accesses,
+    and so creates an instance for, every element. Use :py:meth:`.iter_values`
+    to read the element values of a large array without creating instances.
+    """
+    
+    __slots__ = ("_typecode", "_packed_typecode", "_element_size",
+                 "_to_stored", "_from_stored", "_normalise_unpacked",
+                 "_element_instances", "_values")
+    
+    def __init__(self, data_type, values=[]):
+        assert isinstance(data_type.base_type, Primitive)
+        
+        struct_format = data_type.base_type.struct_format
+        self._typecode, self._packed_typecode = \
+            PRIMITIVE_ARRAY_TYPECODES[struct_format]
+        self._element_size = data_type.base_type.size
+        self._to_stored = _TO_STORED.get(struct_format, (lambda value: value))
+        self._from_stored = _FROM_STORED.get(struct_format,
+                                             (lambda value: value))
+        self._normalise_unpacked = _NORMALISE_UNPACKED.get(struct_format)
+        
+        # Not used by this class but retained for consistency with
+        # ArrayInstance.
+        self._ignore_child_value_changed = False
+        
+        # Element instances which have been created, indexed by position.
+        self._element_instances = {}
+        
+        # The element values, initially all the default value
+        default_value = self._to_stored(data_type.base_type()._value)
+        self._values = array.array(self._typecode,
+                                   [default_value]) * data_type.length
         
-        if self not in _generated:
-            # Iterate over this instance as usual (this will add self to
-            # _generated).
-            for ref in super(ArrayInstance, self).iter_instances(_generated):
-                yield ref
+        # Note: ArrayInstance's constructor is skipped since it would create an
+        # instance for every element.
+        Instance.__init__(self, data_type)
+        
+        # Add the supplied default values
+        self._set_initial_values(values)
+    
+    def _element_address(self, key):
+        """Get the address of the element at the specified (non-negative)
+        index."""
+        address = self.address
+        if address is None:
+            return None
+        else:
+            return address + (key * self._element_size)
+    
+    def _child_address(self, child):
+        return self._element_address(child._container_key)
+    
+    def __iter__(self):
+        for key in range(len(self)):
+            yield self[key]
+    
+    def iter_values(self):
+        """Iterate over the values of the array's elements without creating an
+        instance for each element.
+        
+        Returns
+        -------
+        iterator
+            The value of each element in turn (as would be given by
+            ``a[i].value``).
+        """
+        return (self._from_stored(value) for value in self._values)
+    
+    def __getitem__(self, key):
+        """Get the instance at a particular position in the array (creating it
+        if necessary)."""
+        key = self._check_key(key)
+        
+        instance = self._element_instances.get(key)
+        if instance is None:
+            instance = self.data_type.base_type()
+            instance._value = self._from_stored(self._values[key])
             
-            # Then iterate over the members (which notably will not list
-            # themselves since they are contained by this instance, but rather
-            # will include anything they reference).
-            for instance in self._instances:
-                for ref in instance.iter_instances(_generated):
-                    yield ref
-
+            self._element_instances[key] = instance
+            instance._container_key = key
+            instance._container = self
+        
+        return instance
+    
+    def __setitem__(self, key, instance):
+        """Set the instance at the specified position in the array."""
+        key = self._check_key(key)
+        self._check_element(instance)
+        
+        # Store the value first: this fails (leaving the array unchanged) if
+        # the value cannot be held by the array.
+        self._values[key] = self._to_stored(instance._value)
+        
+        # Set the element's address
+        instance.address = self._element_address(key)
+        
+        # If there was previously an instance here, remove this array as its
+        # container.
+        old_instance = self._element_instances.get(key)
+        if old_instance is not None:
+            old_instance._container = None
+        
+        self._element_instances[key] = instance
+        
+        # We are now the instance's parent
+        instance._container_key = key
+        instance._container = self
+        
+        # The array has now been changed, inform any parents
+        self._value_changed()
+    
+    def _child_value_changed(self, child):
+        key = child._container_key
+        try:
+            self._values[key] = self._to_stored(child._value)
+        except OverflowError:
+            # If the value cannot be held by the array, revert it and fail.
+            child._value = self._from_stored(self._values[key])
+            raise
+        self._deferrable_value_changed()
+    
+    def _values_changed(self):
+        """Update the element instances after the array's values have been
+        replaced and notify any parents."""
+        for key, instance in iteritems(self._element_instances):
+            instance._value = self._from_stored(self._values[key])
+        
+        self._value_changed()
+    
+    @property
+    def literal(self):
+        to_literal = self.data_type.base_type.to_literal
+        return "{{{}}}".format(", ".join(to_literal(self._from_stored(value))
+                                         for value in self._values))
+    
+    def _needs_byteswap(self, endianness):
+        return endianness.name != sys.byteorder and self._element_size > 1
+    
+    def _packed_values(self, endianness):
+        """Get an array whose memory holds the packed form of the array."""
+        if self._typecode != self._packed_typecode:
+            values = array.array(self._packed_typecode, self._values)
+        elif self._needs_byteswap(endianness):
+            values = array.array(self._typecode, self._values)
+        else:
+            return self._values
+        
+        if self._needs_byteswap(endianness):
+            values.byteswap()
+        return values
+    
+    def pack(self, endianness=Endianness.little):
+        return self._packed_values(endianness).tobytes()
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        buffer[offset:offset + self.size] = \
+            memoryview(self._packed_values(endianness)).cast("B")
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        values = array.array(self._packed_typecode)
+        values.frombytes(buffer[offset:offset + self.size])
+        if self._needs_byteswap(endianness):
+            values.byteswap()
+        if self._typecode != self._packed_typecode:
+            values = array.array(self._typecode, values)
+        if self._normalise_unpacked is not None:
+            values = self._normalise_unpacked(values)
+        
+        self._values = values
+        self._values_changed()
+    
+    def _flatten(self, values):
+        values.extend(map(self._from_stored, self._values))
+    
+    def _unflatten(self, values):
+        self._values = array.array(
+            self._typecode,
+            (self._to_stored(next(values)) for _ in range(len(self))))
+        self._values_changed()
+    
+    def __str__(self):
+        return "[{}]".format(", ".join(str(self._from_stored(value))
+                                       for value in self._values))
+    
+    def _iter_children(self):
+        return itervalues(self._element_instances)
+    
+    def _iter_related(self):
+        # Elements are primitives and so cannot refer to anything else.
+        return empty_iterable
@@ -1,5 +1,14 @@
 """The base classes for CData types."""
 
+import struct
+
+from contextlib import contextmanager
+
+from heapq import heappush, heappop
+
+from itertools import count
+
+from operator import itemgetter
 
 from cdata.exceptions import PointerToUndefinedMemoryAddress
 
@@ -7,6 +16,122 @@ from cdata.endianness import Endianness
 
 from cdata.utils import empty_iterable
 
+from cdata.view import View
+
+
+# While greater than zero, value change notifications passed up through
+# containers are deferred (see deferred_updates).
+_deferral_depth = 0
+
+# The containers with a deferred value change notification pending, mapped to
+# the sequence number of the most recent change they are to be notified of.
+_pending_updates = {}
+
+# A heap of (-nesting depth, order, instance) for the pending containers such
+# that the most deeply nested containers are notified first.
+_pending_heap = []
+_pending_order = count()
+
+# Sequence numbers identifying the order in which changes were made.
+_change_sequence_numbers = count()
+
+# The sequence number of the change whose deferred notification is being
+# delivered (or None).
+_delivered_sequence = None
+
+
+@contextmanager
+def deferred_updates():
+    """A context manager within which value change notifications are
+    deferred.
+    
+    Normally, changing the value of an instance immediately notifies every
+    container enclosing it (e.g. causing unions to re-synchronise their
+    members). Within this context, containers are instead marked as changed
+    and each one is notified just once when the (outermost) context exits,
+    making it much cheaper to change many values in a large tree of instances.
+    
+    Within this context, a change to a value nested within a union member
+    only reaches the union when the union is packed or accesses an
+    out-of-date member (or the context exits). Until then, the union's other
+    members do not reflect the change. When several members of a union are
+    changed, the value of the most recently changed member is used in its
+    entirety and earlier changes to other members are lost.
+    
+    This context is not thread-safe.
+    
+    Example::
+        
+        with deferred_updates():
+            for i, element in enumerate(my_array):
+                element.x.value = i
+    """
+    global _deferral_depth
+    _deferral_depth += 1
+    try:
+        yield
+    finally:
+        try:
+            if _deferral_depth == 1:
+                _apply_deferred_updates()
+        finally:
+            _deferral_depth -= 1
+
+
+@contextmanager
+def _immediate_updates():
+    """For internal use. A context manager within which value change
+    notifications are never deferred."""
+    global _deferral_depth
+    old_deferral_depth = _deferral_depth
+    _deferral_depth = 0
+    try:
+        yield
+    finally:
+        _deferral_depth = old_deferral_depth
+
+
+def _change_sequence():
+    """For internal use. Get a sequence number for the change currently being
+    reported.
+    
+    Changes reported while delivering a deferred notification share the
+    sequence number of the change which caused it.
+    """
+    if _delivered_sequence is None:
+        return next(_change_sequence_numbers)
+    else:
+        return _delivered_sequence
+
+
+def _apply_pending_updates():
+    """For internal use. Within a :py:func:`deferred_updates` context, deliver
+    any pending notifications before reading a value which depends on them."""
+    if _deferral_depth and _pending_updates:
+        _apply_deferred_updates()
+
+
+def _apply_deferred_updates():
+    """For internal use. Deliver any pending deferred value change
+    notifications.
+    
+    Notifications are delivered to the most deeply nested containers first.
+    Notifications caused by those being delivered are themselves deferred
+    until they are delivered by this function so that every container is
+    notified only once.
+    """
+    global _deferral_depth, _delivered_sequence
+    old_delivered_sequence = _delivered_sequence
+    _deferral_depth += 1
+    try:
+        while _pending_heap:
+            instance = heappop(_pending_heap)[2]
+            _delivered_sequence = _pending_updates.pop(instance)
+            instance._apply_deferred_update()
+    finally:
+        _delivered_sequence = old_delivered_sequence
+        _deferral_depth -= 1
+
 
 class DataType(object):
     """The base-class for all CData types.
@@ -25,6 +150,11 @@ class DataType(object):
         The C type prototype for this data type (often blank).
     definition : str
         The C type definition for this data type (often blank).
+    size : int
+        The size (in bytes) of the packed form of values of this type (i.e.
+        its sizeof). This is computed once and shared by all instances.
+    alignment : int
+        The natural alignment (in bytes) of values of this type in memory.
     """
     
     # Placed here so that these names appear in the dir() of this class to allow
@@ -57,6 +187,14 @@ class DataType(object):
         # Set the datatype's docstring accordingly.
         if doc:
             self.__doc__ = doc
+        
+        # A cache of compiled codecs {endianness: struct.Struct or None, ...}
+        # produced by :py:meth:`.codec`.
+        self._codecs = {}
+        
+        # A cache of the flattened values of a default instance of this type
+        # (see :py:attr:`._default_flattened`) or None if not yet computed.
+        self._default_flattened_values = None
     
     def __call__(self):
         """Instantiate a new instance of this data type with the values passed
@@ -69,6 +207,262 @@ class DataType(object):
         """
         raise NotImplementedError()
     
+    @property
+    def _flat_format(self):
+        """The :py:mod:`struct` format string (without endianness prefix) of
+        the flattened packed form of this type or None if this type cannot be
+        packed with a single format string.
+        
+        Types which can be flattened must implement
+        :py:meth:`.Instance._flatten` and :py:meth:`.Instance._unflatten` in
+        their instances. The values produced/consumed by these methods
+        correspond one-to-one with the items in this format string.
+        """
+        # The common case: types must opt-in to being flattened.
+        return None
+    
+    def codec(self, endianness=Endianness.little):
+        """Get a compiled :py:class:`struct.Struct` which packs and unpacks the
+        flattened form of this data type.
+        
+        The codec is compiled once and then cached for each endianness.
+        
+        Parameters
+        ----------
+        endianness : :py:class:`.Endianness`
+            The endianness of the packed values. (Default: little-endian).
+        
+        Returns
+        -------
+        :py:class:`struct.Struct` or None
+            The compiled codec or None if this type cannot be packed with a
+            single format string (e.g. it contains a union).
+        """
+        try:
+            return self._codecs[endianness]
+        except KeyError:
+            flat_format = self._flat_format
+            if flat_format is None:
+                codec = None
+            else:
+                codec = struct.Struct(endianness.value + flat_format)
+            self._codecs[endianness] = codec
+            return codec
+    
+    @property
+    def _default_flattened(self):
+        """For internal use. The flattened values (see
+        :py:meth:`.Instance._flatten`) of a default instance of this type.
+        
+        These are computed once and then cached so that, for example,
+        :py:meth:`.pack_many` may fill in omitted struct members without
+        creating an instance each time.
+        """
+        if self._default_flattened_values is None:
+            values = []
+            self()._flatten(values)
+            self._default_flattened_values = tuple(values)
+        return self._default_flattened_values
+    
+    """For internal use. True if the flattened form of this type is a single
+    value which is also the value of records of this type (see
+    :py:meth:`.iter_unpack`)."""
+    _is_scalar = False
+    
+    """For internal use. True if instances of this type cache their packed
+    form, making it cheap to pack them repeatedly."""
+    _has_packed_cache = False
+    
+    def _bulk_codec(self, endianness):
+        """Get the codec used by :py:meth:`.pack_many` and
+        :py:meth:`.iter_unpack` or raise a ValueError if there is none."""
+        codec = self.codec(endianness)
+        if codec is None:
+            raise ValueError(
+                "{} cannot be packed with a single struct format (e.g. it "
+                "contains a union)".format(repr(self)))
+        return codec
+    
+    def pack_many(self, records, endianness=Endianness.little):
+        """Pack many values of this type back-to-back into a single buffer
+        without creating any :py:class:`.Instance` objects.
+        
+        Parameters
+        ----------
+        records : iterable
+            The values to pack. Values are given in the form produced by
+            :py:meth:`.iter_unpack`. Structs may alternatively be given as
+            dictionaries mapping member names to values where any omitted
+            members take their default value. (The default values of each
+            member type are computed, from a default instance, just once.)
+        endianness : :py:class:`.Endianness`
+            The endianness to use to represent packed values. (Default:
+            little-endian).
+        
+        Returns
+        -------
+        :py:class:`bytes`
+        
+        Raises
+        ------
+        ValueError
+            If a value is invalid (including values which are out of range for
+            their packed representation) or if this type cannot be packed with
+            a single format string (see :py:meth:`.codec`).
+        """
+        pack = self._bulk_codec(endianness).pack
+        encode = self._encode
+        
+        packed = []
+        for record in records:
+            values = []
+            encode(record, values)
+            try:
+                packed.append(pack(*values))
+            except (struct.error, OverflowError) as e:
+                raise ValueError("cannot pack {!r} as {}: {}".format(
+                    record, repr(self), e))
+        return b"".join(packed)
+    
+    def iter_unpack(self, buffer, endianness=Endianness.little):
+        """Iterate over values of this type packed back-to-back in a buffer
+        without creating any :py:class:`.Instance` objects.
+        
+        Values are produced as lightweight records: primitives, pointers
+        (addresses) and padding (bytes) produce their Python values, enums the
+        name of their value, arrays a tuple of element values and structs a
+        :py:func:`~collections.namedtuple` (see
+        :py:attr:`.Struct.record_type`).
+        
+        Parameters
+        ----------
+        buffer : :py:class:`bytes`, :py:class:`bytearray`, ...
+            The buffer to unpack. Its length must be a multiple of the size of
+            this type.
+        endianness : :py:class:`.Endianness`
+            The endianness of the packed values. (Default: little-endian).
+        
+        Returns
+        -------
+        An iterator over the unpacked values.
+        
+        Raises
+        ------
+        ValueError
+            If this type cannot be packed with a single format string (see
+            :py:meth:`.codec`).
+        """
+        codec = self._bulk_codec(endianness)
+        return map(self._record_decoder, codec.iter_unpack(buffer))
+    
+    @property
+    def _record_decoder(self):
+        """For internal use. A function which converts a tuple of flattened
+        values (as unpacked by the codec) into the record form of this type
+        used by :py:meth:`.iter_unpack`."""
+        if self._is_scalar:
+            return itemgetter(0)
+        else:
+            return (lambda values: self._decode(iter(values)))
+    
+    def _decode(self, values):
+        """For internal use. Consume this type's flattened values from the
+        supplied iterator and return the record form of the value (see
+        :py:meth:`.iter_unpack`)."""
+        raise NotImplementedError()
+    
+    def _decode_many(self, values, count):
+        """For internal use. Decode a tuple of the record forms of the given
+        number of consecutive values of this type (see :py:meth:`._decode`).
+        
+        Types may override this with a faster, vectorised, implementation.
+        """
+        decode = self._decode
+        return tuple(decode(values) for _ in range(count))
+    
+    def _encode(self, value, values):
+        """For internal use. Append the flattened values of the given record
+        form of a value of this type to the supplied list (see
+        :py:meth:`.pack_many`)."""
+        raise NotImplementedError()
+    
+    @property
+    def size(self):
+        """The size (in bytes) of the packed form of values of this type."""
+        # Types which cannot be flattened must override this property
+        codec = self.codec()
+        if codec is None:
+            raise NotImplementedError()
+        return codec.size
+    
+    @property
+    def alignment(self):
+        """The natural alignment (in bytes) of values of this type in memory,
+        used by :py:func:`.alloc`.
+        
+        By default, this is the size of the type (which is correct for scalar
+        types such as ints and pointers).
+        """
+        return self.size
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        """Get a NumPy dtype with the same layout as the packed form of this
+        type.
+        
+        This allows a buffer containing many packed values of this type (e.g.
+        an array of structs) to be decoded in one go using
+        :py:func:`numpy.frombuffer`.
+        
+        Primitives map onto the NumPy scalar type of the same size, pointers
+        and enums onto unsigned integers (giving the address and numerical
+        value respectively), padding onto void types, arrays onto sub-array
+        types and structs and unions onto structured types with explicit
+        member offsets.
+        
+        Parameters
+        ----------
+        endianness : :py:class:`.Endianness`
+            The endianness of the packed values. (Default: little-endian).
+        
+        Returns
+        -------
+        :py:class:`numpy.dtype`
+        
+        Raises
+        ------
+        ImportError
+            If NumPy is not installed.
+        """
+        raise NotImplementedError()
+    
+    def _view_get(self, buffer, offset, endianness):
+        """For internal use. Read a value of this type from a buffer on behalf
+        of a :py:class:`.View`.
+        
+        Types with a simple Python representation (e.g. primitives) should
+        return the decoded value while other types should return a
+        :py:class:`.View`.
+        """
+        raise NotImplementedError()
+    
+    def _view_set(self, buffer, offset, endianness, value):
+        """For internal use. Write a value of this type into a buffer on behalf
+        of a :py:class:`.View`.
+        
+        This default implementation accepts either an :py:class:`.Instance` or
+        a :py:class:`.View` of this type.
+        """
+        if isinstance(value, View) and value._data_type == self:
+            if value._endianness == endianness:
+                buffer[offset:offset + value._size] = value._pack()
+            else:
+                value._instance().pack_into(buffer, offset, endianness)
+        elif getattr(value, "data_type", None) == self:
+            value.pack_into(buffer, offset, endianness)
+        else:
+            raise TypeError("expected an instance or view of {} but got "
+                            "{}".format(repr(self), repr(value)))
+    
     @property
     def prototype(self):
         """The C prototype definition of this data type.
@@ -154,6 +548,22 @@ class Instance(object):
     property which automatically calls the :py:meth:`._child_address_changed`
     method when the address is set.
     
+    Only top-level instances store their address: the address of an instance
+    within a container is computed on demand by the container's
+    :py:meth:`._child_address` method, which container types must also
+    implement. As a result, changing the address of a container does not
+    require the addresses of all its members to be updated. Only referrers of
+    members (e.g. pointers to a member) are informed of the change.
+    
+    Instances define ``__slots__`` to keep large graphs of instances compact.
+    For example, on 64-bit CPython a :py:class:`.PrimitiveInstance` occupies 88
+    bytes (excluding its value). Containers are somewhat larger since they
+    also hold their members (and, once packed, a cache of their packed form):
+    a struct of three primitive members occupies around 660 bytes including
+    its members.
+    Arrays of primitives avoid most of this overhead by holding their values
+    compactly (see :py:class:`.PrimitiveArrayInstance`).
+    
     Container and reference instances should add themselves to their
     member's/referee instance's _container or _referrer respectively.  They
     should remove themselves when they no longer contain/refer to the specified
@@ -177,46 +587,125 @@ class Instance(object):
         :py:meth:`._value_changed` methods to call all parents'
         :py:meth:`._child_value_changed` and :py:meth:`._child_address_changed`
         methods and also used to implement iter_instances.
+    _container_key
+        For internal use. The key (e.g. member name or element index) by which
+        this instance's container identifies it, set by the container when the
+        instance is added. Stored here (rather than in a reverse mapping in
+        each container) to keep containers compact.
     _referrer : :py:class:`Instance` or None
         Similar to _container except indicates which, if any, instance directly
         refers to this instance (e.g. a pointer). This has the side-effect that
         only one pointer may exist to a given value at any given time.
         
         This is not considered by the iter_instances method.
+    _referenced_count : int
+        For internal use. The number of instances with a referrer amongst this
+        instance and those it (recursively) contains. Used to find the members
+        whose referrers must be informed when a container's address changes.
     """
     
-    # Placed here so that these names appear in the dir() of this class to allow
-    # discovery of the names used by the class before it is instantiateed. This
-    # is useful since some instances may wish to add user-defined attributes to
-    # an Instance object and therefore it is important that any names which are
-    # reserved are known.
-    data_type = None
-    _address = None
-    _container = None
-    _referrer = None
+    # Instances are stored compactly using slots: large graphs of instances
+    # would otherwise be dominated by the size of each instance's __dict__.
+    # Subclasses must also define __slots__ listing any attributes they add
+    # (user-defined attributes cannot be added to instances). Conveniently,
+    # slots appear in the dir() of this class which allows the names used by
+    # instances to be discovered before any are created, e.g. so that complex
+    # types can reject member names which clash with them.
+    __slots__ = ("data_type", "_address", "_container_instance",
+                 "_container_key", "_referrer_instance", "_referenced_count")
     
     def __init__(self, data_type):
         """Create a new instance of the specified type."""
         self.data_type = data_type
-        self.address = None
-        self._container = None
-        self._referrer = None
+        self._address = None
+        self._container_instance = None
+        self._container_key = None
+        self._referrer_instance = None
+        self._referenced_count = 0
     
     @property
     def address(self):
         """Get the address of this instance in memory (or None if unknown)."""
-        return self._address
+        if self._container_instance is None:
+            return self._address
+        else:
+            return self._container_instance._child_address(self)
     
     @address.setter
     def address(self, address):
         """Set the address of this instance in memory (or None if unknown)."""
         self._address = address
+        self._addresses_changed()
+    
+    def _addresses_changed(self):
+        """For internal use. Report a change to the address of this instance
+        and, implicitly, of every instance it contains."""
         self._address_changed()
+        
+        # The addresses of any contained instances have implicitly changed too
+        if self._referenced_count > (self._referrer_instance is not None):
+            self._descendant_addresses_changed()
+    
+    @property
+    def _container(self):
+        return self._container_instance
+    
+    @_container.setter
+    def _container(self, container):
+        old_container = self._container_instance
+        if old_container is not None:
+            # Retain the address this instance had in its old container
+            self._address = self.address
+            if self._referenced_count:
+                old_container._adjust_referenced_count(-self._referenced_count)
+        
+        self._container_instance = container
+        if container is None:
+            self._container_key = None
+        elif self._referenced_count:
+            container._adjust_referenced_count(self._referenced_count)
+    
+    @property
+    def _referrer(self):
+        return self._referrer_instance
+    
+    @_referrer.setter
+    def _referrer(self, referrer):
+        delta = ((referrer is not None) -
+                 (self._referrer_instance is not None))
+        self._referrer_instance = referrer
+        if delta:
+            self._adjust_referenced_count(delta)
+    
+    def _adjust_referenced_count(self, delta):
+        """For internal use. Adjust the count of referenced instances within
+        this instance and its containers."""
+        self._referenced_count += delta
+        if self._container_instance is not None:
+            self._container_instance._adjust_referenced_count(delta)
+    
+    def _descendant_addresses_changed(self):
+        """For internal use. Inform the referrers of any instances
+        (recursively) contained by this instance that their address has
+        changed.
+        
+        Only members with a referenced instance somewhere within them are
+        visited.
+        """
+        to_visit = [self]
+        while to_visit:
+            instance = to_visit.pop()
+            for child in instance._iter_children():
+                if child._referenced_count:
+                    if child._referrer is not None:
+                        child._referrer._child_address_changed(child)
+                    to_visit.append(child)
     
     @property
     def size(self):
         """Return the size of C-encoded form of this instance."""
-        raise NotImplementedError()
+        # All instances of a type have the same size
+        return self.data_type.size
     
     @property
     def literal(self):
@@ -242,13 +731,14 @@ class Instance(object):
         Raises
         ------
         PointerToUndefinedMemoryAddress
-            If this instance contains a pointer to an instance not assigned an address
-            (e.g. with :py:meth:`.alloc`).
+            If this instance contains a pointer to an instance not assigned an
+            address (e.g. with :py:meth:`.alloc`).
         """
         raise NotImplementedError()
   
     def unpack(self, data, endianness=Endianness.little):
-        """Unpack the C-encoded form of this instance's value into this instance.
+        """Unpack the C-encoded form of this instance's value into this
+        instance.
         
         Note that any values referenced (but not contained) by this instance
         will not be updated.
@@ -264,6 +754,104 @@ class Instance(object):
         """
         raise NotImplementedError()
     
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        """Pack the C-encoded form of just this instance's value directly into
+        a writable buffer.
+        
+        Parameters
+        ----------
+        buffer : :py:class:`bytearray`, :py:class:`memoryview`, \
+                :py:class:`mmap.mmap`, ...
+            A writable buffer to pack this instance into. The buffer must be
+            at least offset + size bytes long.
+        offset : int
+            The offset into the buffer at which the packed value will be
+            written. (Default: 0).
+        endianness : :py:class:`.Endianness`
+            The endianness to use to represent packed values. (Default:
+            little-endian).
+        
+        Raises
+        ------
+        struct.error
+            If the packed value does not fit in the buffer at the given
+            (non-negative) offset.
+        PointerToUndefinedMemoryAddress
+            If this instance contains a pointer to an instance not assigned an
+            address (e.g. with :py:meth:`.alloc`).
+        """
+        raise NotImplementedError()
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        """Unpack the C-encoded form of this instance's value directly from a
+        buffer without copying it.
+        
+        As with :py:meth:`.unpack`, any values referenced (but not contained)
+        by this instance will not be updated.
+        
+        Parameters
+        ----------
+        buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+                :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+            The buffer containing the packed data to unpack into this instance.
+        offset : int
+            The offset into the buffer at which the packed value starts.
+            (Default: 0).
+        endianness : :py:class:`.Endianness`
+            The endianness to use to represent packed values. (Default:
+            little-endian).
+        
+        Raises
+        ------
+        struct.error
+            If the packed value does not fit in the buffer at the given
+            (non-negative) offset.
+        """
+        raise NotImplementedError()
+    
+    def _flatten(self, values):
+        """For internal use. Append the values which make up the flattened
+        packed form of this instance to the supplied list.
+        
+        The values must correspond with the items of the data type's
+        :py:attr:`~.DataType._flat_format`.
+        
+        Raises
+        ------
+        PointerToUndefinedMemoryAddress
+            If this instance contains a pointer to an instance not assigned an
+            address.
+        """
+        raise NotImplementedError()
+    
+    def _unflatten(self, values):
+        """For internal use. Consume the values which make up the flattened
+        packed form of this instance from the supplied iterator and update this
+        instance accordingly.
+        
+        Like :py:meth:`.unpack`, this should result in at most one call to
+        :py:meth:`._value_changed`.
+        """
+        raise NotImplementedError()
+    
+    def _iter_children(self):
+        """For internal use. Iterate over the instances directly contained by
+        this instance (e.g. the members of a struct).
+        
+        Unlike :py:meth:`.iter_instances`, referenced instances are not
+        included and nothing is iterated over recursively.
+        """
+        return empty_iterable
+    
+    def _iter_related(self):
+        """For internal use. Iterate over the instances, other than its
+        container, which :py:meth:`.iter_instances` must visit after this
+        instance (e.g. its members or the instance it points to).
+        
+        By default these are the instances directly contained by this instance.
+        """
+        return self._iter_children()
+    
     def iter_instances(self, _generated=None):
         """Iterate over all instances in any way related to this instance.
         
@@ -282,34 +870,44 @@ class Instance(object):
         the pointer instance (or its container) along with the instance being
         pointed to (or its container).
         
+        The data structure is traversed depth-first using an explicit stack
+        (rather than recursively) so that arbitrarily deep structures (e.g.
+        long linked lists) may be traversed. Container and reference types
+        should override :py:meth:`._iter_related` rather than this method.
+        
         Parameters
         ----------
         _generated : set([:py:class:`Instance`, ...]) or None
-            For internal use only. If :py:meth:`.iter_instances` is called on an
-            instance which is listed in the _generated set, the generator
-            should terminate immediately.
+            For internal use only. Instances listed in the _generated set (and
+            anything only reachable via them) are not iterated over.
         """
-        # This default implementation is sufficient for non-container and
-        # non-reference types. Containers and reference types should extend this
-        # method so that it also iterates over their members/referred instances.
-        
         if _generated is None:
             _generated = set()
         
-        # Don't generate this instance multiple times
-        if self in _generated:
-            return
-        else:
-            _generated.add(self)
-        
-        if self._container is None:
-            # If this instance is a top-level instance, produce itself
-            yield self
-        else:
-            # This instance is in a container, list the container's instances
-            # instead.
-            for i in self._container.iter_instances(_generated):
-                yield i
+        # A stack of iterators over the instances still to be visited. Each
+        # instance's container is visited (in its entirety) before anything
+        # else related to the instance.
+        to_visit = [iter((self, ))]
+        while to_visit:
+            # Find the next instance not already generated
+            for instance in to_visit[-1]:
+                if instance not in _generated:
+                    break
+            else:
+                to_visit.pop()
+                continue
+            _generated.add(instance)
+            
+            to_visit.append(iter(instance._iter_related()))
+            
+            container = instance._container_instance
+            if container is None:
+                # If this instance is a top-level instance, produce itself
+                yield instance
+            else:
+                # This instance is in a container, list the container's
+                # instances instead.
+                to_visit.append(iter((container, )))
     
     def __str__(self):
         """Produce a human-readable version of the value of this instance."""
@@ -319,19 +917,72 @@ class Instance(object):
         return "<{}: {}>".format(self.data_type.name,
                                  str(self))
     
+    def _check_buffer(self, buffer, offset):
+        """For internal use. Ensure the packed instance fits in the buffer at
+        the given offset."""
+        if offset < 0 or offset + self.size > len(buffer):
+            raise struct.error(
+                "{}-byte {} at offset {} does not fit in {}-byte "
+                "buffer".format(self.size, self.data_type.name, offset,
+                                len(buffer)))
+    
     def _value_changed(self):
         """To be called when an instances' value is changed."""
-        if self._container is not None:
-            self._container._child_value_changed(self)
-        if self._referrer is not None:
-            self._referrer._child_value_changed(self)
+        container = self._container_instance
+        if container is not None:
+            container._child_value_changed(self)
+        referrer = self._referrer_instance
+        if referrer is not None:
+            referrer._child_value_changed(self)
     
     def _address_changed(self):
         """To be called when an instances' address is changed."""
-        if self._container is not None:
-            self._container._child_address_changed(self)
-        if self._referrer is not None:
-            self._referrer._child_address_changed(self)
+        container = self._container_instance
+        if container is not None:
+            container._child_address_changed(self)
+        referrer = self._referrer_instance
+        if referrer is not None:
+            referrer._child_address_changed(self)
+    
+    def _deferrable_value_changed(self):
+        """For internal use. Like :py:meth:`._value_changed` but, within a
+        :py:func:`.deferred_updates` context, merely schedules the notification
+        to be delivered (just once) when the context exits.
+        
+        Containers should call this from :py:meth:`._child_value_changed`
+        rather than :py:meth:`._value_changed`.
+        """
+        if _deferral_depth:
+            if (self._container_instance is None and
+                    self._referrer_instance is None):
+                # There is nobody to notify
+                return
+            if self not in _pending_updates:
+                heappush(_pending_heap, (-self._nesting_depth(),
+                                         next(_pending_order), self))
+            _pending_updates[self] = (next(_change_sequence_numbers)
+                                      if _delivered_sequence is None else
+                                      _delivered_sequence)
+        else:
+            self._apply_deferred_update()
+    
+    def _nesting_depth(self):
+        """For internal use. The number of containers enclosing this
+        instance."""
+        container = self._container_instance
+        if container is None:
+            return 0
+        else:
+            return container._nesting_depth() + 1
+    
+    def _apply_deferred_update(self):
+        """For internal use. Deliver a notification scheduled by
+        :py:meth:`._deferrable_value_changed`.
+        
+        Containers which must update themselves in response to changes in their
+        children may override this method to do so lazily.
+        """
+        self._value_changed()
     
     def _child_value_changed(self, child):
         """Called for containers when a child's value changes."""
@@ -340,3 +991,8 @@ class Instance(object):
     def _child_address_changed(self, child):
         """Called for containers when a child's value changes."""
         raise NotImplementedError()
+    
+    def _child_address(self, child):
+        """Called for containers to get the address of a contained child (or
+        None if the container's address is unknown)."""
+        raise NotImplementedError()
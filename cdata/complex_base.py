@@ -1,15 +1,28 @@
 """The base class which implements type functionality common to struct and union
 types."""
 
+import re
+
 from six import iteritems, itervalues
 
 from collections import defaultdict, OrderedDict
 
 from cdata.base import DataType, Instance
 
+from cdata.endianness import Endianness
+
+from cdata.view import ComplexTypeView
+
 from cdata.utils import indent, comment
 
 
+"""Matches a single step of a member path (see ComplexType.offsetof), either a
+member name (optionally preceded by a ".") or an array index in square
+brackets."""
+MEMBER_PATH_TOKEN = re.compile(r"(?P<dot>\.?)(?P<name>[A-Za-z_]\w*)|"
+                               r"\[(?P<index>\d+)\]")
+
+
 class ComplexType(DataType):
     """The base type for C structs and unions."""
     
@@ -80,6 +93,162 @@ class ComplexType(DataType):
             # the semicolon)
             name = self._definition.rstrip(";")
         super(ComplexType, self).__init__(name=name, native=native, doc=doc)
+        
+        # The position of each member {member_name: index, ...}, used to look
+        # up member instances (which are stored in a list, in member order).
+        self._member_indices = dict((name, index)
+                                    for index, name
+                                    in enumerate(self._members))
+        
+        # The offsets of each member and total size of the type, computed on
+        # demand by _compute_layout.
+        self._layout = None
+        
+        # Cache of offsetof results {member_path: offset, ...}
+        self._offsetof_cache = {}
+    
+    def _compute_layout(self):
+        """For internal use. Compute the memory layout of this type.
+        
+        Returns
+        -------
+        (OrderedDict({member_name: offset, ...}), size)
+        """
+        raise NotImplementedError()
+    
+    @property
+    def _member_offsets(self):
+        """For internal use. The offset (in bytes) of each member from the
+        start of the packed representation of this type.
+        
+        A dictionary {member_name: offset, ...}.
+        """
+        if self._layout is None:
+            self._layout = self._compute_layout()
+        return self._layout[0]
+    
+    def offsetof(self, member):
+        """Get the offset (in bytes) of a (possibly nested) member from the
+        start of this type, like C's offsetof.
+        
+        Offsets are computed from the type's member offset table and cached.
+        
+        Parameters
+        ----------
+        member : str
+            The member name or a path to a nested member, e.g. ``"a.b[3].c"``
+            refers to member c of element 3 of array b within member a.
+        
+        Returns
+        -------
+        int
+        
+        Raises
+        ------
+        ValueError
+            If the member path is invalid or refers to a non-existent member
+            or array element.
+        """
+        try:
+            return self._offsetof_cache[member]
+        except KeyError:
+            pass
+        
+        # Avoid circular imports
+        from cdata.array import Array
+        from cdata.typedef import Typedef
+        
+        data_type = self
+        offset = 0
+        position = 0
+        while True:
+            match = MEMBER_PATH_TOKEN.match(member, position)
+            if (match is None or
+                    # Member names must be preceded by a "." (unless first)
+                    (match.group("name") is not None and
+                     match.group("dot") != ("" if position == 0 else ".")) or
+                    # Paths can't start with an index
+                    (match.group("index") is not None and position == 0)):
+                raise ValueError("invalid member path {}".format(member))
+            position = match.end()
+            
+            # Look through typedefs
+            while isinstance(data_type, Typedef):
+                data_type = data_type.base_type
+            
+            if match.group("name") is not None:
+                name = match.group("name")
+                if (not isinstance(data_type, ComplexType) or
+                        name not in data_type._members):
+                    raise ValueError("{} has no member {}".format(
+                        repr(data_type), name))
+                offset += data_type._member_offsets[name]
+                data_type = data_type._members[name]
+            else:
+                index = int(match.group("index"))
+                if (not isinstance(data_type, Array) or
+                        index >= data_type.length):
+                    raise ValueError("{} has no element {}".format(
+                        repr(data_type), index))
+                offset += index * data_type.base_type.size
+                data_type = data_type.base_type
+            
+            if position == len(member):
+                break
+        
+        self._offsetof_cache[member] = offset
+        return offset
+    
+    @property
+    def size(self):
+        if self._layout is None:
+            self._layout = self._compute_layout()
+        return self._layout[1]
+    
+    @property
+    def alignment(self):
+        # As in C, the alignment of the most strictly aligned member. Note that
+        # members are not padded to their natural alignment within the type.
+        return max([data_type.alignment
+                    for data_type in itervalues(self._members)] + [1])
+    
+    def view(self, buffer, offset=0, endianness=Endianness.little):
+        """Get a lightweight view of a value of this type packed in the
+        supplied buffer.
+        
+        Unlike unpacking the buffer into a new instance, no member instances
+        are created. Instead, every read or write of a member of the view is
+        decoded from or encoded into the buffer directly.
+        
+        Parameters
+        ----------
+        buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+                :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+            The buffer containing the packed value. The buffer must be
+            writable for writes to the view to succeed.
+        offset : int
+            The offset of the packed value within the buffer. (Default: 0).
+        endianness : :py:class:`.Endianness`
+            The endianness of the packed value. (Default: little-endian).
+        
+        Returns
+        -------
+        :py:class:`.ComplexTypeView`
+        """
+        return ComplexTypeView(self, buffer, offset, endianness)
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype({
+            "names": list(self._members),
+            "formats": [data_type.to_numpy_dtype(endianness)
+                        for data_type in itervalues(self._members)],
+            "offsets": list(itervalues(self._member_offsets)),
+            "itemsize": self.size,
+        })
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self.view(buffer, offset, endianness)
     
     @property
     def prototype(self):
@@ -144,6 +313,7 @@ class ComplexType(DataType):
 class ComplexTypeInstance(Instance):
     """A generic instance of a complex type."""
     
+    __slots__ = ("_member_indices", "_member_instances", "_initialising")
     
     def __init__(self, data_type, *args, **kwargs):
         """Create a new instance of a complex type.
@@ -153,11 +323,17 @@ class ComplexTypeInstance(Instance):
         *args : [:py:class:`.Instance`, ...]
         *kwargs : {member_name: :py:class:`.Instance`, ...}
         """
-        # Create a mapping from member names to their instances. This must be
+        # The member instances, in member order, and the (shared, per-type)
+        # mapping from member names to positions in that list. This must be
         # done before anything else since all getter/setter operations require
-        # that they can check attributes are not in this dictionary.
-        self._member_instances = OrderedDict(
-            (name, None) for name in data_type._members)
+        # that they can check attributes are not member names.
+        self._member_indices = data_type._member_indices
+        self._member_instances = [None] * len(data_type._members)
+        
+        # While set, members are populated without notifying anyone or
+        # assigning addresses: subclasses must assign member addresses (and
+        # send any notifications) once, after this constructor returns.
+        self._initialising = True
         
         super(ComplexTypeInstance, self).__init__(data_type)
         
@@ -168,7 +344,7 @@ class ComplexTypeInstance(Instance):
                 self.data_type.name, len(self._member_instances), len(args)))
         
         # Populate any positionally specified members
-        for name, instance in zip(self._member_instances, args):
+        for name, instance in zip(self.data_type._members, args):
             setattr(self, name, instance)
         
         # Populate any named members, checking for multiple-definitions and
@@ -182,7 +358,7 @@ class ComplexTypeInstance(Instance):
                 name, __, sub_name = name.partition("__")
                 
                 # Fail if the member has already been defined
-                if self._member_instances[name] is not None:
+                if self._find_member(name) is not None:
                     raise ValueError("{} defined twice".format(name))
                 
                 # Save for later
@@ -191,20 +367,21 @@ class ComplexTypeInstance(Instance):
                 # Set non-nested kwargs immediately
                 
                 # Fail if the name isn't a valid member
-                if name not in self._member_instances:
+                if name not in self._member_indices:
                     raise ValueError("{} does not have a member {}".format(
                         self.data_type.name, name))
                 
                 # Fail if the member has already been defined
-                if self._member_instances[name] is not None or name in nested_args:
+                if (self._find_member(name) is not None or
+                        name in nested_args):
                     raise ValueError("{} defined twice".format(name))
                 
                 # Actually set the member's value
                 setattr(self, name, instance)
         
         # Populate any undefined members with new instances (note that the
-        # iterator must be copied since we may mutate the dictionary)
-        for name, instance in list(iteritems(self._member_instances)):
+        # iterator must be copied since we may mutate the list)
+        for name, instance in list(self._iter_members()):
             if instance is None:
                 data_type = self.data_type._members[name]
                 
@@ -217,13 +394,29 @@ class ComplexTypeInstance(Instance):
                             name))
                 
                 setattr(self, name, data_type(**kwargs))
+        
+        self._initialising = False
     
     def _get_member(self, name):
         """Underlying function to fetch member instances.
         
         This function will always be called with a valid member name.
         """
-        return self._member_instances[name]
+        return self._member_instances[self._member_indices[name]]
+    
+    def _find_member(self, name):
+        """For internal use. Get the instance of the named member or None if
+        there is no such member (or it has not yet been populated)."""
+        index = self._member_indices.get(name)
+        if index is None:
+            return None
+        else:
+            return self._member_instances[index]
+    
+    def _iter_members(self):
+        """For internal use. Iterate over (name, instance) pairs for every
+        member, in order."""
+        return zip(self.data_type._members, self._member_instances)
     
     def _set_member(self, name, instance):
         """Underlying function to set member instances.
@@ -238,24 +431,27 @@ class ComplexTypeInstance(Instance):
         
         # If replacing an existing member, record that we are no-longer its
         # parent.
-        if self._member_instances.get(name, None) is not None:
-            self._member_instances[name]._container = None
+        index = self._member_indices[name]
+        if self._member_instances[index] is not None:
+            self._member_instances[index]._container = None
         
-        self._member_instances[name] = instance
+        self._member_instances[index] = instance
+        instance._container_key = name
         instance._container = self
         
-        self._child_value_changed(instance)
+        if not self._initialising:
+            self._child_value_changed(instance)
     
     def __getattr__(self, name):
         """Handles reads of member instances."""
-        if name in self._member_instances:
+        if name in self._member_indices:
             return self._get_member(name)
         else:
             raise AttributeError(name)
     
     def __setattr__(self, name, value):
         """Handles writes to member instances."""
-        if not name.startswith("_") and name in self._member_instances:
+        if not name.startswith("_") and name in self._member_indices:
             # Check that the value is of the correct type before accepting the
             # new value
             if (not hasattr(value, "data_type") or
@@ -266,34 +462,32 @@ class ComplexTypeInstance(Instance):
         else:
             super(ComplexTypeInstance, self).__setattr__(name, value)
     
+    def _iter_current_members(self):
+        """For internal use. Iterate over (name, instance) pairs for the
+        members whose values are meaningful (and which are listed when the
+        instance is displayed or its instances are iterated over)."""
+        return self._iter_members()
+    
     @property
     def literal(self):
         member_literals = ",\n".join(
-            t.literal for t in itervalues(self._member_instances))
+            t.literal for _, t in self._iter_current_members())
         
         return ("({}){{\n"
                 "{}\n"
                 "}}").format(self.data_type.name, indent(member_literals))
 
-    def iter_instances(self, _generated=None):
-        if _generated is None:
-            _generated = set()
-        
-        if self not in _generated:
-            # Iterate over this instance as usual (this will add self to
-            # _generated).
-            for ref in super(ComplexTypeInstance, self).iter_instances(_generated):
-                yield ref
-            
-            # Then iterate over the members (which notably will not list
-            # themselves since they are contained by this instance, but rather
-            # will include anything they reference).
-            for instance in itervalues(self._member_instances):
-                for ref in instance.iter_instances(_generated):
-                    yield ref
+    def _iter_children(self):
+        return iter(self._member_instances)
+    
+    def _iter_related(self):
+        # Iterate over the members (which notably will not list themselves
+        # since they are contained by this instance, but rather will include
+        # anything they reference).
+        return [instance for _, instance in self._iter_current_members()]
 
     def __str__(self):
         return "{{{}}}".format(
             ", ".join("{}: {}".format(name, str(instance))
                       for name, instance
-                      in iteritems(self._member_instances)))
+                      in self._iter_current_members()))
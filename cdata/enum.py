@@ -2,9 +2,9 @@
 
 from collections import OrderedDict
 
-from six import iteritems, itervalues, integer_types, next
+from itertools import islice
 
-import struct
+from six import iteritems, integer_types, next
 
 from cdata.endianness import Endianness
 
@@ -57,10 +57,13 @@ class Enum(DataType):
         if len(members) == 0:
             raise ValueError("empty enum types are not supported.")
         
-        # Validate and record the members of the enumeration
+        # Validate and record the members of the enumeration (and the reverse
+        # mapping from values to names).
         next_value = 0
         self._members = OrderedDict()
         self._member_docs = OrderedDict()
+        self._names = {}
+        reserved = set(dir(self))
         for name_value_doc in members:
             if len(name_value_doc) == 2:
                 name, value = name_value_doc
@@ -76,16 +79,17 @@ class Enum(DataType):
                 raise ValueError("values must be integers (or None)")
             if name in self._members:
                 raise ValueError("name '{}' defined multiple times".format(name))
-            if value in itervalues(self._members):
+            if value in self._names:
                 raise ValueError(
                     "value {} defined multiple times".format(value))
             if not 0 <= value < (1 << enum_size):
                 raise ValueError("value {} is out of range".format(value))
-            if name.startswith("_") or name in dir(self):
+            if name.startswith("_") or name in reserved:
                 raise ValueError("name '{}' is reserved".format(name))
             
             self._members[name] = value
             self._member_docs[name] = member_doc
+            self._names[value] = name
             next_value = value + 1
         
         # If anonymous, the name of the type becomes its full definition.
@@ -112,6 +116,64 @@ class Enum(DataType):
         else:
             raise AttributeError(name)
     
+    @property
+    def _flat_format(self):
+        return self._struct_format
+    
+    def _name_of(self, value):
+        """Get the name of the enum member with the specified (integer) value.
+        
+        Raises
+        ------
+        ValueError
+            If the value is not a member of the enum.
+        """
+        try:
+            return self._names[value]
+        except KeyError:
+            # The value isn't defined by the enum.
+            raise ValueError("value of {} is not a member of {}".format(
+                value, repr(self)))
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype("{}u{}".format(endianness.value,
+                                          self.size))
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self._name_of(
+            self.codec(endianness).unpack_from(buffer, offset)[0])
+    
+    def _view_set(self, buffer, offset, endianness, value):
+        self.codec(endianness).pack_into(buffer, offset, self._value_of(value))
+    
+    def _value_of(self, name):
+        """Get the (integer) value of the named enum member.
+        
+        Raises
+        ------
+        ValueError
+            If the name is not a member of the enum.
+        """
+        if name not in self._members:
+            raise ValueError("{} is not a member of the enum".format(name))
+        return self._members[name]
+    
+    def _decode(self, values):
+        return self._name_of(next(values))
+    
+    def _decode_many(self, values, count):
+        values = tuple(islice(values, count))
+        try:
+            return tuple(map(self._names.__getitem__, values))
+        except KeyError:
+            # Report the first value which isn't a member
+            for value in values:
+                self._name_of(value)
+    
+    def _encode(self, value, values):
+        values.append(self._value_of(value))
+    
     @property
     def definition(self):
         if self.enum_name is not None:
@@ -148,6 +210,8 @@ class Enum(DataType):
 class EnumInstance(Instance):
     """An instance of an enum type."""
     
+    __slots__ = ("_value", )
+    
     def __init__(self, data_type, value=None):
         super(EnumInstance, self).__init__(data_type)
         
@@ -168,31 +232,34 @@ class EnumInstance(Instance):
         self._value = value
         self._value_changed()
 
-    @property
-    def size(self):
-        return struct.calcsize(self.data_type._struct_format)
-    
     @property
     def literal(self):
         return self.value
     
     def pack(self, endianness=Endianness.little):
-        return struct.pack(endianness.value + self.data_type._struct_format,
-                           self.data_type._members[self.value])
+        return self.data_type.codec(endianness).pack(
+            self.data_type._members[self.value])
     
     def unpack(self, data, endianness=Endianness.little):
-        unpacked_value = struct.unpack(
-            endianness.value + self.data_type._struct_format, data)[0]
-        
-        for name, value in iteritems(self.data_type._members):
-            if value == unpacked_value:
-                # Found the unpacked value!
-                self.value = name
-                break
-        else:
-            # The unpacked value isn't defined by the enum.
-            raise ValueError("value of {} is not a member of {}".format(
-                unpacked_value, repr(self.data_type)))
+        self._unflatten(iter(self.data_type.codec(endianness).unpack(data)))
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self.data_type.codec(endianness).pack_into(
+            buffer, offset, self.data_type._members[self.value])
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self._unflatten(iter(
+            self.data_type.codec(endianness).unpack_from(buffer, offset)))
+    
+    def _flatten(self, values):
+        values.append(self.data_type._members[self.value])
+    
+    def _unflatten(self, values):
+        # The name is known to be valid so the value setter's check is skipped
+        self._value = self.data_type._name_of(next(values))
+        self._value_changed()
     
     def __str__(self):
         return self.value
@@ -0,0 +1,590 @@
+"""Access to packed memory images (e.g. files) by absolute address."""
+
+import io
+
+import mmap
+
+from bisect import bisect_right
+
+from cdata.endianness import Endianness
+
+from cdata.array import ArrayInstance, PrimitiveArrayInstance
+
+from cdata.pointer import PointerInstance
+
+from cdata.struct import StructInstance
+
+from cdata.union import UnionInstance
+
+
+class Image(object):
+    """A packed memory image located at a particular base address.
+    
+    The image is backed by a buffer (e.g. a :py:class:`bytearray` or a
+    memory-mapped file, see :py:meth:`.from_file`) whose first byte resides at
+    the base address. Typed instances or views may then be obtained at
+    absolute addresses within the image.
+    
+    Attributes
+    ----------
+    buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+            :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+        The buffer containing the image data.
+    base_address : int
+        The address of the first byte of the buffer.
+    endianness : :py:class:`.Endianness`
+        The endianness of values within the image.
+    """
+    
+    def __init__(self, buffer, base_address=0, endianness=Endianness.little):
+        """Wrap an existing buffer as an image.
+        
+        Parameters
+        ----------
+        buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+                :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+            The image data. Must be writable for :py:meth:`.store` and writes
+            to views to succeed.
+        base_address : int
+            The address of the first byte of the buffer. (Default: 0).
+        endianness : :py:class:`.Endianness`
+            The endianness of values within the image. (Default:
+            little-endian).
+        """
+        self.buffer = buffer
+        self.base_address = base_address
+        self.endianness = endianness
+        
+        # The file the image was mapped from (if any), closed by close().
+        self._file = None
+    
+    @classmethod
+    def from_file(cls, filename, base_address=0,
+                  endianness=Endianness.little, writable=False):
+        """Memory-map a file as an image.
+        
+        Only the pages of the file which are actually accessed will be read
+        from disk.
+        
+        Parameters
+        ----------
+        filename : str
+            The file to map. Must not be empty.
+        base_address : int
+            The address of the first byte of the file. (Default: 0).
+        endianness : :py:class:`.Endianness`
+            The endianness of values within the image. (Default:
+            little-endian).
+        writable : bool
+            If True, writes to the image (e.g. via :py:meth:`.store` or via
+            views) are written back to the file. Otherwise the image is
+            read-only. (Default: False)
+        """
+        f = open(filename, "r+b" if writable else "rb")
+        try:
+            buffer = mmap.mmap(f.fileno(), 0,
+                               access=(mmap.ACCESS_WRITE if writable
+                                       else mmap.ACCESS_READ))
+        except Exception:
+            f.close()
+            raise
+        
+        image = cls(buffer, base_address, endianness)
+        image._file = f
+        return image
+    
+    def close(self):
+        """Unmap and close the underlying file (if the image was created by
+        :py:meth:`.from_file`)."""
+        if self._file is not None:
+            self.buffer.close()
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @property
+    def end_address(self):
+        """The address immediately after the end of the image."""
+        return self.base_address + len(self.buffer)
+    
+    def _offset(self, address, size):
+        """Get the offset into the buffer of the specified address, checking
+        that size bytes at that address lie within the image."""
+        if address is None:
+            raise ValueError("address must be specified")
+        
+        if address < self.base_address or address + size > self.end_address:
+            raise ValueError(
+                "0x{:X}-0x{:X} lies outside the image (0x{:X}-0x{:X})".format(
+                    address, address + size,
+                    self.base_address, self.end_address))
+        
+        return address - self.base_address
+    
+    def at(self, address, data_type):
+        """Unpack a new instance of the specified type from the image.
+        
+        Parameters
+        ----------
+        address : int
+            The absolute address of the value in the image. The returned
+            instance will be given this address.
+        data_type : :py:class:`.DataType`
+            The type of the value.
+        
+        Returns
+        -------
+        :py:class:`.Instance`
+        """
+        instance = data_type()
+        instance.unpack_from(self.buffer,
+                             self._offset(address, instance.size),
+                             self.endianness)
+        instance.address = address
+        return instance
+    
+    def view(self, address, data_type):
+        """Get a lightweight view of a value of the specified type in the
+        image.
+        
+        Parameters
+        ----------
+        address : int
+            The absolute address of the value in the image.
+        data_type : :py:class:`.DataType`
+            The type of the value. Must be a struct, union or array type (or a
+            typedef of one).
+        
+        Returns
+        -------
+        :py:class:`.View`
+        """
+        return data_type.view(self.buffer,
+                              self._offset(address, data_type.size),
+                              self.endianness)
+    
+    def deref(self, pointer):
+        """Unpack the value a pointer instance points at from the image.
+        
+        The value is unpacked (in place) into the instance referenced by the
+        pointer, i.e. :py:attr:`.PointerInstance.deref`.
+        
+        Parameters
+        ----------
+        pointer : :py:class:`.PointerInstance`
+        
+        Returns
+        -------
+        :py:class:`.Instance` or None
+            The instance pointed to or None if the pointer is NULL.
+        """
+        instance = pointer.deref
+        if instance is not None:
+            instance.unpack_from(self.buffer,
+                                 self._offset(instance.address, instance.size),
+                                 self.endianness)
+        return instance
+    
+    def store(self, instance):
+        """Pack an instance into the image at its address.
+        
+        Parameters
+        ----------
+        instance : :py:class:`.Instance`
+            The instance to pack. Must have been assigned an address within the
+            image (e.g. by :py:func:`.alloc`).
+        """
+        instance.pack_into(self.buffer,
+                           self._offset(instance.address, instance.size),
+                           self.endianness)
+
+
+def pack_image(instance, base_address=None, endianness=Endianness.little):
+    """Pack an instance and all instances reachable from it into a single
+    buffer laid out according to their addresses.
+    
+    All instances must already have been allocated addresses (e.g. using
+    :py:func:`.alloc`). Every instance is packed directly into place in a
+    single preallocated buffer.
+    
+    Parameters
+    ----------
+    instance : :py:class:`.Instance`
+        The instance to pack along with all instances it refers to (see
+        :py:meth:`.Instance.iter_instances`).
+    base_address : int or None
+        The address of the first byte of the returned buffer. If None, the
+        lowest address of any instance packed is used.
+    endianness : :py:class:`.Endianness`
+        The endianness to use to represent packed values. (Default:
+        little-endian).
+    
+    Returns
+    -------
+    (buffer, (start, end))
+        buffer is a :py:class:`bytearray` containing the packed instances and
+        start and end give the address of the first byte of the buffer and the
+        address immediately after the buffer respectively. Any bytes not
+        occupied by an instance are zero.
+    
+    Raises
+    ------
+    ValueError
+        If any instance hasn't been allocated an address or lies before the
+        base address.
+    PointerToUndefinedMemoryAddress
+        If a pointer refers to an instance without an address.
+    """
+    instances = list(instance.iter_instances())
+    
+    # Determine the address range spanned by all instances
+    for i in instances:
+        if i.address is None:
+            raise ValueError(
+                "{} has not been allocated an address".format(repr(i)))
+    start = min(i.address for i in instances)
+    end = max(i.address + i.size for i in instances)
+    if base_address is not None:
+        if start < base_address:
+            raise ValueError(
+                "instance at 0x{:X} lies before the base address "
+                "0x{:X}".format(start, base_address))
+        start = base_address
+    end = max(start, end)
+    
+    buffer = bytearray(end - start)
+    for i in instances:
+        i.pack_into(buffer, i.address - start, endianness)
+    
+    return (buffer, (start, end))
+
+
+def write_image(instance, fileobj, base_address=None,
+                endianness=Endianness.little, buffer_size=1024 * 1024,
+                sparse=False):
+    """Write an instance and all instances reachable from it into a file laid
+    out according to their addresses.
+    
+    Unlike :py:func:`.pack_image`, the whole image is never held in memory.
+    Instances are packed, in address order, into a fixed-size buffer which is
+    written to the file whenever it fills up. Adjacent instances are therefore
+    written using a small number of large sequential writes.
+    
+    Parameters
+    ----------
+    instance : :py:class:`.Instance`
+        The instance to write along with all instances it refers to (see
+        :py:meth:`.Instance.iter_instances`). All instances must already have
+        been allocated non-overlapping addresses (e.g. using
+        :py:func:`.alloc`).
+    fileobj : file-like object
+        The (binary) file to write to. The image is written starting at the
+        file's current position which corresponds with the base address.
+    base_address : int or None
+        The address corresponding with the current position in the file. If
+        None, the lowest address of any instance written is used.
+    endianness : :py:class:`.Endianness`
+        The endianness to use to represent packed values. (Default:
+        little-endian).
+    buffer_size : int
+        The size (in bytes) of the buffer used to accumulate instances before
+        writing them to the file. Instances larger than the buffer are packed
+        and written individually. (Default: 1 MiB)
+    sparse : bool
+        If False, gaps between instances are filled with zeros. If True, gaps
+        are skipped by seeking forward which, for files on most filesystems,
+        results in a sparse file. (Default: False)
+    
+    Returns
+    -------
+    (start, end)
+        The address of the first byte written and the address immediately
+        after the last byte written.
+    
+    Raises
+    ------
+    ValueError
+        If any instance hasn't been allocated an address, lies before the base
+        address or overlaps another instance.
+    PointerToUndefinedMemoryAddress
+        If a pointer refers to an instance without an address.
+    """
+    instances = list(instance.iter_instances())
+    for i in instances:
+        if i.address is None:
+            raise ValueError(
+                "{} has not been allocated an address".format(repr(i)))
+    instances.sort(key=(lambda i: i.address))
+    
+    start = instances[0].address if base_address is None else base_address
+    
+    buffer = bytearray(buffer_size)
+    buffer_view = memoryview(buffer)
+    zeros = memoryview(bytes(buffer_size))
+    
+    # The address of the first byte in the buffer and the number of bytes of
+    # the buffer in use.
+    buffer_address = start
+    buffer_used = 0
+    
+    for i in instances:
+        address = i.address
+        size = i.size
+        
+        # Deal with any gap between the end of the previous instance and this
+        # one.
+        gap = address - (buffer_address + buffer_used)
+        if gap < 0:
+            raise ValueError(
+                "{} at 0x{:X} overlaps a previous instance or lies before the "
+                "base address".format(repr(i), address))
+        elif gap > 0 and sparse:
+            fileobj.write(buffer_view[:buffer_used])
+            fileobj.seek(gap, io.SEEK_CUR)
+            buffer_address = address
+            buffer_used = 0
+        else:
+            while gap:
+                n = min(gap, buffer_size - buffer_used)
+                buffer[buffer_used:buffer_used + n] = zeros[:n]
+                buffer_used += n
+                gap -= n
+                if buffer_used == buffer_size:
+                    fileobj.write(buffer_view)
+                    buffer_address += buffer_used
+                    buffer_used = 0
+        
+        # Flush the buffer if the instance won't fit
+        if size > buffer_size - buffer_used:
+            fileobj.write(buffer_view[:buffer_used])
+            buffer_address += buffer_used
+            buffer_used = 0
+        
+        if size > buffer_size:
+            # The instance is too big to fit in the buffer at all
+            fileobj.write(i.pack(endianness))
+            buffer_address += size
+        else:
+            i.pack_into(buffer, buffer_used, endianness)
+            buffer_used += size
+    
+    fileobj.write(buffer_view[:buffer_used])
+    
+    return (start, buffer_address + buffer_used)
+
+
+def load_image(buffer, base_address, data_type, address,
+               endianness=Endianness.little):
+    """Unpack an instance from a packed memory image along with every instance
+    reachable from it via pointers.
+    
+    This is the inverse of :py:func:`.pack_image`. The instance at the
+    specified address is unpacked and then, in turn, the instance pointed to
+    by every non-NULL pointer it contains is unpacked (in place, into
+    :py:attr:`.PointerInstance.deref`) from the same image, and so on.
+    
+    Pointed-to instances are identified by their address and type so that an
+    instance referenced more than once (e.g. by the last node of a circular
+    linked list) is only unpacked once. Likewise, a pointer to a value within
+    another loaded instance (e.g. a struct member or array element) refers to
+    that member, regardless of which is reached first. The data structure is
+    traversed iteratively and so arbitrarily long chains of pointers (e.g.
+    large linked lists) may be loaded.
+    
+    .. note::
+        Pointers within unions are not followed since it is not known which
+        member of the union (if any) holds a valid pointer.
+    
+    Parameters
+    ----------
+    buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+            :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+        The image data.
+    base_address : int
+        The address of the first byte of the buffer.
+    data_type : :py:class:`.DataType`
+        The type of the (root) instance to load.
+    address : int
+        The address of the (root) instance to load.
+    endianness : :py:class:`.Endianness`
+        The endianness of values within the image. (Default: little-endian).
+    
+    Returns
+    -------
+    :py:class:`.Instance`
+        The root instance, with its address set.
+    
+    Raises
+    ------
+    ValueError
+        If any instance to be loaded lies outside the image or if an instance
+        is pointed to by more than one pointer (since only one pointer may
+        refer to any given instance).
+    """
+    image = Image(buffer, base_address, endianness)
+    loader = _ImageLoader(image)
+    
+    root = image.at(address, data_type)
+    loader.register(root)
+    
+    # Load (or link to already loaded) instances pointed to
+    pointers = loader.pointers
+    while pointers:
+        pointer = pointers.pop()
+        target = pointer.deref
+        existing = loader.lookup(target.address, target.data_type)
+        if existing is None:
+            image.deref(pointer)
+            loader.register(target)
+        elif existing._referrer is None:
+            pointer.deref = existing
+        else:
+            raise ValueError(
+                "{} at 0x{:X} is pointed to by more than one "
+                "pointer".format(existing.data_type.name, target.address))
+    
+    return root
+
+
+class _ImageLoader(object):
+    """For internal use. Keeps track of the instances loaded from an image by
+    :py:func:`.load_image` so that each value in the image is represented by
+    exactly one instance.
+    
+    Attributes
+    ----------
+    pointers : [:py:class:`.PointerInstance`, ...]
+        The non-NULL pointers within registered instances which have not yet
+        been followed.
+    """
+    
+    def __init__(self, image):
+        self.image = image
+        self.pointers = []
+        
+        # Lookup from (address, type name) to the instances loaded so far,
+        # including instances contained within them.
+        self._loaded = {}
+        
+        # Instances loaded in their own right (i.e. the root and pointer
+        # targets) which are not contained by any other loaded instance.
+        # {(address, type name): instance, ...}
+        self._top_level = {}
+        
+        # The elements of primitive arrays are only created on demand (see
+        # PrimitiveArrayInstance) and so are found by address instead. Arrays
+        # are listed in address order.
+        self._primitive_array_addresses = []
+        self._primitive_arrays = []
+    
+    def register(self, instance):
+        """Record a newly unpacked instance and everything it contains.
+        
+        Any previously loaded top-level instance which coincides with a member
+        of the new instance takes that member's place (i.e. becomes contained
+        by the new instance) so that pointers to it and to the new instance
+        agree.
+        """
+        self._top_level[(instance.address, instance.data_type.name)] = instance
+        
+        to_register = [instance]
+        while to_register:
+            instance = to_register.pop()
+            key = (instance.address, instance.data_type.name)
+            
+            if instance._container is not None:
+                existing = self._top_level.get(key)
+                if (existing is not None and
+                        existing._container is None and
+                        existing.data_type == instance.data_type and
+                        _replace_child(instance, existing)):
+                    # The existing instance (and its contents) are already
+                    # registered.
+                    del self._top_level[key]
+                    continue
+            
+            self._loaded.setdefault(key, instance)
+            if isinstance(instance, PointerInstance):
+                if instance.deref is not None:
+                    self.pointers.append(instance)
+            elif isinstance(instance, PrimitiveArrayInstance):
+                self._register_primitive_array(instance)
+            elif not isinstance(instance, UnionInstance):
+                to_register.extend(instance._iter_children())
+    
+    def _register_primitive_array(self, array):
+        """Record a newly unpacked primitive array, adopting any previously
+        loaded top-level instances which coincide with its elements."""
+        address = array.address
+        index = bisect_right(self._primitive_array_addresses, address)
+        self._primitive_array_addresses.insert(index, address)
+        self._primitive_arrays.insert(index, array)
+        
+        base_type = array.data_type.base_type
+        element_size = base_type.size
+        keys = ((address + (i * element_size), base_type.name)
+                for i in range(len(array)))
+        if len(self._top_level) < len(array):
+            keys = [key for key in self._top_level
+                    if key[1] == base_type.name and
+                    self._element_index(array, key[0]) is not None]
+        for key in keys:
+            existing = self._top_level.get(key)
+            if (existing is not None and
+                    existing is not array and
+                    existing._container is None and
+                    existing.data_type == base_type):
+                array[self._element_index(array, key[0])] = existing
+                del self._top_level[key]
+    
+    @staticmethod
+    def _element_index(array, address):
+        """Get the index of the element of an array at the given address or
+        None if no element lies at that address."""
+        offset = address - array.address
+        element_size = array.data_type.base_type.size
+        if (0 <= offset < array.size and offset % element_size == 0):
+            return offset // element_size
+        else:
+            return None
+    
+    def lookup(self, address, data_type):
+        """Get the loaded instance of the given type at the given address or
+        None if no such instance has been loaded."""
+        key = (address, data_type.name)
+        instance = self._loaded.get(key)
+        if instance is None:
+            # The instance may be an element of a primitive array
+            index = bisect_right(self._primitive_array_addresses, address)
+            if index:
+                array = self._primitive_arrays[index - 1]
+                element_index = self._element_index(array, address)
+                if (element_index is not None and
+                        array.data_type.base_type == data_type):
+                    instance = array[element_index]
+                    self._loaded[key] = instance
+        return instance
+
+
+def _replace_child(child, instance):
+    """Replace a child of a container with another instance of the same type.
+    
+    Returns
+    -------
+    bool
+        True if the child was replaced, False if its container does not
+        support this.
+    """
+    container = child._container
+    if isinstance(container, ArrayInstance):
+        container[child._container_key] = instance
+    elif isinstance(container, StructInstance):
+        setattr(container, child._container_key, instance)
+    else:
+        return False
+    return True
@@ -1,5 +1,7 @@
 """A simple padding type."""
 
+import struct
+
 from cdata.base import DataType, Instance
 
 from cdata.endianness import Endianness
@@ -13,6 +15,8 @@ class Padding(DataType):
     returns that value when packed. By default they pack into null bytes.
     """
     
+    _is_scalar = True
+    
     def __init__(self, length, doc=""):
         """Define a new padding value type which pads the specified number of
         bytes.
@@ -33,6 +37,38 @@ class Padding(DataType):
     def __call__(self):
         return PaddingInstance(self)
     
+    @property
+    def alignment(self):
+        return 1
+    
+    @property
+    def _flat_format(self):
+        return "{}s".format(self.length)
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype("V{}".format(self.length))
+    
+    def _view_get(self, buffer, offset, endianness):
+        return bytes(buffer[offset:offset + self.length])
+    
+    def _view_set(self, buffer, offset, endianness, value):
+        self._check_length(value)
+        buffer[offset:offset + self.length] = value
+    
+    def _check_length(self, value):
+        """Check a padding value is the right length."""
+        if len(value) != self.length:
+            raise ValueError("expected {} bytes of padding, got {}".format(
+                self.length, len(value)))
+    
+    def _decode(self, values):
+        return next(values)
+    
+    def _encode(self, value, values):
+        self._check_length(value)
+        values.append(bytes(value))
+    
     def declare(self, identifier=""):
         return "char{}[{}]".format(" {}".format(identifier).rstrip(),
                                    self.length)
@@ -40,6 +76,8 @@ class Padding(DataType):
 class PaddingInstance(Instance):
     """An instance of a padding value."""
     
+    __slots__ = ("_bytes", )
+    
     def __init__(self, data_type):
         assert isinstance(data_type, Padding)
         super(PaddingInstance, self).__init__(data_type)
@@ -48,10 +86,6 @@ class PaddingInstance(Instance):
         # null bytes.
         self._bytes = bytearray([0] * self.data_type.length)
     
-    @property
-    def size(self):
-        return self.data_type.length
-    
     @property
     def literal(self):
         length = self.data_type.length
@@ -62,10 +96,27 @@ class PaddingInstance(Instance):
         return bytes(self._bytes)
     
     def unpack(self, data, endianness=Endianness.little):
+        if len(data) != self.data_type.length:
+            raise struct.error("unpack requires a buffer of {} bytes".format(
+                self.data_type.length))
         self._bytes[:] = data
         
         # Not entirely meaningful, but honest.
         self._value_changed()
     
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        buffer[offset:offset + self.data_type.length] = self._bytes
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self.unpack(buffer[offset:offset + self.data_type.length])
+    
+    def _flatten(self, values):
+        values.append(bytes(self._bytes))
+    
+    def _unflatten(self, values):
+        self.unpack(next(values))
+    
     def __str__(self):
         return str(bytes(self._bytes))
@@ -1,7 +1,5 @@
 """Allow definition of C pointers to existing types."""
 
-import struct
-
 from six import integer_types
 
 from cdata.base import DataType, Instance
@@ -21,6 +19,8 @@ class Pointer(DataType):
         64: "Q",
     }
     
+    _is_scalar = True
+    
     def __init__(self, base_type, pointer_size=32, doc=""):
         """Define a pointer type.
         
@@ -50,6 +50,36 @@ class Pointer(DataType):
     def __call__(self, *args, **kwargs):
         return PointerInstance(self, *args, **kwargs)
     
+    @property
+    def _flat_format(self):
+        return self._struct_format
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype("{}u{}".format(endianness.value,
+                                          self.size))
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self.codec(endianness).unpack_from(buffer, offset)[0]
+    
+    def _view_set(self, buffer, offset, endianness, address):
+        self._check_address(address)
+        self.codec(endianness).pack_into(buffer, offset, address)
+    
+    def _check_address(self, address):
+        """Check the address is within the allowable range."""
+        if address & ~((1 << self.pointer_size) - 1):
+            raise ValueError(
+                "Address 0x{:X} out of range of pointer type {}".format(
+                    address, repr(self)))
+    
+    def _decode(self, values):
+        return next(values)
+    
+    def _encode(self, address, values):
+        self._check_address(address)
+        values.append(address)
+    
     def iter_types(self, _generated=None):
         if _generated is None:
             _generated = set()
@@ -78,6 +108,8 @@ class PointerInstance(Instance):
     directly will not cause the instance to be replaced.
     """
     
+    __slots__ = ("_deref", )
+    
     def __init__(self, data_type, value_or_address=None):
         super(PointerInstance, self).__init__(data_type)
         
@@ -200,10 +232,6 @@ class PointerInstance(Instance):
             inst.address = address
             self.deref = inst
     
-    @property
-    def size(self):
-        return struct.calcsize("<" + self.data_type._struct_format)
-    
     @property
     def literal(self):
         if self.deref is None:
@@ -212,19 +240,34 @@ class PointerInstance(Instance):
             return "&{}".format(self.deref.literal)
     
     def pack(self, endianness=Endianness.little):
+        values = []
+        self._flatten(values)
+        return self.data_type.codec(endianness).pack(*values)
+    
+    def unpack(self, data, endianness=Endianness.little):
+        self.ref = self.data_type.codec(endianness).unpack(data)[0]
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        values = []
+        self._flatten(values)
+        self.data_type.codec(endianness).pack_into(buffer, offset, *values)
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self.ref = self.data_type.codec(endianness).unpack_from(buffer,
+                                                                offset)[0]
+    
+    def _flatten(self, values):
         if self.deref is None:
-            address = 0
+            values.append(0)
         elif self.deref.address is not None:
-            address = self.deref.address
+            values.append(self.deref.address)
         else:
             raise PointerToUndefinedMemoryAddress(self.deref)
-        
-        return struct.pack(
-            endianness.value + self.data_type._struct_format, address)
     
-    def unpack(self, data, endianness=Endianness.little):
-        self.ref = struct.unpack(
-            endianness.value + self.data_type._struct_format, data)[0]
+    def _unflatten(self, values):
+        self.ref = next(values)
     
     def __str__(self):
         if self.deref is None:
@@ -232,20 +275,10 @@ class PointerInstance(Instance):
         else:
             return str(self.deref)
 
-    def iter_instances(self, _generated=None):
-        if _generated is None:
-            _generated = set()
-        
-        if self not in _generated:
-            # Iterate over this instance as usual (this will add self to
-            # _generated).
-            for ref in super(PointerInstance, self).iter_instances(_generated):
-                yield ref
-            
-            # Then iterate over the pointed-to value
-            if self.deref is not None:
-                for ref in self.deref.iter_instances(_generated):
-                    yield ref
+    def _iter_related(self):
+        # Iterate over the pointed-to value
+        if self._deref is not None:
+            yield self._deref
 
 def pointer(instance):
     """Convenience function create a pointer instance which points to the
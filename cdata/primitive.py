@@ -1,7 +1,6 @@
 """Primitive C data types e.g. int, char."""
 
 import builtins
-import struct
 
 from six import integer_types
 
@@ -12,6 +11,16 @@ from cdata.endianness import Endianness
 from cdata.utils import char_literal
 
 
+# Mapping from struct format character to NumPy type kind
+NUMPY_KINDS = {
+    "c": "S",
+    "?": "b",
+    "b": "i", "h": "i", "i": "i", "l": "i", "q": "i",
+    "B": "u", "H": "u", "I": "u", "L": "u", "Q": "u",
+    "f": "f", "d": "f",
+}
+
+
 class Primitive(DataType):
     """Defines generic primitive data-types as supported by :py:mod:`struct`.
     
@@ -20,6 +29,8 @@ class Primitive(DataType):
     arrays, strings and pointers.
     """
     
+    _is_scalar = True
+    
     def __init__(self, name, struct_format, default_value,
                  cast, to_literal=repr, native=False, doc=""):
         """Define a new primitive type.
@@ -49,6 +60,29 @@ class Primitive(DataType):
         if value is None:
             value = self.default_value
         return PrimitiveInstance(self, value)
+    
+    @property
+    def _flat_format(self):
+        return self.struct_format
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        import numpy
+        return numpy.dtype("{}{}{}".format(
+            endianness.value,
+            NUMPY_KINDS[self.struct_format],
+            self.size))
+    
+    def _decode(self, values):
+        return next(values)
+    
+    def _encode(self, value, values):
+        values.append(self.cast(value))
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self.codec(endianness).unpack_from(buffer, offset)[0]
+    
+    def _view_set(self, buffer, offset, endianness, value):
+        self.codec(endianness).pack_into(buffer, offset, self.cast(value))
 
 
 class PrimitiveInstance(Instance):
@@ -57,6 +91,8 @@ class PrimitiveInstance(Instance):
     The value of the primitive is accessed via the :py:meth:`.value` accessor.
     """
     
+    __slots__ = ("_value", )
+    
     def __init__(self, data_type, value):
         assert isinstance(data_type, Primitive)
         super(PrimitiveInstance, self).__init__(data_type)
@@ -71,22 +107,30 @@ class PrimitiveInstance(Instance):
         self._value = self.data_type.cast(value)
         self._value_changed()
     
-    @property
-    def size(self):
-        return struct.calcsize("<" + self.data_type.struct_format)
-    
     @property
     def literal(self):
         return self.data_type.to_literal(self.value)
     
     def pack(self, endianness=Endianness.little):
-        return struct.pack(endianness.value + self.data_type.struct_format,
-                           self.value)
+        return self.data_type.codec(endianness).pack(self._value)
     
     def unpack(self, data, endianness=Endianness.little):
-        self.value = struct.unpack(endianness.value +
-                                   self.data_type.struct_format,
-                                   data)[0]
+        self.value = self.data_type.codec(endianness).unpack(data)[0]
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self.data_type.codec(endianness).pack_into(buffer, offset, self._value)
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        self.value = self.data_type.codec(endianness).unpack_from(buffer,
+                                                                  offset)[0]
+    
+    def _flatten(self, values):
+        values.append(self._value)
+    
+    def _unflatten(self, values):
+        self.value = next(values)
     
     def __str__(self):
         return str(self.value)
@@ -1,9 +1,17 @@
 """Allows the definition of structs."""
 
-from six import itervalues
+from six import iteritems, itervalues
+
+from collections import OrderedDict, namedtuple
+
+from keyword import iskeyword
+
+from collections.abc import Mapping
 
 from cdata.endianness import Endianness
 
+from cdata.base import _apply_pending_updates
+
 from cdata.complex_base import ComplexType, ComplexTypeInstance
 
 class Struct(ComplexType):
@@ -11,103 +19,232 @@ class Struct(ComplexType):
     
     def __init__(self, *args, native=False, doc=""):
         super(Struct, self).__init__("struct", *args, native=native, doc=doc)
+        self._record_type = None
+        
+        # Whether instances are packed member-by-member, computed on demand by
+        # _pack_by_member.
+        self._packs_by_member = None
     
     
     def __call__(self, *args, **kwargs):
         return StructInstance(self, *args, **kwargs)
+    
+    _has_packed_cache = True
+    
+    @property
+    def _pack_by_member(self):
+        """For internal use. True if instances are best packed by
+        concatenating the (cached) packed members rather than packing all
+        flattened values at once."""
+        if self._packs_by_member is None:
+            self._packs_by_member = any(data_type._has_packed_cache
+                                        for data_type
+                                        in itervalues(self._members))
+        return self._packs_by_member
+    
+    def _compute_layout(self):
+        # Members are packed back-to-back
+        offsets = OrderedDict()
+        offset = 0
+        for name, data_type in iteritems(self._members):
+            offsets[name] = offset
+            offset += data_type.size
+        return (offsets, offset)
+    
+    @property
+    def _flat_format(self):
+        # Structs are packed without padding so the format is simply the
+        # concatenation of the members' formats.
+        member_formats = [data_type._flat_format
+                          for data_type in itervalues(self._members)]
+        if None in member_formats:
+            return None
+        else:
+            return "".join(member_formats)
+    
+    @property
+    def record_type(self):
+        """The :py:func:`~collections.namedtuple` type used to represent
+        values of this struct by :py:meth:`.iter_unpack` (and accepted by
+        :py:meth:`.pack_many`). Its fields are the struct's members, except
+        that members whose names are not valid field names (e.g. Python
+        keywords such as ``from``) are named after their position (e.g.
+        ``_1``)."""
+        if self._record_type is None:
+            type_name = self._complex_type_name
+            if type_name is None or iskeyword(type_name):
+                type_name = "record"
+            self._record_type = namedtuple(type_name, list(self._members),
+                                           rename=True)
+        return self._record_type
+    
+    @property
+    def _record_decoder(self):
+        if all(data_type._is_scalar
+               for data_type in itervalues(self._members)):
+            # Fast path: the flattened values are the members' values
+            return self.record_type._make
+        else:
+            return super(Struct, self)._record_decoder
+    
+    def _decode(self, values):
+        return self.record_type._make([data_type._decode(values)
+                                       for data_type
+                                       in itervalues(self._members)])
+    
+    def _encode(self, value, values):
+        if isinstance(value, Mapping):
+            unknown = set(value).difference(self._members)
+            if unknown:
+                raise ValueError("{} has no member{} {}".format(
+                    repr(self),
+                    "" if len(unknown) == 1 else "s",
+                    ", ".join(sorted(unknown))))
+            
+            for name, data_type in iteritems(self._members):
+                if name in value:
+                    data_type._encode(value[name], values)
+                else:
+                    # Omitted members take their default value
+                    values.extend(data_type._default_flattened)
+        else:
+            if len(value) != len(self._members):
+                raise ValueError("expected {} values for {}, got {}".format(
+                    len(self._members), repr(self), len(value)))
+            
+            for data_type, member_value in zip(itervalues(self._members),
+                                               value):
+                data_type._encode(member_value, values)
 
 
 class StructInstance(ComplexTypeInstance):
     """An instance of a struct type."""
     
+    __slots__ = ("_ignore_child_value_changed", "_packed")
+    
     def __init__(self, *args, **kwargs):
         # Used to suppress value changed notifications during unpacking
         self._ignore_child_value_changed = False
         
+        # The packed form of the struct for each endianness it has been packed
+        # with since it last changed (or None until it is first packed).
+        self._packed = None
+        
         super(StructInstance, self).__init__(*args, **kwargs)
-        # This will cause any child instances to have their addresses reset
+        
+        # Now all members have been populated, set the address (informing the
+        # referrers of any members of their new address) in one pass.
         self.address = None
     
-    @property
-    def address(self):
-        return self._address
+    def pack(self, endianness=Endianness.little):
+        # Make sure the cache reflects any deferred changes
+        _apply_pending_updates()
+        
+        if self._packed is None:
+            self._packed = {}
+        packed = self._packed.get(endianness)
+        if packed is None:
+            codec = self.data_type.codec(endianness)
+            if codec is None or self.data_type._pack_by_member:
+                # Concatenate the (possibly cached) packed members
+                packed = b"".join(
+                    instance.pack(endianness)
+                    for instance in self._member_instances)
+            else:
+                # Pack all (flattened) fields in one go
+                values = []
+                self._flatten(values)
+                packed = codec.pack(*values)
+            self._packed[endianness] = packed
+        return packed
     
-    @address.setter
-    def address(self, address):
-        self._address = address
+    def unpack(self, data, endianness=Endianness.little):
+        self.unpack_from(data, 0, endianness)
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        _apply_pending_updates()
         
-        # Must also update the addresses of all the struct members
-        for instance in itervalues(self._member_instances):
-            # During initialisation this setter will be called and at that point
-            # in time the instance will not have been assigned so we should just
-            # skip it.
-            if instance is None:
-                continue
-            
-            instance.address = address
-            
-            # The address may have been changed to None
-            if address is not None:
-                address += instance.size
+        packed = None if self._packed is None else self._packed.get(endianness)
+        if packed is not None:
+            buffer[offset:offset + self.size] = packed
+            return
         
-        # Notify any containers
-        self._address_changed()
+        codec = self.data_type.codec(endianness)
+        if codec is None or self.data_type._pack_by_member:
+            # Pack each member in place (using any cached packed members)
+            offsets = self.data_type._member_offsets
+            for name, instance in self._iter_members():
+                instance.pack_into(buffer, offset + offsets[name], endianness)
+        else:
+            values = []
+            self._flatten(values)
+            codec.pack_into(buffer, offset, *values)
     
-    @property
-    def size(self):
-        return sum(i.size for i in itervalues(self._member_instances))
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_buffer(buffer, offset)
+        codec = self.data_type.codec(endianness)
+        if codec is not None:
+            self._unflatten(iter(codec.unpack_from(buffer, offset)))
+            return
+        
+        self._ignore_child_value_changed = True
+        
+        offsets = self.data_type._member_offsets
+        for name, instance in self._iter_members():
+            instance.unpack_from(buffer, offset + offsets[name], endianness)
+        
+        self._ignore_child_value_changed = False
+        self._value_changed()
     
-    def pack(self, endianness=Endianness.little):
-        # Just concatenate all the fields (without any padding bytes) to get the
-        # total struct size
-        return b"".join(i.pack(endianness)
-                        for i in itervalues(self._member_instances))
+    def _flatten(self, values):
+        for instance in self._member_instances:
+            instance._flatten(values)
     
-    def unpack(self, data, endianness=Endianness.little):
+    def _unflatten(self, values):
         self._ignore_child_value_changed = True
         
-        for instance in itervalues(self._member_instances):
-            this_data, data = data[:instance.size], data[instance.size:]
-            instance.unpack(this_data, endianness)
+        for instance in self._member_instances:
+            instance._unflatten(values)
         
         self._ignore_child_value_changed = False
         self._value_changed()
     
+    def _iter_related(self):
+        # All members are current
+        return self._iter_children()
+    
     def _child_value_changed(self, child):
+        self._packed = None
         if not self._ignore_child_value_changed:
-            self._value_changed()
+            self._deferrable_value_changed()
     
     def _child_address_changed(self, child):
         """When a child's address is changed, thrown an exception if it is
         inconsistent (after changing it back)."""
+        address = self._child_address(child)
+        if child._address != address:
+            # Fix the address before throwing the exception
+            child._address = address
+            raise ValueError("The address of {} is defined by its "
+                             "containing struct, {}, as {}".format(
+                                 repr(child), repr(self), address))
+    
+    def _child_address(self, child):
+        return self._member_address(child._container_key)
+    
+    def _member_address(self, name):
+        """Get the address the named member should have."""
         address = self.address
-        
-        # Find the child member in the struct (while calculating the appropriate
-        # address along the way)
-        for instance in itervalues(self._member_instances):
-            if instance is child:
-                if instance.address != address:
-                    # Fix the address before throwing the exception
-                    instance.address = address
-                    raise ValueError("The address of {} is defined by its "
-                                     "containing struct, {}, as {}".format(
-                                         repr(child), repr(self), address))
-                else:
-                    # The child's address is consistent with what it should be
-                    return
-            
-            # Note that the address may be None in which case it can't be
-            # incremented.
-            if address is not None:
-                address += instance.size
-        
-        # If we got here, the child was not a member of the struct which means
-        # there has been a bug somewhere.
-        assert False, (  # pragma: no cover
-            "Child is not a member of this struct. This is a bug.")
+        if address is None:
+            return None
+        else:
+            return address + self.data_type._member_offsets[name]
     
     def _set_member(self, name, instance):
         super(StructInstance, self)._set_member(name, instance)
         
-        # Re-compute all addresses in order to assign an address to this member
-        self.address = self.address
+        # Assign the new member its address (during initialisation all
+        # addresses are assigned together afterwards).
+        if not self._initialising:
+            instance.address = self._member_address(name)
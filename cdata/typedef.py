@@ -2,6 +2,8 @@
 
 from cdata.base import DataType, Instance
 
+from cdata.endianness import Endianness
+
 from cdata.utils import comment
 
 class Typedef(DataType):
@@ -9,11 +11,66 @@ class Typedef(DataType):
     
     def __init__(self, name, base_type, native=False, doc=""):
         self.base_type = base_type
+        
+        # The TypedefInstance subclass shared by all instances of this typedef
+        # (created when the first instance is).
+        self._instance_class = None
+        
         super(Typedef, self).__init__(name, native, doc)
     
     def __call__(self, *args, **kwargs):
         return TypedefInstance(self, *args, **kwargs)
     
+    @property
+    def _flat_format(self):
+        return self.base_type._flat_format
+    
+    @property
+    def size(self):
+        return self.base_type.size
+    
+    @property
+    def alignment(self):
+        return self.base_type.alignment
+    
+    def view(self, buffer, offset=0, endianness=Endianness.little):
+        """Get a :py:class:`.View` of a value of the typedef'd type packed in
+        the supplied buffer (see :py:meth:`.ComplexType.view`)."""
+        return self.base_type.view(buffer, offset, endianness)
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        return self.base_type.to_numpy_dtype(endianness)
+    
+    @property
+    def _is_scalar(self):
+        return self.base_type._is_scalar
+    
+    @property
+    def _has_packed_cache(self):
+        return self.base_type._has_packed_cache
+    
+    @property
+    def _record_decoder(self):
+        return self.base_type._record_decoder
+    
+    def _decode(self, values):
+        return self.base_type._decode(values)
+    
+    def _decode_many(self, values, count):
+        return self.base_type._decode_many(values, count)
+    
+    def _encode(self, value, values):
+        self.base_type._encode(value, values)
+    
+    def _view_get(self, buffer, offset, endianness):
+        return self.base_type._view_get(buffer, offset, endianness)
+    
+    def _view_set(self, buffer, offset, endianness, value):
+        if getattr(value, "data_type", None) == self:
+            value.pack_into(buffer, offset, endianness)
+        else:
+            self.base_type._view_set(buffer, offset, endianness, value)
+    
     @property
     def definition(self):
         definition = "typedef {};".format(self.base_type.declare(self.name))
@@ -44,12 +101,15 @@ class TypedefInstance(Instance):
     that something is going on.
     """
     
+    __slots__ = ("_base_instance", )
+    
     def __init__(self, typedef, *args, **kwargs):
         super(TypedefInstance, self).__init__(typedef)
         
         # We act like a container since when reporting changes, the reported
         # instance must be the typedef instance and not the base instance.
         assert self._base_instance._container is None
+        self._address = self._base_instance._address
         self._base_instance._container = self
     
     @property
@@ -58,48 +118,71 @@ class TypedefInstance(Instance):
                                self._base_instance.literal)
     
     def _child_value_changed(self, child):
-        self._value_changed()
+        self._deferrable_value_changed()
     
     def _child_address_changed(self, child):
+        # The typedef instance's own address mirrors that of the base instance
+        self._address = child._address
         self._address_changed()
     
+    def _child_address(self, child):
+        # The base instance shares the typedef instance's address
+        if self._container is None:
+            return self._address
+        else:
+            return self._container._child_address(self)
+    
+    def _flatten(self, values):
+        self._base_instance._flatten(values)
+    
+    def _unflatten(self, values):
+        self._base_instance._unflatten(values)
+    
+    def _iter_children(self):
+        yield self._base_instance
+    
+    # Members of the Instance API which are forwarded explicitly since, being
+    # defined by this class, they would never reach __getattr__.
+    @property
+    def address(self):
+        return self._base_instance.address
+    
+    @property
+    def size(self):
+        return self._base_instance.size
+    
+    def pack(self, endianness=Endianness.little):
+        return self._base_instance.pack(endianness)
+    
+    def unpack(self, data, endianness=Endianness.little):
+        self._base_instance.unpack(data, endianness)
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._base_instance.pack_into(buffer, offset, endianness)
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
+        self._base_instance.unpack_from(buffer, offset, endianness)
+    
     # A list of members of this method which this instance overrides (i.e. which
-    # __getattribute__ and __setattr__ shouldn't intercept).
+    # __setattr__ shouldn't intercept).
     OVERRIDDEN_MEMBERS = set([
         "data_type",
         "literal",
         "iter_instances",
     ])
     
-    def __getattribute__(self, attr):
-        if attr in type(self).OVERRIDDEN_MEMBERS or attr.startswith("_"):
-            return super(TypedefInstance, self).__getattribute__(attr)
-        else:
-            _base_instance = \
-                super(TypedefInstance, self).__getattribute__("_base_instance")
-            return getattr(_base_instance, attr)
+    def __getattr__(self, attr):
+        # Only called for attributes this instance doesn't have: anything
+        # public must belong to the base instance.
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self._base_instance, attr)
     
     def __setattr__(self, attr, value):
-        if attr in type(self).OVERRIDDEN_MEMBERS or attr.startswith("_"):
+        if attr in self.OVERRIDDEN_MEMBERS or attr.startswith("_"):
             super(TypedefInstance, self).__setattr__(attr, value)
         else:
-            self._base_instance.__setattr__(attr, value)
-
-    def iter_instances(self, _generated=None):
-        if _generated is None:
-            _generated = set()
-        
-        if self not in _generated:
-            # Iterate over this instance as usual (this will add self to
-            # _generated).
-            for ref in super(TypedefInstance, self).iter_instances(_generated):
-                yield ref
-            
-            # Then iterate over the wrapped instance (which notably will not
-            # list itself since it is contained by this typedef, but rather will
-            # include anything they reference).
-            for ref in self._base_instance.iter_instances(_generated):
-                yield ref
+            setattr(self._base_instance, attr, value)
     
     
     # The set of all special functions of the base type which will be wrapped by
@@ -112,20 +195,31 @@ class TypedefInstance(Instance):
         "__contains__"])
     
     def __new__(cls, typedef, *args, **kwargs):
-        """Set up the TypedefInstance such that it wraps all special functions
-        of the wrapped type."""
-        # First create subclass of the TypedefInstance since we need to modify
-        # it to include the wrapped special methods
-        cls = type(cls.__name__, (TypedefInstance, ), {})
+        """Create an instance of the typedef's wrapper class which wraps all
+        special functions of the wrapped type."""
+        base_instance = typedef.base_type(*args, **kwargs)
         
-        # Create the base type instance and embed a reference to it in the class
-        cls._base_instance = typedef.base_type(*args, **kwargs)
+        # All instances of a typedef share a single subclass of TypedefInstance
+        # which includes the wrapped special methods. This is required since
+        # Python calls these directly without going via __getattr__.
+        if typedef._instance_class is None:
+            base_class = type(base_instance)
+            typedef._instance_class = type(
+                cls.__name__, (TypedefInstance, ),
+                dict(__slots__=(),
+                     **{attr: _wrap_special_function(attr)
+                        for attr in cls.WRAPPABLE_FUNCTIONS
+                        if hasattr(base_class, attr)}))
         
-        # Next add any magic methods from the function being wrapped. This is
-        # required since Python can call these directly without going via
-        # __getattribute__.
-        for attr in dir(cls._base_instance):
-            if attr in cls.WRAPPABLE_FUNCTIONS:
-                setattr(cls, attr, getattr(cls._base_instance, attr))
+        self = super(TypedefInstance, cls).__new__(typedef._instance_class)
+        self._base_instance = base_instance
+        return self
+
 
-        return super(TypedefInstance, cls).__new__(cls)
+def _wrap_special_function(attr):
+    """Create a method which calls the named special function of the wrapped
+    instance."""
+    def wrapper(self, *args, **kwargs):
+        return getattr(self._base_instance, attr)(*args, **kwargs)
+    wrapper.__name__ = attr
+    return wrapper
@@ -2,24 +2,61 @@
 
 from six import itervalues
 
+from collections import OrderedDict
+
 from cdata.endianness import Endianness
 
+from cdata.base import \
+    _immediate_updates, _apply_pending_updates, _change_sequence
+
 from cdata.complex_base import ComplexType, ComplexTypeInstance
 
+from cdata.typedef import TypedefInstance
+
 class Union(ComplexType):
     """Define C-style unions."""
     
-    def __init__(self, *args, endianness=Endianness.little, native=False, doc=""):
+    def __init__(self, *args, endianness=Endianness.little, native=False,
+                 doc=""):
         super(Union, self).__init__("union", *args, native=native, doc=doc)
         self.endianness = endianness
     
     
     def __call__(self, *args, **kwargs):
         return UnionInstance(self, *args, **kwargs)
+    
+    def to_numpy_dtype(self, endianness=Endianness.little):
+        # Unions can only be represented in the endianness they were defined
+        # with (see UnionInstance.pack).
+        if endianness != self.endianness:
+            raise ValueError(
+                "Cannot represent {} defined as {}-endian, as "
+                "{}-endian".format(repr(self), self.endianness.name,
+                                   endianness.name))
+        
+        return super(Union, self).to_numpy_dtype(endianness)
+    
+    def _compute_layout(self):
+        # All members reside at the start of the union
+        offsets = OrderedDict((name, 0) for name in self._members)
+        size = max([data_type.size
+                    for data_type in itervalues(self._members)] or [0])
+        return (offsets, size)
 
 
 class UnionInstance(ComplexTypeInstance):
-    """An instance of a union type."""
+    """An instance of a union type.
+    
+    The value of the union is held in a single buffer shared by all members.
+    When a member's value changes, it is packed into this buffer and the other
+    members are only updated (unpacked from the buffer) when they are next
+    accessed via the union (e.g. ``my_union.member``). As a consequence, a
+    reference to a member retained from before a sibling was changed may hold
+    an out-of-date value until it is next accessed via the union.
+    """
+    
+    __slots__ = ("_ignore_child_value_changed", "_buffer", "_fresh_members",
+                 "_buffer_sequence")
     
     def __init__(self, data_type, *args, **kwargs):
         # If more than one initialiser is given, fail since there is no
@@ -34,11 +71,22 @@ class UnionInstance(ComplexTypeInstance):
             raise ValueError("At most one union member may be initialised.")
         
         # If this flag is set, all calls to _child_value_changed are ignored.
-        # This is required since when the union is changed all members of the
-        # struct must be overwritten. Initially disabled while initialisation
-        # takes place.
+        # This is required since members are updated from the shared buffer
+        # by unpacking them. Initially disabled while initialisation takes
+        # place.
         self._ignore_child_value_changed = True
         
+        # The packed value of the union (in the union's endianness), shared by
+        # all members.
+        self._buffer = bytearray(data_type.size)
+        
+        # The names of the members whose values are consistent with the
+        # buffer. Other members must be unpacked before they are accessed.
+        self._fresh_members = set()
+        
+        # The sequence number of the most recent change written to the buffer.
+        self._buffer_sequence = -1
+        
         super(UnionInstance, self).__init__(data_type, *args, **kwargs)
         
         # Re-enable child value change updates now the union has been
@@ -49,75 +97,57 @@ class UnionInstance(ComplexTypeInstance):
         self.address = None
         
         # Ensure consistent initial value by making it look like the member
-        # specified for initialisation got assigned. Otherwise, just run through
-        # the pack/unpack cycle to make everything the same in an arbitrary
-        # manner. (Note there can be at most one arg/kwarg.)
+        # specified for initialisation got assigned. Otherwise, just use the
+        # value of an arbitrary maximally-sized member. (Note there can be at
+        # most one arg/kwarg.)
         if kwargs_names:
-            self._child_value_changed(
-                self._member_instances[list(kwargs_names)[0]])
+            self._child_value_changed(self._member_instances[
+                self._member_indices[list(kwargs_names)[0]]])
         elif args:
-            self._child_value_changed(
-                getattr(self, list(self._member_instances)[0]))
-        else:
-            self.unpack(self.pack(self.data_type.endianness),
-                        self.data_type.endianness)
+            self._child_value_changed(self._member_instances[0])
+        elif self._member_instances:
+            self._child_value_changed(max(self._member_instances,
+                                          key=(lambda i: i.size)))
     
-    @property
-    def address(self):
-        return self._address
-    
-    @address.setter
-    def address(self, address):
-        self._address = address
-        
-        # Must also update the addresses of all the union members
-        for instance in itervalues(self._member_instances):
-            # During initialisation this setter will be called and at that point
-            # in time the instance will not have been assigned so we should just
-            # skip it.
-            if instance is None:
-                continue
-            
-            instance.address = address
-        
-        self._address_changed()
-    
-    @property
-    def size(self):
-        return max(i.size for i in itervalues(self._member_instances))
-    
-    def pack(self, endianness=Endianness.little):
-        # Must be using the same Endianness defined when the union was defined.
+    def _check_endianness(self, endianness, action):
+        """Throw a ValueError if the endianness differs from the endianness the
+        union was defined with."""
         if endianness != self.data_type.endianness:
             raise ValueError(
-                "Cannot pack {} defined as {}-endian, as {}-endian".format(
+                "Cannot {} {} defined as {}-endian, as {}-endian".format(
+                    action,
                     repr(self),
                     self.data_type.endianness.name,
                     endianness.name))
+    
+    def pack(self, endianness=Endianness.little):
+        # Must be using the same Endianness defined when the union was defined.
+        self._check_endianness(endianness, "pack")
+        
+        # Make sure the buffer reflects any deferred changes
+        _apply_pending_updates()
         
-        # Returns the packed form of an arbitrary maximally-sized member.
-        # XXX: This makes the assumption that a member never throws away any
-        # information it unpacks which *should* be a good assumption but isn't
-        # enforced...
-        _, instance = max((i.size, i)
-                          for i in itervalues(self._member_instances))
-        return instance.pack(endianness)
+        return bytes(self._buffer)
     
     def unpack(self, data, endianness=Endianness.little):
+        self.unpack_from(data, 0, endianness)
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        self._check_endianness(endianness, "pack")
+        self._check_buffer(buffer, offset)
+        _apply_pending_updates()
+        buffer[offset:offset + self.size] = self._buffer
+    
+    def unpack_from(self, buffer, offset=0, endianness=Endianness.little):
         # Must be using the same Endianness defined when the union was defined.
-        if endianness != self.data_type.endianness:
-            raise ValueError(
-                "Cannot unpack {} defined as {}-endian, as {}-endian".format(
-                    repr(self),
-                    self.data_type.endianness.name,
-                    endianness.name))
+        self._check_endianness(endianness, "unpack")
+        self._check_buffer(buffer, offset)
         
-        old_ignore_child_value_changed = self._ignore_child_value_changed
-        self._ignore_child_value_changed = True
-        for instance in itervalues(self._member_instances):
-            # Unpack the same data (or a subset thereof) into each member.
-            instance.unpack(data[:instance.size], endianness)
-        self._ignore_child_value_changed = old_ignore_child_value_changed
+        # Members are unpacked when they're next accessed. Note that this
+        # change supersedes any (earlier) deferred changes to members.
+        self._buffer[:] = buffer[offset:offset + self.size]
+        self._buffer_sequence = _change_sequence()
+        self._fresh_members.clear()
         
         if not self._ignore_child_value_changed:
             self._value_changed()
@@ -126,35 +156,182 @@ class UnionInstance(ComplexTypeInstance):
         """Throw a ValueError if any child's address is changed inconsistently
         with the union's address (after reverting the address to its previous
         value)."""
-        if child.address != self.address:
-            child.address = self.address
+        if child._address != self.address:
+            child._address = self.address
             raise ValueError("The address of {} is defined by its "
                              "containing union, {}, as {}".format(
                                  repr(child), repr(self), self.address))
     
+    def _child_address(self, child):
+        return self.address
+    
     def _child_value_changed(self, child):
-        """If a member's value changes, all other members must be updated
-        accordingly.
+        """If a member's value changes, pack it into the shared buffer: all
+        other members are now out of date.
         
-        In order to prevent uncontrolled recursion, all value-changed callbacks
-        are ignored while this function is called.
+        Within a :py:func:`.deferred_updates` context, changes to members
+        nested within a member may arrive late. The most recent change to any
+        member takes precedence (and members with older changes are reverted
+        to the union's value).
         """
-        if not self._ignore_child_value_changed:
+        if self._ignore_child_value_changed:
+            return
+        
+        name = child._container_key
+        sequence = _change_sequence()
+        if sequence >= self._buffer_sequence:
+            child.pack_into(self._buffer, 0, self.data_type.endianness)
+            self._buffer_sequence = sequence
+            self._fresh_members = set([name])
+        else:
+            self._fresh_members.discard(name)
+        
+        self._deferrable_value_changed()
+    
+    def _update_member(self, name):
+        """Unpack the named member from the buffer if it is out of date."""
+        if name not in self._fresh_members:
+            # Apply any pending changes to other members first
+            _apply_pending_updates()
+            
+            # The member's own notifications are all ignored and so needn't be
+            # deferred.
             self._ignore_child_value_changed = True
             try:
-                # Update the current packed value with the new contents
-                packed_value = bytearray(self.pack(self.data_type.endianness))
-                packed_value[:child.size] = child.pack(self.data_type.endianness)
-                
-                # Now unpack that into all children
-                self.unpack(packed_value, self.data_type.endianness)
-                
-                # Finally, report that the union's value was changed
-                self._value_changed()
+                with _immediate_updates():
+                    member = self._member_instances[self._member_indices[name]]
+                    member.unpack_from(self._buffer, 0,
+                                       self.data_type.endianness)
             finally:
                 self._ignore_child_value_changed = False
+            
+            self._fresh_members.add(name)
+    
+    def _current_member_names(self):
+        """The names of the members whose values are meaningful: all of
+        them for a plain union."""
+        return list(self.data_type._members)
+    
+    def _iter_current_members(self):
+        names = self._current_member_names()
+        for name in names:
+            self._update_member(name)
+        return [(name, self._member_instances[self._member_indices[name]])
+                for name in names]
+    
+    def _get_member(self, name):
+        self._update_member(name)
+        return super(UnionInstance, self)._get_member(name)
     
     def _set_member(self, member, instance):
         # Fix the address and update the union's value
         instance.address = self.address
         super(UnionInstance, self)._set_member(member, instance)
+
+
+class TaggedUnion(Union):
+    """Define a discriminated union: a union whose active member is selected by
+    a tag member (typically an enum) of the struct which contains it.
+    
+    Only the active member of a tagged union is packed and only the active
+    member is decoded when the union is displayed or its instances are
+    iterated over. If the active member cannot be determined (e.g. because
+    the union is not contained by a struct or because the tag's value does not
+    select any member), the union behaves like a plain :py:class:`.Union`.
+    """
+    
+    def __init__(self, *args, tag, variants, endianness=Endianness.little,
+                 native=False, doc=""):
+        """Define a tagged union.
+        
+        Parameters
+        ----------
+        *args
+            The union's name and members (see :py:class:`.Union`).
+        tag : str
+            The name of the member of the containing struct which selects the
+            active member of the union.
+        variants : {tag_value: member_name, ...}
+            The union member selected by each value of the tag. For enum tags,
+            values are given by name.
+        """
+        super(TaggedUnion, self).__init__(*args, endianness=endianness,
+                                          native=native, doc=doc)
+        
+        # Members mustn't be hidden by attributes of the instance
+        clashes = set(self._members).intersection(dir(TaggedUnionInstance))
+        if clashes:
+            raise ValueError("{} {} reserved member name{}".format(
+                ", ".join(clashes),
+                "is a" if len(clashes) == 1 else "are",
+                "" if len(clashes) == 1 else "s"))
+        
+        unknown = set(itervalues(variants)).difference(self._members)
+        if unknown:
+            raise ValueError("{} has no member{} {}".format(
+                repr(self),
+                "" if len(unknown) == 1 else "s",
+                ", ".join(sorted(unknown))))
+        
+        self.tag = tag
+        self.variants = dict(variants)
+    
+    def __call__(self, *args, **kwargs):
+        return TaggedUnionInstance(self, *args, **kwargs)
+
+
+class TaggedUnionInstance(UnionInstance):
+    """An instance of a tagged union type."""
+    
+    __slots__ = ()
+    
+    @property
+    def active_member(self):
+        """The name of the member selected by the tag of the containing struct
+        (or None if this cannot be determined)."""
+        # Look through any typedefs for the containing struct
+        container = self._container
+        while isinstance(container, TypedefInstance):
+            container = container._container
+        
+        if isinstance(container, ComplexTypeInstance):
+            tag = container._find_member(self.data_type.tag)
+        else:
+            tag = None
+        if tag is None:
+            return None
+        else:
+            return self.data_type.variants.get(tag.value)
+    
+    def _current_member_names(self):
+        name = self.active_member
+        if name is None:
+            return super(TaggedUnionInstance, self)._current_member_names()
+        else:
+            return [name]
+    
+    def pack(self, endianness=Endianness.little):
+        name = self.active_member
+        if name is None:
+            return super(TaggedUnionInstance, self).pack(endianness)
+        
+        # Pack just the active member, zero-padded to the size of the union
+        self._check_endianness(endianness, "pack")
+        packed = self._get_member(name).pack(endianness)
+        return packed + bytes(self.size - len(packed))
+    
+    def pack_into(self, buffer, offset=0, endianness=Endianness.little):
+        name = self.active_member
+        if name is None:
+            super(TaggedUnionInstance, self).pack_into(buffer, offset,
+                                                       endianness)
+            return
+        
+        # Pack just the active member in place, zero-padding the remainder of
+        # the union
+        self._check_endianness(endianness, "pack")
+        self._check_buffer(buffer, offset)
+        member = self._get_member(name)
+        member.pack_into(buffer, offset, endianness)
+        buffer[offset + member.size:offset + self.size] = \
+            bytes(self.size - member.size)
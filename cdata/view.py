@@ -0,0 +1,152 @@
+"""Lightweight views of packed data within a buffer.
+
+Unlike :py:class:`.Instance` objects, views do not hold a copy of the values
+they represent. Instead, reads and writes of members are decoded from and
+encoded into the underlying buffer on every access. This makes views cheap to
+create when only a handful of values within a large buffer need to be
+inspected or modified.
+"""
+
+from cdata.endianness import Endianness
+
+
+class View(object):
+    """The base class for buffer-backed views of cdata types.
+    
+    Since members of views are accessed as attributes (or items), all
+    attributes and methods of views are prefixed with an underscore to avoid
+    clashing with member names (which may not start with an underscore).
+    
+    Attributes
+    ----------
+    _data_type : :py:class:`.DataType`
+        The data type being viewed.
+    _buffer : :py:class:`bytes`, :py:class:`bytearray`, \
+            :py:class:`memoryview`, :py:class:`mmap.mmap`, ...
+        The buffer containing the packed data. If the buffer is read-only
+        (e.g. :py:class:`bytes`), writes will fail.
+    _offset : int
+        The offset of the packed data within the buffer.
+    _endianness : :py:class:`.Endianness`
+        The endianness of the packed data.
+    """
+    
+    __slots__ = ("_data_type", "_buffer", "_offset", "_endianness")
+    
+    def __init__(self, data_type, buffer, offset=0,
+                 endianness=Endianness.little):
+        self._data_type = data_type
+        self._buffer = buffer
+        self._offset = offset
+        self._endianness = endianness
+        
+        if offset < 0 or offset + self._size > len(buffer):
+            raise ValueError(
+                "{}-byte {} at offset {} does not fit in {}-byte "
+                "buffer".format(self._size, data_type.name, offset,
+                                len(buffer)))
+    
+    @property
+    def _size(self):
+        """The size (in bytes) of the viewed data."""
+        return self._data_type.size
+    
+    def _pack(self):
+        """Get a copy of the packed data being viewed."""
+        return bytes(self._buffer[self._offset:self._offset + self._size])
+    
+    def _instance(self):
+        """Unpack the viewed data into a new :py:class:`.Instance`."""
+        instance = self._data_type()
+        instance.unpack_from(self._buffer, self._offset, self._endianness)
+        return instance
+    
+    def __repr__(self):
+        return "<{} view: {}>".format(self._data_type.name, str(self))
+
+
+class ComplexTypeView(View):
+    """A view of a struct or union. Members are accessed as attributes.
+    
+    Members of primitive, enum, pointer and padding types are decoded into
+    their Python value (e.g. an int, the name of an enum value, the address
+    pointed to or a bytes object, respectively) while members of struct, union
+    and array types are returned as (further) views.
+    """
+    
+    __slots__ = ()
+    
+    def __getattr__(self, name):
+        """Handles reads of members."""
+        # Never treat (possibly uninitialised) internal names as members
+        if name.startswith("_"):
+            raise AttributeError(name)
+        
+        try:
+            offset = self._data_type._member_offsets[name]
+        except KeyError:
+            raise AttributeError(name)
+        
+        return self._data_type._members[name]._view_get(
+            self._buffer, self._offset + offset, self._endianness)
+    
+    def __setattr__(self, name, value):
+        """Handles writes to members."""
+        if name.startswith("_"):
+            super(ComplexTypeView, self).__setattr__(name, value)
+            return
+        
+        try:
+            offset = self._data_type._member_offsets[name]
+        except KeyError:
+            raise AttributeError(name)
+        
+        self._data_type._members[name]._view_set(
+            self._buffer, self._offset + offset, self._endianness, value)
+    
+    def __str__(self):
+        return "{{{}}}".format(
+            ", ".join("{}: {}".format(name, str(getattr(self, name)))
+                      for name in self._data_type._members))
+
+
+class ArrayView(View):
+    """A view of an array. Elements are accessed by index.
+    
+    As with :py:class:`.ComplexTypeView`, elements are either decoded into
+    their Python values or returned as (further) views.
+    """
+    
+    __slots__ = ()
+    
+    def __len__(self):
+        return self._data_type.length
+    
+    def _element_offset(self, key):
+        """Get the offset of the specified element within the buffer."""
+        # Check in range
+        if key >= len(self) or key < -len(self):
+            raise IndexError("array index {} out of range".format(key))
+        
+        if key < 0:
+            key += len(self)
+        
+        return (self._offset +
+                (key * self._data_type.base_type.size))
+    
+    def __getitem__(self, key):
+        """Get the value of a particular element of the array."""
+        return self._data_type.base_type._view_get(
+            self._buffer, self._element_offset(key), self._endianness)
+    
+    def __setitem__(self, key, value):
+        """Set the value of a particular element of the array."""
+        self._data_type.base_type._view_set(
+            self._buffer, self._element_offset(key), self._endianness, value)
+    
+    def __iter__(self):
+        for key in range(len(self)):
+            yield self[key]
+    
+    def __str__(self):
+        return "[{}]".format(", ".join(map(str, self)))
@@ -12,5 +12,6 @@ setup(
 
     # Requirements
     install_requires=["six", "enum34"],
+    extras_require={"numpy": ["numpy"]},
     tests_require=["pytest>=2.6", "pytest-cov", "mock"],
 )
@@ -128,3 +128,10 @@ def test_compound():
     
     # Check the allocation size matches
     assert cdata.alloc(nn, 0x1000) == 0x1000 + size
+    
+    # None of the instances in the structure should carry a __dict__
+    to_visit = list(nn.iter_instances())
+    while to_visit:
+        instance = to_visit.pop()
+        assert not hasattr(instance, "__dict__")
+        to_visit.extend(instance._iter_children())
@@ -8,16 +8,15 @@ from mock import Mock
 def container():
     container = Mock()
     
-    def iter_instances(_generated=None):
-        """A simple mock container iter_instances method.
-        
-        Just checks the _generated set is provided and then lists itself (if not
-        already covered).
-        """
-        assert _generated is not None
-        if container not in _generated:
-            _generated.add(container)
-            yield container
-    container.iter_instances.side_effect = iter_instances
+    # The mock container is a top-level instance which refers to nothing else
+    container._container_instance = None
+    container._iter_related.return_value = []
+    container._nesting_depth.return_value = 0
+    
+    def child_address(child):
+        """A mock container places children at whatever address they were
+        last given."""
+        return child._address
+    container._child_address.side_effect = child_address
     
     return container
@@ -4,9 +4,19 @@ from cdata.array import Array
 
 from cdata.pointer import Pointer
 
-from cdata.primitive import char
+from cdata.struct import Struct
 
-from cdata.alloc import total_size, alloc
+from cdata.union import Union
+
+from cdata.enum import Enum
+
+from cdata.padding import Padding
+
+from cdata.typedef import Typedef
+
+from cdata.primitive import char, unsigned_short, double
+
+from cdata.alloc import total_size, alloc, Allocator
 
 def test_total_size():
     # Sizes of stand-alone types should be the obvious values
@@ -45,3 +55,218 @@ def test_alloc():
     assert alloc(a, 0x1000) == 0x1008
     assert a.address == 0x1000
     
+
+def test_long_list():
+    # Long chains of pointers must not hit the recursion limit
+    next_pointer = Pointer(char)
+    node = Struct("list_node", ("value", char), ("next", next_pointer))
+    next_pointer.base_type = node
+    next_pointer.name = "struct list_node*"
+    
+    nodes = [node() for _ in range(5000)]
+    for n0, n1 in zip(nodes, nodes[1:]):
+        n0.next.deref = n1
+    
+    # Nodes should be listed in the order they're reached
+    assert list(nodes[0].iter_instances()) == nodes
+    assert list(nodes[1].next.iter_instances()) == nodes[1:]
+    
+    assert total_size(nodes[0]) == 5000 * 5
+    assert alloc(nodes[0], 0x1000) == 0x1000 + 5000 * 5
+    assert [n.address for n in nodes] == list(range(0x1000, 0x1000 + 5000 * 5,
+                                                    5))
+    assert nodes[-2].next.ref == nodes[-1].address
+
+def test_alloc_updates_pointers():
+    # Pointers within containers should reflect the allocated addresses
+    s = Struct("s", ("p", Pointer(char)))
+    a = Array(s, 2)()
+    c = char()
+    a[1].p.deref = c
+    assert alloc(a, 0x1000) == 0x1000 + 8 + 1
+    assert c.address == 0x1008
+    assert a.pack() == b"\0\0\0\0\x08\x10\0\0"
+    
+    assert alloc(a, 0x2000) == 0x2000 + 8 + 1
+    packed = a.pack()
+    assert packed == b"\0\0\0\0\x08\x20\0\0"
+    
+    # Re-allocating at the same addresses should leave everything untouched
+    assert alloc(a, 0x2000) == 0x2000 + 8 + 1
+    assert a.pack() is packed
+
+def test_alignment():
+    # Types should be naturally aligned to their size or, for compound types,
+    # the alignment of their elements/members
+    assert char.alignment == 1
+    assert double.alignment == 8
+    assert Pointer(char).alignment == 4
+    assert Pointer(char, 64).alignment == 8
+    assert Enum(("a", 1), enum_size=16).alignment == 2
+    assert Padding(3).alignment == 1
+    assert Array(unsigned_short, 3).alignment == 2
+    assert Struct(("c", char), ("d", double)).alignment == 8
+    assert Struct().alignment == 1
+    assert Union(("c", char), ("s", unsigned_short)).alignment == 2
+    assert Typedef("double_t", double).alignment == 8
+    
+    # By default instances are packed back-to-back
+    c = char()
+    d = double()
+    s = Struct(("c", Pointer(char)), ("d", Pointer(double)))(
+        c=Pointer(char)(c), d=Pointer(double)(d))
+    assert alloc(s, 0x1001) == 0x1001 + 8 + 1 + 8
+    assert (s.address, c.address, d.address) == (0x1001, 0x1009, 0x100A)
+    
+    # When aligned, each instance should be naturally aligned
+    assert alloc(s, 0x1001, aligned=True) == 0x1018
+    assert (s.address, c.address, d.address) == (0x1004, 0x100C, 0x1010)
+    assert s.d.ref == 0x1010
+    
+    # A minimum alignment may also be given
+    assert alloc(s, 0x1001, min_alignment=16) == 0x1038
+    assert (s.address, c.address, d.address) == (0x1010, 0x1020, 0x1030)
+    assert alloc(s, 0x1000, aligned=True, min_alignment=2) == 0x1018
+    assert (s.address, c.address, d.address) == (0x1000, 0x1008, 0x1010)
+    
+    with pytest.raises(ValueError):
+        alloc(s, 0x1000, min_alignment=0)
+    
+    # Types with the same name but different layouts should be aligned
+    # independently (here 32- and 64-bit pointers, both named "char*")
+    p32 = Pointer(char)()
+    p64 = Pointer(char, 64)()
+    s = Struct(("p32", Pointer(Pointer(char))),
+               ("p64", Pointer(Pointer(char, 64))))(
+        p32=Pointer(Pointer(char))(p32), p64=Pointer(Pointer(char, 64))(p64))
+    assert alloc(s, 0x1000, aligned=True) == 0x1018
+    assert (p32.address, p64.address) == (0x1008, 0x1010)
+
+def test_sections():
+    table_t = Typedef("table_t", Array(unsigned_short, 4))
+    table = table_t()
+    state = char()
+    s = Struct(("table", Pointer(table_t)), ("state", Pointer(char)))(
+        table=Pointer(table_t)(table), state=Pointer(char)(state))
+    
+    def section(instance):
+        return "rodata" if instance.data_type is table_t else "data"
+    
+    assert alloc(s, {"data": 0x2001, "rodata": 0x1000}, section,
+                 aligned=True) == {"data": 0x200D, "rodata": 0x1008}
+    assert (s.address, state.address, table.address) == (0x2004, 0x200C,
+                                                        0x1000)
+    assert s.table.ref == 0x1000
+    
+    # Every section must have a start address
+    with pytest.raises(ValueError):
+        alloc(s, {"data": 0x2000}, section)
+    with pytest.raises(ValueError):
+        alloc(s, {"data": 0x2000, "rodata": 0x1000})
+    with pytest.raises(ValueError):
+        alloc(s, 0x1000, section)
+
+def test_allocator():
+    c0 = char()
+    c1 = char()
+    a = Array(Pointer(char), 3)()
+    a[0].deref = c0
+    a[1].deref = c1
+    
+    allocator = Allocator(0x1000)
+    assert allocator.alloc(a) == [a, c0, c1]
+    assert (a.address, c0.address, c1.address) == (0x1000, 0x100C, 0x100D)
+    assert allocator.next_address == 0x100E
+    
+    # Nothing new to allocate
+    assert allocator.alloc(a) == []
+    assert (a.address, c0.address, c1.address) == (0x1000, 0x100C, 0x100D)
+    
+    # Only new instances should be allocated (without moving anything else)
+    c2 = char()
+    a[2].deref = c2
+    assert allocator.alloc(a) == [c2]
+    assert (a.address, c0.address, c1.address) == (0x1000, 0x100C, 0x100D)
+    assert c2.address == 0x100E
+    assert a[2].ref == 0x100E
+    
+    # Unreachable instances should be freed and their space reused
+    a[0].deref = None
+    assert allocator.alloc(a) == []
+    s = Array(char, 2)()
+    a[0].deref = s[1]
+    assert allocator.alloc(a) == [s]
+    assert s.address == 0x100F
+    assert a[0].ref == 0x1010
+    c3 = char()
+    a[1].deref = c3
+    assert allocator.alloc(a) == [c3]
+    assert c3.address == 0x100C
+    
+    # Adjacent free ranges should be merged and ranges at the end returned to
+    # the end of the allocated space
+    a[0].deref = None
+    a[1].deref = None
+    a[2].deref = None
+    assert allocator.alloc(a) == []
+    assert allocator.next_address == 0x100C
+    
+    # Instances moved by other means should be allocated afresh
+    a[0].deref = c0
+    assert allocator.alloc(a) == [c0]
+    assert c0.address == 0x100C
+    c0.address = 0x2000
+    assert allocator.alloc(a) == [c0]
+    assert c0.address == 0x100C
+    assert a[0].ref == 0x100C
+
+def test_allocator_alignment_and_sections():
+    d = double()
+    p = Pointer(double)(d)
+    
+    def section(instance):
+        return "rodata" if instance is d else "data"
+    
+    allocator = Allocator({"data": 0x1000, "rodata": 0x2001}, section,
+                          aligned=True)
+    assert allocator.alloc(p) == [p, d]
+    assert (p.address, d.address) == (0x1000, 0x2008)
+    assert allocator.next_address == {"data": 0x1004, "rodata": 0x2010}
+    
+    # Free ranges should only be used if they can be suitably aligned
+    allocator = Allocator(0x1000, aligned=True)
+    char16 = Array(char, 16)
+    s = Struct(("cp", Pointer(char)),
+               ("ap", Pointer(char16)),
+               ("dp", Pointer(double)))()
+    s.cp.deref = char()
+    s.ap.deref = char16()
+    s.dp.deref = double()
+    allocator.alloc(s)
+    assert (s.cp.ref, s.ap.ref, s.dp.ref) == (0x100C, 0x100D, 0x1020)
+    
+    s.ap.deref = None
+    s.dp.deref = double()
+    s.cp.deref = char()
+    assert allocator.alloc(s) == [s.cp.deref, s.dp.deref]
+    assert (s.cp.ref, s.dp.ref) == (0x100C, 0x1010)
+    assert allocator.next_address == 0x1020
+    
+    # Alignments of types seen by earlier allocations should not affect
+    # later allocations of different types with the same name
+    allocator = Allocator(0x1000, aligned=True)
+    s = Struct(("p32", Pointer(Pointer(char))),
+               ("p64", Pointer(Pointer(char, 64))))()
+    s.p32.deref = Pointer(char)()
+    allocator.alloc(s)
+    assert s.p32.ref == 0x1008
+    s.p64.deref = Pointer(char, 64)()
+    assert allocator.alloc(s) == [s.p64.deref]
+    assert s.p64.ref == 0x1010
+    
+    with pytest.raises(ValueError):
+        Allocator(0x1000, min_alignment=0)
+    with pytest.raises(ValueError):
+        Allocator({"data": 0x1000})
+    with pytest.raises(ValueError):
+        Allocator({"data": 0x1000}, section).alloc(p)
@@ -1,12 +1,21 @@
 import pytest
 
+import builtins
+
+import struct
+
 from mock import Mock
 
-from cdata.array import Array, ArrayInstance
+from cdata.array import Array, ArrayInstance, PrimitiveArrayInstance
 
 from cdata.pointer import Pointer
 
-from cdata.primitive import unsigned_short, char
+from cdata.padding import Padding
+
+from cdata.primitive import (unsigned_short, char, signed_char, _Bool,
+                             float, long_long)
+
+from cdata.endianness import Endianness
 
 from mock_container import container
 
@@ -21,6 +30,7 @@ def test_array():
     assert ushort3.declare() == "unsigned short[3]"
     assert ushort3.declare("magic") == "unsigned short magic[3]"
     assert list(ushort3.iter_types()) == [unsigned_short, ushort3]
+    assert ushort3.size == 6
     
     # Check the instance behaves as expected.
     # The default constructor should result in default values
@@ -107,6 +117,219 @@ def test_array():
     assert a[2].value == 0x90AB
     assert a[2].address is None
 
+def test_codec():
+    # Arrays of single-item types should use the repeat-count syntax
+    assert Array(unsigned_short, 3).codec().format == "<3H"
+    assert Array(unsigned_short, 0).codec().format == "<0H"
+    assert Array(Array(char, 2), 2).codec(Endianness.big).format == ">2c2c"
+    
+    # Formats with their own counts must be repeated
+    assert Array(Padding(2), 3).codec().format == "<2s2s2s"
+    
+    a = Array(Array(unsigned_short, 2), 2)()
+    a.unpack(b"\x01\x00\x02\x00\x03\x00\x04\x00")
+    assert [[i.value for i in row] for row in a] == [[1, 2], [3, 4]]
+    assert a.pack(Endianness.big) == b"\x00\x01\x00\x02\x00\x03\x00\x04"
+
+
+def test_pack_into_unpack_from():
+    ushort3 = Array(unsigned_short, 3)
+    a = ushort3([unsigned_short(1), unsigned_short(2), unsigned_short(3)])
+    
+    buffer = bytearray(8)
+    a.pack_into(buffer, 2, Endianness.big)
+    assert buffer == b"\0\0\0\x01\0\x02\0\x03"
+    
+    a = ushort3()
+    a.unpack_from(memoryview(buffer), 2, Endianness.big)
+    assert [i.value for i in a] == [1, 2, 3]
+
+
+def test_primitive_array():
+    # Arrays of primitives should be stored compactly
+    ushort3 = Array(unsigned_short, 3)
+    a = ushort3()
+    assert isinstance(a, PrimitiveArrayInstance)
+    assert not isinstance(Array(Pointer(char), 3)(), PrimitiveArrayInstance)
+    assert not isinstance(Array(ushort3, 3)(), PrimitiveArrayInstance)
+    
+    # Element instances should only be created on access (and then reused)
+    a.address = 0x1000
+    assert a._element_instances == {}
+    a1 = a[1]
+    assert a[1] is a1
+    assert a[-2] is a1
+    assert a1.address == 0x1002
+    assert list(a._element_instances) == [1]
+    
+    # Changes to elements should be reflected in the array and vice versa
+    a1.value = 0x1234
+    assert a.pack() == b"\0\0\x34\x12\0\0"
+    a.unpack(b"\x01\x00\x02\x00\x03\x00")
+    assert a1.value == 2
+    assert a.pack(Endianness.big) == b"\0\x01\0\x02\0\x03"
+    
+    # Replaced elements should be detached
+    a[1] = unsigned_short(0xABCD)
+    assert a1._container is None
+    a1.value = 0
+    assert a.pack() == b"\x01\x00\xCD\xAB\x03\x00"
+    
+    # Packing into and unpacking from buffers should be bounds checked
+    buffer = bytearray(8)
+    a.pack_into(buffer, 2, Endianness.big)
+    assert buffer == b"\0\0\0\x01\xAB\xCD\0\x03"
+    with pytest.raises(struct.error):
+        a.pack_into(buffer, 3)
+    assert len(buffer) == 8
+    with pytest.raises(struct.error):
+        a.unpack_from(buffer, 3)
+
+
+@pytest.mark.parametrize("data_type,values",
+                         [(char, [b"A", b"\0", b"\xFF"]),
+                          (_Bool, [True, False, True]),
+                          (float, [0.5, -1.0, 0.1]),
+                          (long_long, [-1, 1 << 40, 0])])
+def test_primitive_array_types(data_type, values):
+    # Values should survive packing and unpacking in either endianness and
+    # agree with packing each element individually
+    a = Array(data_type, 3)(list(map(data_type, values)))
+    assert [i.value for i in a] == values
+    assert str(a) == "[{}]".format(", ".join(str(v) for v in values))
+    assert a.literal == "{{{}}}".format(
+        ", ".join(data_type(v).literal for v in values))
+    for endianness in Endianness:
+        packed = a.pack(endianness)
+        assert packed == b"".join(data_type(v).pack(endianness)
+                                  for v in values)
+        a2 = Array(data_type, 3)()
+        a2.unpack(packed, endianness)
+        assert a2.pack(endianness) == packed
+        
+        # (Floats will be rounded when packed)
+        expected = []
+        for v in values:
+            i = data_type()
+            i.unpack(data_type(v).pack(endianness), endianness)
+            expected.append(i.value)
+        assert [i.value for i in a2] == expected
+
+
+def test_primitive_array_float_range():
+    # Floats too large for a 32-bit float should be rejected as they are when
+    # packing an individual element
+    with pytest.raises(OverflowError):
+        float(1e300).pack()
+    with pytest.raises(OverflowError):
+        Array(float, 2)([float(1e300)])
+    
+    a = Array(float, 2)([float(0.5)])
+    with pytest.raises(OverflowError):
+        a[1] = float(1e300)
+    with pytest.raises(OverflowError):
+        a[0].value = 1e300
+    
+    # The array (and element) should be unchanged
+    assert a[0].value == 0.5
+    assert a.pack() == float(0.5).pack() + float(0.0).pack()
+    
+    # Infinities may be packed either way
+    a[1].value = builtins.float("inf")
+    assert a.pack()[4:] == float(builtins.float("inf")).pack()
+
+
+
+def test_primitive_array_failed_assignment():
+    # A value which the array cannot hold should leave the array (and the
+    # element previously at that position) untouched
+    a = Array(signed_char, 3)()
+    e = a[1]
+    with pytest.raises(OverflowError):
+        a[1] = signed_char(300)
+    assert a[1] is e
+    assert e._container is a
+    e.value = 5
+    assert a.pack() == b"\x00\x05\x00"
+    
+    # Likewise when an element's value is changed
+    with pytest.raises(OverflowError):
+        e.value = 300
+    assert e.value == 5
+    assert a.pack() == b"\x00\x05\x00"
+
+def test_primitive_array_bool_normalised():
+    # Any non-zero byte should unpack as True and be re-packed as 1, as for an
+    # individual element
+    data = b"\x00\x01\x02\xFF"
+    a = Array(_Bool, 4)()
+    a.unpack(data)
+    
+    expected = []
+    for byte in data:
+        i = _Bool()
+        i.unpack(bytes([byte]))
+        expected.append(i)
+    assert [i.value for i in a] == [i.value for i in expected]
+    assert a.pack() == b"".join(i.pack() for i in expected)
+    assert a.pack() == b"\x00\x01\x01\x01"
+
+
+def test_large_primitive_array():
+    # Constructing and packing large arrays shouldn't create element instances
+    a = Array(char, 1 << 20)()
+    assert a.size == 1 << 20
+    assert a.pack() == b"\0" * (1 << 20)
+    a.unpack(b"J" * (1 << 20))
+    assert a[-1].value == b"J"
+    assert len(a._element_instances) == 1
+    
+    # Element values may be read without creating instances
+    assert all(value == b"J" for value in a.iter_values())
+    assert len(a._element_instances) == 1
+    assert list(Array(_Bool, 2)([_Bool(True)]).iter_values()) == [True, False]
+
+
+def test_rebase_primitive_array():
+    # Re-basing an array shouldn't touch its elements but pointers to elements
+    # must follow the new address.
+    a = Array(unsigned_short, 1000)()
+    a.address = 0x1000
+    p = Pointer(unsigned_short)(a[500])
+    assert a[500].address == 0x1000 + 1000
+    
+    a.address = 0x2000
+    assert a[500].address == 0x2000 + 1000
+    assert p.ref == 0x2000 + 1000
+    assert a[999].address == 0x2000 + 1998
+    assert len(a._element_instances) == 2
+
+def test_packed_cache():
+    pair = Array(unsigned_short, 2)
+    a = Array(pair, 3)()
+    
+    packed = a.pack()
+    assert packed == b"\0" * 12
+    assert a.pack() is packed
+    
+    # Changing an element should invalidate the cache
+    a[1][0].value = 0x1234
+    assert a.pack() == b"\0\0\0\0\x34\x12\0\0\0\0\0\0"
+    a[2] = pair([unsigned_short(1), unsigned_short(2)])
+    assert a.pack() == b"\0\0\0\0\x34\x12\0\0\x01\0\x02\0"
+    a.unpack(b"\x01" * 12)
+    assert a.pack() == b"\x01" * 12
+    
+    # Packing into a buffer should use the cache when present, otherwise
+    # packing directly into the buffer
+    buffer = bytearray(13)
+    a.pack_into(buffer, 1)
+    assert buffer == b"\0" + b"\x01" * 12
+    a[0][1].value = 0x0302
+    a.pack_into(buffer, 1)
+    assert buffer == b"\0\x01\x01\x02\x03" + b"\x01" * 8
+    assert a._packed is None
+
 def test_pointers_iter_instances():
     # When we have an array of pointers, the pointer's referred values should be
     # iterated over
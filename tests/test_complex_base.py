@@ -41,6 +41,10 @@ class FooInstance(ComplexTypeInstance):
         # Just do nothing
         pass
     
+    def _child_address(self, child):
+        # Children are wherever they were last placed
+        return child._address
+    
     def _child_value_changed(self, child):
         self._value_changed()
 
@@ -4,6 +4,8 @@ from mock import Mock
 
 from cdata.enum import Enum, EnumInstance
 
+from cdata.array import Array
+
 from cdata.endianness import Endianness
 
 from mock_container import container
@@ -173,12 +175,21 @@ def test_sizes(n_bits, packed):
         Enum(("XXX", -1), enum_size=n_bits)
     
     my_enum = Enum(("ONE", 1), enum_size=n_bits)
+    assert my_enum.size == len(packed)
     
     # Test pack/unpack
     e = my_enum()
     assert e.pack() == packed
     e.unpack(packed)
     assert e.value == "ONE"
+    
+    # Test pack_into/unpack_from
+    buffer = bytearray(len(packed) + 1)
+    e.pack_into(buffer, 1)
+    assert buffer[1:] == packed
+    e = my_enum("ONE")
+    e.unpack_from(memoryview(bytes(buffer)), 1)
+    assert e.value == "ONE"
 
 
 def test_bad_size():
@@ -253,6 +264,29 @@ def test_enum_instance():
         e.value = "FOUR"
 
 
+def test_large_enum():
+    # Large enums should be quick to define and decode
+    errors = Enum("error", *(("E{}".format(i), i * 3) for i in range(10000)))
+    assert errors._name_of(29997) == "E9999"
+    with pytest.raises(ValueError):
+        errors._name_of(1)
+    
+    e = errors()
+    e.unpack(b"\x03\0\0\0")
+    assert e.value == "E1"
+    with pytest.raises(ValueError):
+        e.unpack(b"\x04\0\0\0")
+    
+    # Arrays of enums are decoded in one go
+    error_array = Array(errors, 3)
+    data = b"\x06\0\0\0\0\0\0\0\x09\0\0\0"
+    assert list(error_array.iter_unpack(data)) == [("E2", "E0", "E3")]
+    a = error_array()
+    a.unpack(data)
+    assert [i.value for i in a] == ["E2", "E0", "E3"]
+    with pytest.raises(ValueError):
+        list(error_array.iter_unpack(b"\x06\0\0\0\x01\0\0\0\x09\0\0\0"))
+
 def test_parents(container):
     # Test that enum instances inform their container when changed
     my_enum = Enum("my_enum",
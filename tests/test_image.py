@@ -0,0 +1,306 @@
+import pytest
+
+import io
+
+from cdata.image import Image, pack_image, write_image, load_image
+
+from cdata.struct import Struct
+
+from cdata.pointer import Pointer
+
+from cdata.primitive import char, unsigned_short, unsigned_int
+
+from cdata.array import Array
+
+from cdata.union import Union
+
+from cdata.endianness import Endianness
+
+from cdata.alloc import alloc
+
+struct_node = Struct("node",
+                     ("value", unsigned_short),
+                     ("next", Pointer(char)))
+
+
+def test_image():
+    buffer = bytearray(b"\xFF\xFF"  # 0x1000: (outside node)
+                       b"\x34\x12"  # 0x1002: node.value
+                       b"\x08\x10\x00\x00"  # 0x1004: node.next
+                       b"J")  # 0x1008: *node.next
+    image = Image(buffer, 0x1000)
+    assert image.base_address == 0x1000
+    assert image.end_address == 0x1009
+    assert image.endianness == Endianness.little
+    
+    # Should be able to get instances at particular addresses
+    n = image.at(0x1002, struct_node)
+    assert n.address == 0x1002
+    assert n.value.value == 0x1234
+    assert n.next.ref == 0x1008
+    
+    # Pointers can be dereferenced through the image
+    c = image.deref(n.next)
+    assert c is n.next.deref
+    assert c.address == 0x1008
+    assert c.value == b"J"
+    assert image.deref(Pointer(char)()) is None
+    
+    # Views should also be available
+    v = image.view(0x1002, struct_node)
+    assert v.value == 0x1234
+    assert v.next == 0x1008
+    v.value = 0xABCD
+    assert buffer[2:4] == b"\xCD\xAB"
+    
+    # Instances can be written back
+    n.value.value = 0x5678
+    image.store(n)
+    assert buffer[2:4] == b"\x78\x56"
+    
+    # Out-of-bounds and unallocated accesses should fail
+    with pytest.raises(ValueError):
+        image.at(0x0FFF, char)
+    with pytest.raises(ValueError):
+        image.at(0x1009, char)
+    with pytest.raises(ValueError):
+        image.view(0x1004, struct_node)
+    with pytest.raises(ValueError):
+        image.store(char())
+    
+    # Closing a non-file image should do nothing
+    image.close()
+
+
+@pytest.mark.parametrize("endianness", Endianness)
+def test_from_file(endianness, tmpdir):
+    n = struct_node(unsigned_short(0x1234), Pointer(char)(char(b"J")))
+    assert alloc(n, 0x2000) == 0x2007
+    
+    filename = str(tmpdir.join("image"))
+    with open(filename, "wb") as f:
+        f.write(b"\0" * 7)
+    
+    # Write the image via a writable mapping
+    with Image.from_file(filename, 0x2000, endianness, writable=True) as image:
+        for instance in n.iter_instances():
+            image.store(instance)
+    with open(filename, "rb") as f:
+        assert f.read() == n.pack(endianness) + b"J"
+    
+    # Read it back from a read-only mapping
+    with Image.from_file(filename, 0x2000, endianness) as image:
+        n2 = image.at(0x2000, struct_node)
+        assert n2.value.value == 0x1234
+        assert image.deref(n2.next).value == b"J"
+        
+        # Read-only images can't be written to
+        with pytest.raises(TypeError):
+            image.store(n)
+
+
+def test_pack_image():
+    n = struct_node(unsigned_short(0x1234), Pointer(char)(char(b"J")))
+    
+    # Unallocated instances can't be packed
+    with pytest.raises(ValueError):
+        pack_image(n)
+    
+    # When packed, the image should span all instances
+    alloc(n, 0x1000)
+    buffer, span = pack_image(n)
+    assert span == (0x1000, 0x1007)
+    assert buffer == b"\x34\x12\x06\x10\x00\x00J"
+    
+    for endianness in Endianness:
+        buffer, span = pack_image(n, 0x1000, endianness)
+        assert span == (0x1000, 0x1007)
+        assert bytes(buffer) == n.pack(endianness) + b"J"
+    
+    # Should leave any gaps zeroed
+    n.next.deref.address = 0x1010
+    buffer, span = pack_image(n, 0x0FFE)
+    assert span == (0x0FFE, 0x1011)
+    assert buffer == (b"\0\0" +
+                      b"\x34\x12\x10\x10\x00\x00" +
+                      b"\0" * 10 +
+                      b"J")
+    
+    # Base address must not come after any instance
+    with pytest.raises(ValueError):
+        pack_image(n, 0x1001)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 2, 3, 7, 1024])
+@pytest.mark.parametrize("sparse", [False, True])
+def test_write_image(buffer_size, sparse):
+    n = struct_node(unsigned_short(0x1234), Pointer(char)(char(b"J")))
+    
+    # Unallocated instances can't be written
+    with pytest.raises(ValueError):
+        write_image(n, io.BytesIO())
+    
+    # Should produce the same image as pack_image regardless of the buffer
+    # size, leaving gaps zeroed
+    alloc(n, 0x1000)
+    n.next.deref.address = 0x1010
+    for endianness in Endianness:
+        f = io.BytesIO()
+        span = write_image(n, f, 0x0FFE, endianness,
+                           buffer_size=buffer_size, sparse=sparse)
+        buffer, expected_span = pack_image(n, 0x0FFE, endianness)
+        assert span == expected_span
+        assert f.getvalue() == buffer
+    
+    # The image should be written from the file's current position
+    f = io.BytesIO()
+    f.write(b"XY")
+    assert write_image(n, f, buffer_size=buffer_size,
+                       sparse=sparse) == (0x1000, 0x1011)
+    assert f.getvalue() == (b"XY" +
+                            b"\x34\x12\x10\x10\x00\x00" +
+                            b"\0" * 10 +
+                            b"J")
+    
+    # Base address must not come after any instance
+    with pytest.raises(ValueError):
+        write_image(n, io.BytesIO(), 0x1001, buffer_size=buffer_size)
+    
+    # Overlapping instances can't be written
+    n.next.deref.address = 0x1005
+    with pytest.raises(ValueError):
+        write_image(n, io.BytesIO(), buffer_size=buffer_size)
+
+
+def test_write_image_file(tmpdir):
+    # Gaps skipped in sparse files should read back as zeros
+    block = Array(char, 100)
+    p = Pointer(block)(block())
+    alloc(p, 0)
+    p.deref.address = 0x10000
+    p.deref[99].value = b"!"
+    
+    filename = str(tmpdir.join("image.bin"))
+    with open(filename, "wb") as f:
+        assert write_image(p, f, buffer_size=4096, sparse=True) == (0, 0x10064)
+    with open(filename, "rb") as f:
+        data = f.read()
+    assert data == p.pack() + b"\0" * (0x10000 - 4) + b"\0" * 99 + b"!"
+
+
+def linked_list_type():
+    """Create a (self-referential) linked list node type."""
+    next_pointer = Pointer(char)
+    node = Struct("list_node",
+                  ("value", unsigned_short),
+                  ("next", next_pointer))
+    next_pointer.base_type = node
+    next_pointer.name = "struct list_node*"
+    return node
+
+
+def test_load_image():
+    node = linked_list_type()
+    header = Struct("header",
+                    ("first", Pointer(node)),
+                    ("c", Pointer(char)),
+                    ("u", Union(("p", Pointer(node)),
+                                ("i", unsigned_short))))
+    buffer = bytearray(b"\x0E\x10\x00\x00"  # 0x1000: first
+                       b"\x0C\x10\x00\x00"  # 0x1004: c
+                       b"\x0A\x10\x00\x00"  # 0x1008: u
+                       b"J"  # 0x100C: *c
+                       b"\x00"  # 0x100D: (unused)
+                       b"\x01\x00\x14\x10\x00\x00"  # 0x100E: node 1
+                       b"\x02\x00\x1A\x10\x00\x00"  # 0x1014: node 2
+                       b"\x03\x00\x00\x00\x00\x00")  # 0x101A: node 3
+    
+    h = load_image(buffer, 0x1000, header, 0x1000)
+    assert h.address == 0x1000
+    assert h.c.deref.address == 0x100C
+    assert h.c.deref.value == b"J"
+    
+    n1 = h.first.deref
+    n2 = n1.next.deref
+    n3 = n2.next.deref
+    assert [n.address for n in (n1, n2, n3)] == [0x100E, 0x1014, 0x101A]
+    assert [n.value.value for n in (n1, n2, n3)] == [1, 2, 3]
+    assert n3.next.deref is None
+    
+    # Pointers in unions are not followed
+    assert h.u.p.deref.address == 0x100A
+    assert h.u.p.deref is not n1
+    
+    # Instances pointed to by more than one pointer can't be loaded (here,
+    # node 1 is pointed to by both the header and node 3).
+    buffer[0x1C:0x20] = b"\x0E\x10\x00\x00"
+    with pytest.raises(ValueError):
+        load_image(buffer, 0x1000, header, 0x1000)
+    
+    # ...though cycles back to the root are fine
+    n1 = load_image(buffer, 0x1000, node, 0x100E)
+    n2 = n1.next.deref
+    n3 = n2.next.deref
+    assert [n.value.value for n in (n1, n2, n3)] == [1, 2, 3]
+    assert n3.next.deref is n1
+    
+    # Loading and re-packing should reproduce the original image
+    assert pack_image(n1)[0] == buffer[0x0E:]
+    
+    # Pointers outside the image can't be followed
+    with pytest.raises(ValueError):
+        load_image(b"\x00\x20\x00\x00", 0x1000, Pointer(char), 0x1000)
+
+
+@pytest.mark.parametrize("member_first", [True, False])
+def test_load_image_pointer_to_member(member_first):
+    # Pointers to a member of a struct (or element of an array) which is also
+    # pointed to should refer to that member, whichever is loaded first.
+    t = Struct("t", ("a", unsigned_short), ("b", unsigned_int))
+    members = [("pb", Pointer(unsigned_int)),
+               ("pt", Pointer(t)),
+               ("pe", Pointer(unsigned_short)),
+               ("pa", Pointer(Array(unsigned_short, 2)))]
+    if not member_first:
+        members = [members[1], members[0], members[3], members[2]]
+    r = Struct("r", *members)
+    
+    buffer = bytearray(b"\x00" * 0x1C)
+    buffer[0x00:0x10] = r.pack_many(
+        [dict(pb=0x1012, pt=0x1010, pe=0x101A, pa=0x1018)])
+    buffer[0x10:0x18] = t.pack_many([(1, 2)])
+    buffer[0x18:0x1C] = b"\x03\x00\x04\x00"
+    
+    root = load_image(buffer, 0x1000, r, 0x1000)
+    assert root.pt.deref.b.value == 2
+    assert root.pb.deref is root.pt.deref.b
+    assert root.pe.deref is root.pa.deref[1]
+    assert root.pe.deref.value == 4
+    
+    # Every value should be represented by exactly one instance
+    addresses = [instance.address for instance in root.iter_instances()]
+    assert sorted(addresses) == [0x1000, 0x1010, 0x1018]
+    
+    # ...and so the graph can be written back out again
+    f = io.BytesIO()
+    write_image(root, f, 0x1000)
+    assert f.getvalue() == buffer
+
+
+def test_load_image_long_list():
+    # Long lists must not hit the recursion limit
+    node = linked_list_type()
+    num_nodes = 10000
+    buffer = bytearray()
+    for i in range(num_nodes):
+        next_address = 0 if i == num_nodes - 1 else 6 * (i + 1)
+        buffer += unsigned_short(i).pack()
+        buffer += Pointer(char)(next_address).pack()
+    
+    n = load_image(buffer, 0, node, 0)
+    assert pack_image(n)[0] == buffer
+    for i in range(num_nodes):
+        assert n.value.value == i
+        if i != num_nodes - 1:
+            n = n.next.deref
+    assert n.next.deref is None
@@ -1,3 +1,7 @@
+import pytest
+
+import struct
+
 from mock import Mock
 
 from cdata.padding import Padding, PaddingInstance
@@ -27,6 +31,7 @@ def test_padding_type():
     assert p.data_type is pad2
     assert p.address is None
     assert p.size == 2
+    assert pad2.size == 2
     assert p.literal == "{'\\x00', '\\x00'}"
     assert list(p.iter_instances()) == [p]
     assert str(p) == "b'\\x00\\x00'"
@@ -39,6 +44,29 @@ def test_padding_type():
     assert p.pack() == b"\xAA\xBB"
     assert str(p) == "b'\\xaa\\xbb'"
 
+def test_pack_into_unpack_from():
+    p = Padding(2)()
+    p.unpack(b"AB")
+    
+    buffer = bytearray(4)
+    p.pack_into(buffer, 1)
+    assert buffer == b"\0AB\0"
+    
+    p = Padding(2)()
+    p.unpack_from(memoryview(buffer), 2)
+    assert p.pack() == b"B\0"
+    
+    # Packing into and unpacking from buffers should be bounds checked
+    buffer = bytearray(1)
+    with pytest.raises(struct.error):
+        p.pack_into(buffer, 1)
+    assert buffer == b"\0"
+    with pytest.raises(struct.error):
+        p.unpack_from(buffer)
+    with pytest.raises(struct.error):
+        p.unpack(b"A")
+    assert p.pack() == b"B\0"
+
 def test_parent(container):
     # Check the container is informed when the padding bytes change and when the
     # address changes.
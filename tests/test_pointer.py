@@ -203,6 +203,13 @@ def test_lengths(n_bits):
         c.unpack(c.pack(endianness), endianness)
         assert c.deref.address == address
         assert c.deref is referenced_char_inst
+        
+        # Likewise when packing into/out of a buffer at an offset
+        buffer = bytearray(1 + (n_bits // 8))
+        c.pack_into(buffer, 1, endianness)
+        assert buffer[1:] == packed_address
+        c.unpack_from(buffer, 1, endianness)
+        assert c.deref is referenced_char_inst
 
 
 def test_unsupported_length():
@@ -42,6 +42,60 @@ class TestPrimitive(object):
         assert str(inst) == "171"
         assert repr(inst) == "<test_t: 171>"
     
+    def test_codec(self):
+        """Ensure a compiled codec is produced and cached per endianness."""
+        test_t = primitive.Primitive("test_t", "H", cast=(lambda v: v),
+                                     default_value=0)
+        
+        little = test_t.codec(Endianness.little)
+        big = test_t.codec(Endianness.big)
+        assert little.format == "<H"
+        assert big.format == ">H"
+        
+        # Should be cached
+        assert test_t.codec(Endianness.little) is little
+        assert test_t.codec(Endianness.big) is big
+        
+        # Default endianness should be little
+        assert test_t.codec() is little
+    
+    @pytest.mark.parametrize("buffer_type", [bytearray,
+                                             (lambda b: memoryview(
+                                                 bytearray(b)))])
+    def test_pack_into_unpack_from(self, buffer_type):
+        """Ensure values can be packed into and unpacked from buffers at an
+        offset."""
+        test_t = primitive.Primitive("test_t", "H", cast=(lambda v: v),
+                                     default_value=0x1234)
+        buffer = buffer_type(b"\xAA" * 5)
+        
+        inst = test_t()
+        inst.pack_into(buffer, 1)
+        assert bytes(buffer) == b"\xAA\x34\x12\xAA\xAA"
+        inst.pack_into(buffer, 3, Endianness.big)
+        assert bytes(buffer) == b"\xAA\x34\x12\x12\x34"
+        
+        inst.unpack_from(buffer, 2)
+        assert inst.value == 0x1212
+        inst.unpack_from(buffer, 2, Endianness.big)
+        assert inst.value == 0x1212
+        inst.unpack_from(buffer, 3, Endianness.big)
+        assert inst.value == 0x1234
+    
+    def test_pack_many_iter_unpack(self):
+        """Ensure many values can be packed and unpacked at once."""
+        test_t = primitive.Primitive("test_t", "H", cast=(lambda v: v + 1),
+                                     default_value=0)
+        packed = test_t.pack_many([1, 2, 3], Endianness.big)
+        assert packed == b"\0\x02\0\x03\0\x04"
+        assert list(test_t.iter_unpack(packed, Endianness.big)) == [2, 3, 4]
+        
+        # Out-of-range values should be rejected
+        with pytest.raises(ValueError):
+            test_t.pack_many([0x10000])
+        with pytest.raises(ValueError):
+            primitive.float.pack_many([1e300])
+    
     def test_cast(self):
         """Ensure the cast argument is used."""
         test_t = primitive.Primitive("test_t", "B", default_value=0,
@@ -310,3 +364,22 @@ class TestStandardTypes(object):
             
             # Test C literals
             assert f.literal == str(value)
+    
+    @pytest.mark.parametrize("data_type,value",
+                             [(primitive.char, b"J"),
+                              (primitive._Bool, True),
+                              (primitive.signed_char, -2),
+                              (primitive.unsigned_short, 0x1234),
+                              (primitive.long, -0x12345678),
+                              (primitive.unsigned_long_long, 1 << 63),
+                              (primitive.float, 0.5),
+                              (primitive.double, -0.25)])
+    @pytest.mark.parametrize("endianness", Endianness)
+    def test_to_numpy_dtype(self, data_type, value, endianness):
+        """Ensure NumPy dtypes decode packed values identically."""
+        numpy = pytest.importorskip("numpy")
+        dtype = data_type.to_numpy_dtype(endianness)
+        assert dtype.itemsize == data_type().size
+        
+        packed = data_type(value).pack(endianness) * 3
+        assert list(numpy.frombuffer(packed, dtype)) == [value] * 3
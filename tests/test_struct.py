@@ -1,13 +1,31 @@
 import pytest
 
-from mock import Mock
+import mmap
+
+import struct
+
+from mock import Mock, patch
 
 from cdata.struct import Struct, StructInstance
 
-from cdata.primitive import char, unsigned_char
+from cdata.primitive import char, unsigned_char, unsigned_short
+
+from cdata.array import Array
+
+from cdata.pointer import Pointer
+
+from cdata.padding import Padding
+
+from cdata.union import Union
+
+from cdata.enum import Enum
+
+from cdata.typedef import Typedef
 
 from cdata.endianness import Endianness
 
+from cdata.base import deferred_updates
+
 from mock_container import container
 
 def test_struct():
@@ -107,6 +125,465 @@ def test_struct():
         assert t.b.value == 0xAA
 
 
+def test_codec():
+    inner = Struct(("a", unsigned_short),
+                   ("b", Array(char, 3)))
+    struct_test = Struct("test",
+                         ("a", unsigned_char),
+                         ("b", Pointer(char)),
+                         ("c", inner),
+                         ("d", Padding(2)),
+                         ("e", Array(inner, 2)))
+    
+    # The codec should be a single flattened format string and cached
+    codec = struct_test.codec(Endianness.big)
+    assert codec.format == ">BIH3c2sH3cH3c"
+    assert codec.size == 1 + 4 + 5 + 2 + 10
+    
+    # The size should be available from the type
+    assert struct_test.size == 1 + 4 + 5 + 2 + 10
+    assert struct_test().size == struct_test.size
+    assert struct_test.codec(Endianness.big) is codec
+    
+    # Packing should be consistent with packing each member in turn
+    t = struct_test()
+    t.a.value = 0x12
+    t.c.a.value = 0x3456
+    t.c.b[1].value = b"X"
+    t.d.unpack(b"PD")
+    t.e[1].b[2].value = b"Y"
+    for endianness in Endianness:
+        packed = t.pack(endianness)
+        assert packed == b"".join(getattr(t, name).pack(endianness)
+                                  for name in "abcde")
+        
+        # Unpacking should be the exact inverse
+        t2 = struct_test()
+        t2.unpack(packed, endianness)
+        assert t2.pack(endianness) == packed
+        assert t2.c.a.value == 0x3456
+        assert t2.e[1].b[2].value == b"Y"
+    
+    # Structs containing unions can't be flattened but still pack
+    struct_union = Struct("has_union",
+                          ("a", unsigned_char),
+                          ("b", Union(("ba", unsigned_char),
+                                      ("bb", unsigned_short))))
+    assert struct_union.codec() is None
+    t = struct_union()
+    t.b.bb.value = 0x1234
+    assert t.pack() == b"\x00\x34\x12"
+    t.unpack(b"\x01\x02\x03")
+    assert t.a.value == 1
+    assert t.b.bb.value == 0x0302
+
+
+@pytest.mark.parametrize("with_union", [False, True])
+def test_pack_into_unpack_from(with_union, tmpdir):
+    # Check both the flattened and member-by-member code paths
+    if with_union:
+        b_type = Union(("b", unsigned_short))
+    else:
+        b_type = Struct(("b", unsigned_short))
+    struct_test = Struct("test",
+                         ("a", unsigned_char),
+                         ("b", b_type))
+    
+    t = struct_test(unsigned_char(0x12))
+    t.b.b.value = 0x3456
+    
+    buffer = bytearray(b"\xFF" * 5)
+    t.pack_into(buffer, 1)
+    assert buffer == b"\xFF\x12\x56\x34\xFF"
+    
+    # Should work with memory views (e.g. of a larger image)
+    buffer = bytearray(8)
+    t.pack_into(memoryview(buffer)[4:], 1)
+    assert buffer == b"\0\0\0\0\0\x12\x56\x34"
+    
+    t = struct_test()
+    t.unpack_from(memoryview(buffer), 5)
+    assert t.a.value == 0x12
+    assert t.b.b.value == 0x3456
+    
+    # And with memory-mapped files
+    filename = str(tmpdir.join("image"))
+    with open(filename, "wb") as f:
+        f.write(b"\0" * 16)
+    with open(filename, "r+b") as f:
+        m = mmap.mmap(f.fileno(), 0)
+        t.b.b.value = 0xABCD
+        t.pack_into(m, 8)
+        t = struct_test()
+        t.unpack_from(m, 8)
+        assert t.a.value == 0x12
+        assert t.b.b.value == 0xABCD
+        m.close()
+    with open(filename, "rb") as f:
+        assert f.read()[8:11] == b"\x12\xCD\xAB"
+
+
+@pytest.mark.parametrize("data_type",
+                         [unsigned_short,
+                          Enum(("ONE", 1), ("TWO", 2), enum_size=16),
+                          Pointer(char, 16),
+                          Padding(2),
+                          Struct(("a", unsigned_char), ("b", unsigned_char)),
+                          Struct(("a", Struct(("b", unsigned_short))),
+                                 ("c", Padding(0))),
+                          Union(("a", unsigned_short)),
+                          Array(unsigned_char, 2),
+                          Array(Pointer(char, 8), 2),
+                          Typedef("test_t", unsigned_short)])
+def test_pack_into_unpack_from_negative_offset(data_type):
+    # Negative offsets should be rejected by every type rather than counting
+    # from the end of the buffer
+    instance = data_type()
+    assert instance.size == 2
+    buffer = bytearray(b"\xFF" * 4)
+    with pytest.raises(struct.error):
+        instance.pack_into(buffer, -2)
+    assert buffer == b"\xFF" * 4
+    with pytest.raises(struct.error):
+        instance.unpack_from(buffer, -2)
+    assert instance.pack() == data_type().pack()
+
+
+def test_pack_many_iter_unpack():
+    my_enum = Enum(("ONE", 1), ("TWO", 2), enum_size=8)
+    point = Struct("point",
+                   ("x", unsigned_short),
+                   ("y", unsigned_short))
+    record = Struct("record",
+                    ("a", unsigned_char),
+                    ("b", Pointer(char)),
+                    ("c", Typedef("point_t", point)),
+                    ("d", Padding(2)),
+                    ("e", Array(char, 2)),
+                    ("f", my_enum))
+    
+    # Simple structs should produce namedtuples of their member values
+    assert point.record_type._fields == ("x", "y")
+    assert point.record_type is point.record_type
+    packed = point.pack_many([(1, 2), {"x": 3, "y": 4}, {"y": 5}])
+    assert packed == b"".join(point(unsigned_short(x), unsigned_short(y)).pack()
+                              for x, y in [(1, 2), (3, 4), (0, 5)])
+    points = list(point.iter_unpack(packed))
+    assert points == [(1, 2), (3, 4), (0, 5)]
+    assert points[2].y == 5
+    
+    # Members named after Python keywords are valid C and so must be supported
+    # (albeit with positional field names)
+    keywords = Struct("from", ("from", unsigned_short), ("to", unsigned_short))
+    assert keywords.record_type._fields == ("_0", "to")
+    assert list(keywords.iter_unpack(packed)) == [(1, 2), (3, 4), (0, 5)]
+    assert keywords.pack_many([{"from": 1, "to": 2}]) == packed[:4]
+    
+    # Nested types should produce nested records
+    r = record()
+    r.a.value = 0x12
+    r.b.ref = 0x1000
+    r.c.y.value = 0x3456
+    r.d.unpack(b"PD")
+    r.e[1].value = b"X"
+    r.f.value = "TWO"
+    for endianness in Endianness:
+        packed = r.pack(endianness) * 3
+        records = list(record.iter_unpack(packed, endianness))
+        assert len(records) == 3
+        assert records[0] == (0x12, 0x1000, (0, 0x3456), b"PD", (b"\0", b"X"),
+                              "TWO")
+        assert records[0].c.y == 0x3456
+        
+        # Records should pack back into the original data
+        assert record.pack_many(records, endianness) == packed
+    
+    # Omitted members (including nested types) should take their default
+    # values, which are only computed once rather than for every record
+    expected = record(unsigned_char(0x12)).pack()
+    assert record.pack_many([{"a": 0x12}]) == expected
+    with patch.object(StructInstance, "__init__",
+                      side_effect=AssertionError("instance created")):
+        assert record.pack_many([{"a": 0x12}] * 2) == expected * 2
+    
+    # Values should be checked
+    with pytest.raises(ValueError):
+        point.pack_many([(1, 2, 3)])
+    with pytest.raises(ValueError):
+        point.pack_many([{"z": 1}])
+    with pytest.raises(ValueError):
+        record.pack_many([(0, 0, (0, 0), b"P", (b"\0", b"\0"), "ONE")])
+    with pytest.raises(ValueError):
+        record.pack_many([(0, 0, (0, 0), b"PD", (b"\0", ), "ONE")])
+    with pytest.raises(ValueError):
+        record.pack_many([(0, 0, (0, 0), b"PD", (b"\0", b"\0"), "THREE")])
+    with pytest.raises(ValueError):
+        record.pack_many([(0, 1 << 32, (0, 0), b"PD", (b"\0", b"\0"), "ONE")])
+    
+    # Types which can't be flattened aren't supported
+    struct_union = Struct(("a", Union(("b", unsigned_char))))
+    with pytest.raises(ValueError):
+        struct_union.pack_many([])
+    with pytest.raises(ValueError):
+        struct_union.iter_unpack(b"")
+
+
+def test_to_numpy_dtype():
+    numpy = pytest.importorskip("numpy")
+    
+    my_enum = Enum(("ONE", 1), ("TWO", 2), enum_size=16)
+    inner = Struct(("a", unsigned_short),
+                   ("b", Array(char, 3)))
+    struct_test = Struct("test",
+                         ("a", unsigned_char),
+                         ("b", Pointer(char)),
+                         ("c", inner),
+                         ("d", Padding(2)),
+                         ("e", Array(Typedef("inner_t", inner), 2)),
+                         ("f", my_enum),
+                         ("g", Union(("ga", unsigned_char),
+                                     ("gb", unsigned_short))))
+    
+    dtype = struct_test.to_numpy_dtype()
+    assert dtype.names == ("a", "b", "c", "d", "e", "f", "g")
+    assert dtype.itemsize == struct_test().size
+    assert dtype.fields["e"][1] == 1 + 4 + 5 + 2
+    assert dtype["g"].fields["gb"][1] == 0
+    
+    # A buffer of many records should be decodable in one go
+    records = []
+    for n in range(4):
+        t = struct_test()
+        t.a.value = n
+        t.b.ref = 0x1000 + n
+        t.c.b[n % 3].value = b"X"
+        t.e[1].a.value = 0x100 * n
+        t.f.value = "TWO"
+        t.g.gb.value = 0x1234 + n
+        records.append(t)
+    a = numpy.frombuffer(b"".join(t.pack() for t in records), dtype)
+    assert len(a) == 4
+    assert list(a["a"]) == [0, 1, 2, 3]
+    assert list(a["b"]) == [0x1000, 0x1001, 0x1002, 0x1003]
+    assert list(a["c"]["b"][:, 1]) == [b"", b"X", b"", b""]
+    assert a["d"].tobytes() == b"\0" * 8
+    assert list(a["e"]["a"][:, 1]) == [0, 0x100, 0x200, 0x300]
+    assert list(a["f"]) == [2] * 4
+    assert list(a["g"]["ga"]) == [0x34, 0x35, 0x36, 0x37]
+    assert list(a["g"]["gb"]) == [0x1234, 0x1235, 0x1236, 0x1237]
+    
+    # Big-endian types should also work
+    big = inner.to_numpy_dtype(Endianness.big)
+    t = inner(unsigned_short(0x1234))
+    assert numpy.frombuffer(t.pack(Endianness.big), big)["a"][0] == 0x1234
+    
+    # Unions (and structs containing them) can only be represented in the
+    # endianness they were defined with
+    with pytest.raises(ValueError):
+        struct_test.to_numpy_dtype(Endianness.big)
+
+
+def test_offsetof():
+    inner = Struct(("x", unsigned_char),
+                   ("y", unsigned_short))
+    middle = Struct(("a", unsigned_char),
+                    ("b", Array(Typedef("inner_t", inner), 4)),
+                    ("u", Union(("ua", unsigned_char),
+                                ("ub", inner))))
+    outer = Struct("outer",
+                   ("p", Pointer(char)),
+                   ("m", middle),
+                   ("grid", Array(Array(unsigned_short, 3), 2)))
+    
+    assert outer.offsetof("p") == 0
+    assert outer.offsetof("m") == 4
+    assert outer.offsetof("m.a") == 4
+    assert outer.offsetof("m.b") == 5
+    assert outer.offsetof("m.b[0].x") == 5
+    assert outer.offsetof("m.b[3].y") == 5 + (3 * 3) + 1
+    assert outer.offsetof("m.u.ub.y") == 5 + (4 * 3) + 1
+    assert outer.offsetof("grid[1][2]") == 4 + 1 + 12 + 3 + (3 * 2) + 4
+    
+    # Cached results should be consistent
+    assert outer.offsetof("m.b[3].y") == 5 + (3 * 3) + 1
+    
+    # Bad paths should fail
+    for path in ["", "q", "p.x", "m.b[4]", "m.b.x", "m.a[0]", "[0]", ".p",
+                 "m..a", "m.", "m b", "grid[1]2", "grid[-1]"]:
+        with pytest.raises(ValueError):
+            outer.offsetof(path)
+
+
+def test_wide_struct_addresses():
+    # Member addresses should be consistent with offsetof for wide structs
+    wide = Struct(*(("m{}".format(i), unsigned_short) for i in range(1000)))
+    s = wide()
+    s.address = 0x1000
+    assert s.m999.address == 0x1000 + wide.offsetof("m999")
+    
+    # Replacing a member should give the new member the right address
+    s.m500 = unsigned_short(0x1234)
+    assert s.m500.address == 0x1000 + 1000
+    with pytest.raises(ValueError):
+        s.m500.address = 0x1000
+    assert s.m500.address == 0x1000 + 1000
+
+
+def test_construction_address_propagation():
+    # Member addresses are derived from the struct's address so constructing
+    # a struct should not need to assign any member's address.
+    wide = Struct(*(("m{}".format(i), unsigned_short) for i in range(100)))
+    with patch.object(StructInstance, "_child_address_changed",
+                      autospec=True,
+                      side_effect=StructInstance._child_address_changed) as m:
+        s = wide(*(unsigned_short(i) for i in range(50)))
+    assert m.call_count == 0
+    assert s.m49.value == 49
+    assert s.m99.address is None
+    
+    # Replacing members afterwards should still assign addresses
+    s.address = 0x1000
+    s.m10 = unsigned_short()
+    assert s.m10.address == 0x1000 + 20
+
+
+def test_relative_member_addresses():
+    # Member addresses are computed from the top-level container so re-basing
+    # should not assign the address of any member.
+    inner = Struct("inner", ("a", unsigned_char), ("b", unsigned_short))
+    inner_t = Typedef("inner_t", inner)
+    outer = Struct("outer",
+                   ("x", unsigned_char),
+                   ("i", inner_t),
+                   ("arr", Array(inner, 3)))
+    o = outer()
+    with patch.object(StructInstance, "_child_address_changed",
+                      autospec=True,
+                      side_effect=StructInstance._child_address_changed) as m:
+        o.address = 0x1000
+    assert m.call_count == 0
+    assert o.i.address == 0x1000 + outer.offsetof("i")
+    assert o.i.b.address == 0x1000 + outer.offsetof("i.b")
+    assert o.arr[2].b.address == 0x1000 + outer.offsetof("arr[2].b")
+    
+    # Pointers to members should still track the member's address
+    p_b = Pointer(unsigned_short)(o.arr[2].b)
+    p_i = Pointer(inner_t)(o.i)
+    assert o._referenced_count == 2
+    o.address = 0x2000
+    assert p_b.ref == 0x2000 + outer.offsetof("arr[2].b")
+    assert p_i.ref == 0x2000 + outer.offsetof("i")
+    assert p_b.pack() == (0x2000 + outer.offsetof("arr[2].b")).to_bytes(
+        4, "little")
+    
+    # Moving a referenced member to address zero makes its pointer NULL
+    p_x = Pointer(unsigned_char)(o.x)
+    assert o._referenced_count == 3
+    o.address = 0
+    assert p_x.deref is None
+    assert o._referenced_count == 2
+    
+    # Members removed from a container retain their last address (and are no
+    # longer counted as referenced members)
+    o.address = 0x3000
+    old_b = o.arr[2].b
+    o.arr[2].b = unsigned_short()
+    assert o._referenced_count == 1
+    o.address = 0x4000
+    assert old_b.address == 0x3000 + outer.offsetof("arr[2].b")
+    assert p_b.ref == 0x3000 + outer.offsetof("arr[2].b")
+    assert o.arr[2].b.address == 0x4000 + outer.offsetof("arr[2].b")
+
+def test_deferred_updates(container):
+    point = Struct("point", ("x", unsigned_short), ("y", unsigned_short))
+    points = Array(point, 100)()
+    points._container = container
+    
+    # Containers should be notified just once, on leaving the context
+    with patch.object(StructInstance, "_value_changed", autospec=True,
+                      side_effect=StructInstance._value_changed) as m:
+        with deferred_updates():
+            for i, p in enumerate(points):
+                p.x.value = i
+                p.y.value = i * 2
+            
+            # Nesting the context has no effect
+            with deferred_updates():
+                points[0].x.value = 1000
+            
+            assert not container._child_value_changed.called
+            assert m.call_count == 0
+        assert m.call_count == 100
+    container._child_value_changed.assert_called_once_with(points)
+    
+    # The changes are all applied
+    assert points[0].x.value == 1000
+    assert points[99].y.value == 198
+    assert points.pack()[-4:] == b"\x63\x00\xc6\x00"
+    
+    # Notifications are delivered immediately outside of the context
+    points[1].x.value = 0
+    assert container._child_value_changed.call_count == 2
+
+
+def test_packed_cache():
+    point = Struct("point", ("x", unsigned_short), ("y", unsigned_short))
+    line = Struct("line",
+                  ("a", point),
+                  ("b", point),
+                  ("p", Pointer(unsigned_char, pointer_size=8)))
+    l = line()
+    c = unsigned_char()
+    c.address = 0x10
+    l.p.deref = c
+    
+    # No cache should be allocated until the struct is first packed
+    assert l._packed is None
+    
+    # Packing repeatedly should reuse the same packed value
+    packed = l.pack()
+    assert packed == b"\0\0\0\0\0\0\0\0\x10"
+    assert l.pack() is packed
+    assert l.pack(Endianness.big) == packed
+    
+    # Changing a member should only repack the changed path
+    b_packed = l.b.pack()
+    l.a.x.value = 0x1234
+    assert l.b.pack() is b_packed
+    assert l.pack() == b"\x34\x12\0\0\0\0\0\0\x10"
+    assert l.pack(Endianness.big) == b"\x12\x34\0\0\0\0\0\0\x10"
+    
+    # Replacing members, unpacking and moving pointed-to instances should all
+    # invalidate the cache
+    l.b = point(unsigned_short(1))
+    assert l.pack() == b"\x34\x12\0\0\x01\0\0\0\x10"
+    c.address = 0x20
+    assert l.pack() == b"\x34\x12\0\0\x01\0\0\0\x20"
+    l.unpack(b"\x01\0\x02\0\x03\0\x04\0\x20")
+    assert l.pack() == b"\x01\0\x02\0\x03\0\x04\0\x20"
+    
+    # Packing into a buffer should use the cache too (but check the bounds)
+    buffer = bytearray(10)
+    l.pack_into(buffer, 1)
+    assert buffer == b"\0\x01\0\x02\0\x03\0\x04\0\x20"
+    with pytest.raises(struct.error):
+        l.pack_into(buffer, 2)
+    
+    # Uncached structs should be packed directly into the buffer
+    l2 = line()
+    l2.a.y.value = 0x5678
+    buffer = bytearray(10)
+    l2.pack_into(buffer, 1)
+    assert buffer == b"\0\0\0\x78\x56\0\0\0\0\0"
+    assert l2._packed is None
+    assert l2.a._packed is None
+    
+    # Deferred changes should be applied before packing
+    with deferred_updates():
+        l.b.y.value = 0xFFFF
+        assert l.pack() == b"\x01\0\x02\0\x03\0\xFF\xFF\x20"
+
+
 def test_container(container):
     struct_test = Struct("test",
                          ("a", char),
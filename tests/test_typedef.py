@@ -4,10 +4,14 @@ from mock import Mock
 
 from cdata.typedef import Typedef, TypedefInstance
 
-from cdata.primitive import char
+from cdata.primitive import char, unsigned_short
 
 from cdata.pointer import Pointer
 
+from cdata.struct import Struct
+
+from cdata.array import Array
+
 from mock_container import container
 
 def test_typedef():
@@ -115,3 +119,34 @@ def test_multiple_typedef_instances():
     
     assert c0.value == b"0"
     assert c1.value == b"1"
+
+
+def test_shared_instance_class():
+    # All instances of a typedef should share one class which still wraps the
+    # special methods of the base type
+    point_t = Typedef("point_t", Struct("point", ("x", unsigned_short),
+                                        ("y", unsigned_short)))
+    p0 = point_t()
+    p1 = point_t()
+    assert type(p0) is type(p1)
+    assert isinstance(p0, TypedefInstance)
+    
+    ushort2_t = Typedef("ushort2_t", Array(unsigned_short, 2))
+    a = ushort2_t()
+    assert len(a) == 2
+    a[1] = unsigned_short(0x1234)
+    assert a.pack() == b"\0\0\x34\x12"
+    
+    # Arrays of typedef'd structs should work as usual
+    points = Array(point_t, 100)()
+    assert len(set(type(p) for p in points)) == 1
+    points.address = 0x1000
+    points[10].y.value = 0xABCD
+    assert points[10].address == 0x1000 + 40
+    assert points[10].y.address == 0x1000 + 42
+    assert points.pack()[42:44] == b"\xCD\xAB"
+    assert repr(points[10]) == "<point_t: {x: 0, y: 43981}>"
+    
+    # Private attributes should not be forwarded to the base instance
+    with pytest.raises(AttributeError):
+        p0._member_instances
@@ -1,11 +1,21 @@
 import pytest
 
-from mock import Mock
+from mock import Mock, patch
 
-from cdata.union import Union, UnionInstance
+from cdata.union import Union, UnionInstance, TaggedUnion
+
+from cdata.struct import Struct, StructInstance
+
+from cdata.base import deferred_updates
 
 from cdata.primitive import unsigned_char, unsigned_short
 
+from cdata.enum import Enum
+
+from cdata.pointer import Pointer
+
+from cdata.typedef import Typedef
+
 from cdata.endianness import Endianness
 
 from mock_container import container
@@ -38,6 +48,7 @@ def test_union():
     assert t.b.value == 123
     assert t.data_type == union_test
     assert t.size == 2
+    assert union_test.size == 2
     assert t.literal == ("(union test){\n"
                          "    123,\n"
                          "    123\n"
@@ -215,6 +226,21 @@ def test_union_behaviour(endianness, a, b,
             packed_data = t.pack(endianness=endianness)
             with pytest.raises(ValueError):
                 t.unpack(packed_data, endianness=wrong_endianness)
+            
+            buffer = bytearray(2)
+            with pytest.raises(ValueError):
+                t.pack_into(buffer, 0, endianness=wrong_endianness)
+            with pytest.raises(ValueError):
+                t.unpack_from(buffer, 0, endianness=wrong_endianness)
+    
+    # Should be able to pack into/unpack from buffers
+    buffer = bytearray(3)
+    t.pack_into(buffer, 1, endianness)
+    assert buffer[1:] == t.pack(endianness)
+    t2 = union_test()
+    t2.unpack_from(memoryview(buffer), 1, endianness)
+    assert t2.a.value == t.a.value
+    assert t2.b.value == t.b.value
 
 
 def test_container(container):
@@ -264,6 +290,162 @@ def test_container(container):
     assert list(s.iter_instances()) == [container]
 
 
+def test_lazy_members():
+    big = Struct("big", *(("m{}".format(i), unsigned_short)
+                          for i in range(100)))
+    union_test = Union("test",
+                       ("a", big),
+                       ("b", big),
+                       ("c", unsigned_short))
+    u = union_test()
+    
+    # Writing a member shouldn't unpack any of the others...
+    with patch.object(StructInstance, "unpack_from", autospec=True,
+                      side_effect=StructInstance.unpack_from) as unpack_from:
+        for i in range(10):
+            u.c.value = i
+        assert unpack_from.call_count == 0
+        assert u.pack()[:4] == b"\x09\x00\x00\x00"
+        
+        # ...until they're accessed
+        assert u.a.m0.value == 9
+        assert u.a.m0.value == 9
+        assert unpack_from.call_count == 1
+        assert u.b.m1.value == 0
+        assert unpack_from.call_count == 2
+    
+    # Unpacking the union should also be lazy
+    u.unpack(b"\x01\x00" * 100)
+    assert u.c.value == 1
+    assert u.b.m99.value == 1
+    
+    # Everything should be brought up to date when the union is displayed
+    u.c.value = 0xABCD
+    assert str(u).startswith("{a: {m0: 43981, m1: 1,")
+
+def test_tagged_union():
+    kind = Enum("kind", ("KIND_SHORT", None), ("KIND_BYTES", None),
+                ("KIND_POINTER", None))
+    two_bytes = Struct("two_bytes",
+                       ("a", unsigned_char),
+                       ("b", unsigned_char))
+    body = TaggedUnion("body",
+                       ("s", unsigned_short),
+                       ("bytes", two_bytes),
+                       ("p", Pointer(unsigned_char, pointer_size=16)),
+                       tag="kind",
+                       variants={"KIND_SHORT": "s",
+                                 "KIND_BYTES": "bytes",
+                                 "KIND_POINTER": "p"})
+    message = Struct("message", ("kind", kind), ("body", body))
+    
+    m = message(kind.KIND_BYTES)
+    assert m.body.active_member == "bytes"
+    m.body.bytes.a.value = 1
+    m.body.bytes.b.value = 2
+    assert m.pack() == b"\x01\0\0\0\x01\x02"
+    buffer = bytearray(b"\xFF" * 7)
+    m.pack_into(buffer, 1)
+    assert buffer == b"\xFF\x01\0\0\0\x01\x02"
+    
+    # Only the active member should be listed
+    assert str(m.body) == "{bytes: {a: 1, b: 2}}"
+    
+    # Unpacking should decode only the active member
+    with patch.object(StructInstance, "unpack_from", autospec=True,
+                      side_effect=StructInstance.unpack_from) as unpack_from:
+        m.unpack(b"\0\0\0\0\x34\x12")
+        assert m.body.active_member == "s"
+        assert m.body.s.value == 0x1234
+        assert str(m.body) == "{s: 4660}"
+        # (Just the message itself)
+        assert unpack_from.call_count == 1
+    
+    # Only the active member's pointers should be followed
+    m.kind.value = "KIND_POINTER"
+    assert m.body.p.deref is not None
+    assert len(list(m.iter_instances())) == 2
+    m.kind.value = "KIND_SHORT"
+    assert list(m.iter_instances()) == [m]
+    
+    # Typedefs of tagged unions should work
+    body_t = Typedef("body_t", body)
+    message_t = Struct("message_t", ("kind", kind), ("body", body_t))
+    m = message_t(kind.KIND_SHORT, body_t(s=unsigned_short(0xABCD)))
+    assert m.body.active_member == "s"
+    assert m.pack() == b"\0\0\0\0\xCD\xAB"
+    
+    # Without an enclosing struct, all members are used
+    b = body()
+    assert b.active_member is None
+    b.bytes.b.value = 0xFF
+    assert b.pack() == b"\0\xFF"
+    assert str(b) == "{s: 65280, bytes: {a: 0, b: 255}, p: 0}"
+    
+    # The variants must refer to real members
+    with pytest.raises(ValueError):
+        TaggedUnion(("s", unsigned_short), tag="kind", variants={"X": "t"})
+    with pytest.raises(ValueError):
+        TaggedUnion(("active_member", unsigned_short), tag="kind",
+                    variants={})
+
+def test_deferred_updates(container):
+    inner = Struct("inner",
+                   ("a", unsigned_char),
+                   ("b", unsigned_char))
+    union_test = Union("test",
+                       ("s", inner),
+                       ("c", unsigned_short))
+    u = union_test()
+    u._container = container
+    
+    # Within the context the union is only notified once, when the context
+    # exits
+    with deferred_updates():
+        for i in range(100):
+            u.s.a.value = i
+            u.s.b.value = i + 1
+        assert not container._child_value_changed.called
+    container._child_value_changed.assert_called_once_with(u)
+    assert u.pack() == b"\x63\x64"
+    assert u.c.value == 0x6463
+    
+    # Members are brought up to date when accessed via the union
+    with deferred_updates():
+        u.c.value = 0x1234
+        u.s.a.value = 0xFF
+    assert u.s.b.value == 0x12
+    assert u.c.value == 0x12FF
+    
+    # ...but otherwise the most recently changed member wins outright
+    with deferred_updates():
+        s = u.s
+        s.a.value = 0x00
+        u.c.value = 0xABCD
+    assert u.s.a.value == 0xCD
+    with deferred_updates():
+        c = u.c
+        u.s.a.value = 0x00
+        c.value = 0x1234
+        s.b.value = 0xFF
+    assert u.c.value == 0xFF00
+    assert u.s.a.value == 0x00
+    with deferred_updates():
+        u.s.a.value = 0xFF
+        u.c.value = 0x1234
+    assert u.s.a.value == 0x34
+    
+    # Packing a union brings it up to date
+    with deferred_updates():
+        u.c.value = 0xABCD
+        assert u.s.a.value == 0xCD
+        u.s.b.value = 0x00
+        assert u.pack() == b"\xCD\x00"
+        u.s.a.value = 0x11
+        u.unpack(b"\x22\x33")
+    assert u.c.value == 0x3322
+
+
 def test_nested():
     # Ensure that nested unions can be initialised
     union_inner = Union("inner",
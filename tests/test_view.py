@@ -0,0 +1,192 @@
+import pytest
+
+from cdata.view import View, ComplexTypeView, ArrayView
+
+from cdata.struct import Struct
+
+from cdata.union import Union
+
+from cdata.array import Array
+
+from cdata.enum import Enum
+
+from cdata.pointer import Pointer
+
+from cdata.padding import Padding
+
+from cdata.typedef import Typedef
+
+from cdata.primitive import char, unsigned_char, unsigned_short, int
+
+from cdata.endianness import Endianness
+
+my_enum = Enum("my_enum", ("ONE", 1), ("TWO", 2), enum_size=8)
+
+inner = Struct("inner",
+               ("a", unsigned_char),
+               ("b", unsigned_short))
+
+struct_test = Struct("test",
+                     ("a", int),
+                     ("b", Array(char, 3)),
+                     ("c", inner),
+                     ("d", Union(("da", unsigned_char),
+                                 ("db", unsigned_short))),
+                     ("e", my_enum),
+                     ("f", Pointer(char)),
+                     ("g", Padding(2)),
+                     ("h", Array(inner, 2)),
+                     ("i", Typedef("inner_t", inner)))
+
+
+def test_view_read():
+    t = struct_test()
+    t.a.value = -2
+    t.b[1].value = b"J"
+    t.c.b.value = 0x1234
+    t.d.db.value = 0xABCD
+    t.e.value = "TWO"
+    t.f.ref = 0xDEADBEEF
+    t.g.unpack(b"PD")
+    t.h[1].a.value = 0x42
+    t.i.b.value = 0x5678
+    
+    # Check the views correctly interpret values at an offset
+    packed = t.pack()
+    buffer = b"\xFF" + packed
+    v = struct_test.view(buffer, 1)
+    assert isinstance(v, ComplexTypeView)
+    assert isinstance(v, View)
+    assert v._data_type is struct_test
+    assert v._offset == 1
+    assert v._endianness == Endianness.little
+    assert v._size == len(packed)
+    assert v._pack() == packed
+    
+    assert v.a == -2
+    assert isinstance(v.b, ArrayView)
+    assert list(v.b) == [b"\0", b"J", b"\0"]
+    assert isinstance(v.c, ComplexTypeView)
+    assert v.c.a == 0
+    assert v.c.b == 0x1234
+    assert v.d.da == 0xCD
+    assert v.d.db == 0xABCD
+    assert v.e == "TWO"
+    assert v.f == 0xDEADBEEF
+    assert v.g == b"PD"
+    assert v.h[0].a == 0
+    assert v.h[1].a == 0x42
+    assert v.h[-1].a == 0x42
+    assert v.i.b == 0x5678
+    
+    # Should be able to materialise an instance
+    assert v._instance().pack() == packed
+    
+    # Views should respect endianness
+    v_big = inner.view(b"\x00\x12\x34", 0, Endianness.big)
+    assert v_big.b == 0x1234
+    assert v_big._instance().b.value == 0x1234
+    
+    assert str(v.c) == "{a: 0, b: 4660}"
+    assert repr(v.c) == "<struct inner view: {a: 0, b: 4660}>"
+    assert str(v.b) == "[b'\\x00', b'J', b'\\x00']"
+    
+    # Non-existent members/elements should fail
+    with pytest.raises(AttributeError):
+        v.no_exist
+    with pytest.raises(AttributeError):
+        v._no_exist
+    with pytest.raises(IndexError):
+        v.h[2]
+    with pytest.raises(IndexError):
+        v.h[-3]
+
+
+def test_view_write():
+    buffer = bytearray(64)
+    v = struct_test.view(buffer)
+    
+    v.a = -2
+    v.b[1] = b"J"
+    v.c.b = 0x1234
+    v.d.da = 0xAB
+    v.e = "ONE"
+    v.f = 0x1000
+    v.g = b"PD"
+    v.h[-1].b = 0x5678
+    v.i.a = 0xFF
+    
+    # The writes should be visible in an unpacked instance
+    t = struct_test()
+    t.unpack_from(buffer)
+    assert t.a.value == -2
+    assert t.b[1].value == b"J"
+    assert t.c.b.value == 0x1234
+    assert t.d.da.value == 0xAB
+    assert t.e.value == "ONE"
+    assert t.f.ref == 0x1000
+    assert t.g.pack() == b"PD"
+    assert t.h[1].b.value == 0x5678
+    assert t.i.a.value == 0xFF
+    
+    # Values should be cast as for instances
+    v.c.a = 0x1FF
+    assert v.c.a == 0xFF
+    
+    # Should be able to assign instances and views of complex types
+    v.c = inner(unsigned_char(1), unsigned_short(2))
+    assert (v.c.a, v.c.b) == (1, 2)
+    v.h[0] = v.c
+    assert (v.h[0].a, v.h[0].b) == (1, 2)
+    v.i = Typedef("inner_t", inner)()
+    assert (v.i.a, v.i.b) == (0, 0)
+    
+    # Views of other endiannesses are converted when assigned
+    other = bytearray(3)
+    inner.view(other, 0, Endianness.big).b = 0x1234
+    v.c = inner.view(other, 0, Endianness.big)
+    assert v.c.b == 0x1234
+    
+    # Bad values should be rejected
+    with pytest.raises(ValueError):
+        v.e = "THREE"
+    with pytest.raises(ValueError):
+        v.f = 1 << 32
+    with pytest.raises(ValueError):
+        v.g = b"P"
+    with pytest.raises(TypeError):
+        v.c = v.h
+    with pytest.raises(AttributeError):
+        v.no_exist = 123
+    
+    # Read-only buffers can't be written to
+    v = struct_test.view(bytes(buffer))
+    with pytest.raises(TypeError):
+        v.a = 123
+
+
+def test_view_bounds():
+    # Views must fit in the buffer
+    inner.view(bytearray(3))
+    inner.view(bytearray(4), 1)
+    with pytest.raises(ValueError):
+        inner.view(bytearray(2))
+    with pytest.raises(ValueError):
+        inner.view(bytearray(4), 2)
+    with pytest.raises(ValueError):
+        inner.view(bytearray(4), -1)
+
+
+def test_array_view():
+    ushort3 = Array(unsigned_short, 3)
+    buffer = bytearray(b"\x01\x00\x02\x00\x03\x00")
+    
+    v = ushort3.view(memoryview(buffer))
+    assert len(v) == 3
+    assert list(v) == [1, 2, 3]
+    v[-1] = 0x1234
+    assert buffer[4:] == b"\x34\x12"
+    
+    # Typedefs of arrays should be viewable too
+    v = Typedef("ushort3_t", ushort3).view(buffer, 0, Endianness.big)
+    assert list(v) == [0x0100, 0x0200, 0x3412]